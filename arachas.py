@@ -2,29 +2,44 @@
 # -*- coding: utf-8 -*-
 
 import os.path
-import json
+import sys
 import time
+import signal
+import traceback
 import queue
 import threading
-import requests
-import mimetypes
 import argparse
 import re
+import functools
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 from unidecode import unidecode
 
 import gwentifyHandler as siteHandler
 import indexer
+import stats
+import binarySnapshot
+from httpCache import HttpCache
+from httpPool import HttpPool
+from scheduler import AdaptiveScheduler
+from cardWriter import CardWriter
+from tableIndex import TableIndex
+from imageStore import ImageStore
+from journal import Journal
+from supervisor import Supervisor, DeadLetters
+from distributed import WorkQueue
+from history import History
+from parseMemo import ParseMemo
+from textIndex import TextIndex
 
 args = {}
 
 NAME_REPLACE = {" ": "_", ":": "", "'": "", "`": "", "’": "", "(": "", ")": ""}
 
-# URL where we can begin the crawl.
-HOST = 'http://gwentify.com/cards/?view=table'
-
 IMAGE_FOLDER = 'media'
 
+OUTPUT_FOLDER = 'output'
+
 FILE_NAME = 'latest'
 
 DOWNLOAD_ARTWORK = False
@@ -33,21 +48,60 @@ DOWNLOAD_ARTWORK = False
 TIMEOUT = 5.0
 # Number of threads that the program uses.
 THREADS_COUNT = 10
+# Number of times a throttled or failed request is sent again.
+MAX_RETRIES = 5
+# Number of processes parsing the cards. Defaults to one per core.
+PARSE_WORKERS = os.cpu_count() or 1
+
+# Number of seconds between two checks of the results of the workers of the distributed engine.
+POLL_INTERVAL = 0.5
+
+# Maximum number of items waiting in every queue. A stage putting an item in a full queue waits for the next stage,
+# so the memory used doesn't grow with the number of cards.
+QUEUE_SIZE = 1000
 
 # Queue containing the URL of every pages.
-pageQueue = queue.Queue()
+pageQueue = None
 # Queue containing the URL of every cards.
-cardQueue = queue.Queue()
+cardQueue = None
 
 # Queue containing every cards already processed and ready to be saved.
-finalDataQueue = queue.Queue()
+finalDataQueue = None
+
+# Queue containing the name and the URL of every artwork to download, only used with --image.
+imageQueue = None
+
+# Limit of the requests in flight and of the request rate for every host, and retry policy of the failed requests.
+scheduler = None
+
+# Keep-alive connection pool shared by every thread.
+httpPool = None
+# Conditional-GET cache used for the pages and the cards. None when the cache is disabled.
+httpCache = None
+
+# Content-addressed store where the artworks are saved. None when the artworks aren't downloaded.
+imageStore = None
 
-imageQueue = queue.Queue()
+# Fingerprints of the rows of the table view, used with --table-first. None when it's disabled.
+tableIndex = None
 
-# Request headers
-HEADERS = {
-    'User-Agent': 'Mozilla/5.0'
-}
+# Progress of the crawl, used by --resume to continue an interrupted crawl.
+journal = None
+
+# Pages, cards and artworks that failed, saved next to the output.
+deadLetters = None
+
+# In daemon mode, the digests of the cards of the outputs saved last (see CardWriter.digests).
+savedDigests = None
+
+# Cards already parsed, by the hash of the html of their page, or None with --no-parse-memo.
+parseMemo = None
+
+# Telemetry of every stage of the crawl, saved with --stats. New ones are created by every crawl.
+pipelineStats = stats.PipelineStats()
+
+# Crawler of the asyncio engine, kept by every crawl of the daemon. None until the first crawl with this engine.
+asyncCrawler = None
 
 
 # Set the command line parameters.
@@ -55,65 +109,265 @@ def setParser():
     parser = argparse.ArgumentParser(description='This script allows you to crawl different Gwent community website '
                                                  'to parse and save data about the cards.')
     parser.add_argument('-o', '--output', help='Name of the json file that will be saved.', required=False)
+    parser.add_argument('--format', help='With binary, also save a compact binary snapshot of the cards (.bin) '
+                                         'next to the json outputs, see binarySnapshot.py.',
+                        choices=['json', 'binary'], default='json', required=False)
     parser.add_argument('--image', help='Use this argument to download the full size artwork for all cards.',
                         action='store_true', required=False)
+    parser.add_argument('--threads', help='Number of threads downloading the pages, the cards and the artworks.',
+                        type=int, default=THREADS_COUNT, required=False)
+    parser.add_argument('--queue-size', help='Maximum number of pages, cards or artworks waiting between two stages '
+                                             'of the crawl.', type=int, default=QUEUE_SIZE, required=False)
+    parser.add_argument('--parse-workers', help='Number of processes parsing the cards. Use 0 to parse the cards in '
+                                                'the threads downloading them. Not used by the distributed engine.',
+                        type=int, default=PARSE_WORKERS, required=False)
+    parser.add_argument('--pool-size', help='Maximum number of connections kept open to a single host. It\'s also '
+                                            'the most requests in flight to a single host: the crawler adapts the '
+                                            'number of requests in flight to the latency and the errors of the host '
+                                            'up to this limit.',
+                        type=int, default=THREADS_COUNT, required=False)
+    parser.add_argument('--timeout', help='Timeout of every request, in seconds.',
+                        type=float, default=TIMEOUT, required=False)
+    parser.add_argument('--rate', help='Maximum number of requests per second sent to a single host. '
+                                       'By default there is no limit.',
+                        type=float, default=0.0, required=False)
+    parser.add_argument('--burst', help='Number of requests that can be sent at once above the --rate limit after '
+                                        'an idle period.', type=int, default=1, required=False)
+    parser.add_argument('--max-retries', help='Number of times a throttled (429) or failed (5xx or connection error) '
+                                              'request is sent again, with an exponential backoff.',
+                        type=int, default=MAX_RETRIES, required=False)
+    parser.add_argument('--engine', help='Run the crawl with a pool of threads for every stage (default), '
+                                         'with coroutines on a single asyncio event loop, or with distributed.py '
+                                         'workers running on any number of machines.',
+                        choices=['threads', 'asyncio', 'distributed'], default='threads', required=False)
+    parser.add_argument('--queue-path', help='SQLite file of the work queue shared with the workers of the '
+                                             'distributed engine. Defaults to the output path with .queue.db.',
+                        required=False)
+    parser.add_argument('--page-concurrency', help='Maximum number of pages downloaded at the same time by the '
+                                                   'asyncio engine.', type=int, default=THREADS_COUNT, required=False)
+    parser.add_argument('--card-concurrency', help='Maximum number of cards downloaded at the same time by the '
+                                                   'asyncio engine.', type=int, default=THREADS_COUNT, required=False)
+    parser.add_argument('--image-concurrency', help='Maximum number of artworks downloaded at the same time by the '
+                                                    'asyncio engine.', type=int, default=THREADS_COUNT, required=False)
+    parser.add_argument('--parser', help='HTML parser used to extract the data. By default the fastest parser '
+                                         'installed is used.',
+                        choices=['auto'] + siteHandler.PARSERS, default='auto', required=False)
+    parser.add_argument('--proxy', help='URL of an HTTP proxy used for every request, for example a replayServer.py '
+                                        'instance.', required=False)
+    parser.add_argument('--stats', help='Save a report of the queue depths, latencies, parse times, bytes '
+                                        'transferred and worker usage of every stage in this json file.',
+                        required=False)
+    parser.add_argument('--table-first', help='Only download the page of the cards whose row in the table view '
+                                              'changed since the last run. The other cards are reused from the last '
+                                              'output.', action='store_true', required=False)
+    parser.add_argument('--no-history', help='Don\'t save the changes of this run in the history of the cards.',
+                        action='store_true', required=False)
+    parser.add_argument('--no-text-index', help='Don\'t update the full-text index of the info and flavor text of '
+                                                'the cards.', action='store_true', required=False)
+    parser.add_argument('--no-parse-memo', help='Parse every card page again, even when its html is the same as in '
+                                                'a previous crawl.', action='store_true', required=False)
+    parser.add_argument('--parse-memo-size', help='Most megabytes of parsed cards kept in the parse memo. The least '
+                                                  'recently used cards are evicted first.', type=float, default=100,
+                        required=False)
+    parser.add_argument('--no-cache', help='Use this argument to ignore the HTTP cache and download every page again.',
+                        action='store_true', required=False)
+    parser.add_argument('--deadline', help='Maximum duration of the crawl in seconds. The work left when it\'s '
+                                           'reached is reported as failed, the cards already crawled are saved and '
+                                           'the crawl can be continued with --resume.',
+                        type=float, required=False)
+    parser.add_argument('--daemon', help='Stay resident and crawl again every --interval seconds. The connections '
+                                         'and the cards parsed are kept between the crawls, and the outputs and the '
+                                         'index are only saved again when the cards changed.',
+                        action='store_true', required=False)
+    parser.add_argument('--interval', help='Seconds between the start of two crawls in daemon mode.',
+                        type=float, default=3600.0, required=False)
+    parser.add_argument('--resume', help='Continue the last crawl if it was interrupted. The pages, cards and '
+                                         'artworks it already crawled are not downloaded again.',
+                        action='store_true', required=False)
 
     global args
     args = parser.parse_args()
 
 
 # Class responsible for processing the URL of a page and obtaining the URL of every cards on the page.
+# With --table-first, the cards whose row didn't change are sent directly to the finalDataQueue.
+# The rows of the page are recorded in the journal once they are all queued.
 class ThreadPage(threading.Thread):
-    def __init__(self, pageQueue, cardQueue):
+    def __init__(self, pageQueue, cardQueue, finalDataQueue, imageQueue):
         threading.Thread.__init__(self)
         self.pageQueue = pageQueue
         self.cardQueue = cardQueue
+        self.finalDataQueue = finalDataQueue
+        self.imageQueue = imageQueue
 
     def run(self):
         while True:
+            waitStart = time.perf_counter()
             url = self.pageQueue.get()
-            res = requests.get(url, headers=HEADERS, timeout=TIMEOUT)
-
-            if res.status_code == 200:
-                # Send the html to the siteHandler module for processing.
-                # Return a list of URL where every URL is the URL for a card.
-                listCards = siteHandler.getCardsUrl(res.content)
-                # Add all entry of listCards in the cardQueue.
-                list(map(self.cardQueue.put, listCards))
-            else:
-                print("Error")
-            # Notify that we have finished one task.
-            self.pageQueue.task_done()
+            if url is None:
+                # Stopped by the Supervisor.
+                self.pageQueue.task_done()
+                return
+            start = time.perf_counter()
+
+            try:
+                self.process(url)
+            except Exception:
+                deadLetters.add('pages', url)
+            finally:
+                pipelineStats.addWorkerTime('pages', time.perf_counter() - start, start - waitStart)
+                # Notify that we have finished one task.
+                self.pageQueue.task_done()
+
+    def process(self, url):
+        res = fetch(url, 'pages')
+
+        if res.status_code == 200:
+            # Send the html to the siteHandler module for processing.
+            # Return the rows of the table, with the URL of every card.
+            rows = siteHandler.getCardRows(res.content)
+            for row in rows:
+                queueRow(row, self.cardQueue, self.finalDataQueue, self.imageQueue)
+            journal.addPage(url, rows)
+        else:
+            deadLetters.add('pages', url, "HTTP %s" % res.status_code)
 
 
 # Class responsible for processing the URL of a card and obtaining all information related to the card.
+# When a parsePool is given, the html is handed to one of its processes and the thread goes back to downloading
+# right away. Otherwise the card is parsed by the thread itself.
 class CardThread(threading.Thread):
-    def __init__(self, cardQueue, finalDataQueue, imageQueue):
+    # parseSlots limits the number of cards handed to the parsePool and not parsed yet.
+    def __init__(self, cardQueue, finalDataQueue, imageQueue, parsePool=None, parseSlots=None):
         threading.Thread.__init__(self)
         self.cardQueue = cardQueue
         self.finalDataQueue = finalDataQueue
         self.imageQueue = imageQueue
+        self.parsePool = parsePool
+        self.parseSlots = parseSlots
 
     def run(self):
         while True:
+            waitStart = time.perf_counter()
             url = self.cardQueue.get()
-            res = requests.get(url, headers=HEADERS, timeout=TIMEOUT)
-
-            if res.status_code == 200:
-                # Send the html to the siteHandler module for processing.
-                # Return a card.
-                cardData = siteHandler.getCardJson(res.content)
-                key = getNameKey(cardData['name'])
-                cardData['key'] = key
-                self.finalDataQueue.put(cardData)
-                self.imageQueue.put((cardData['key'], cardData['variations'][0]['art']['fullsizeImage']))
-                self.imageQueue.put((cardData['key'] + "_thumbnail", cardData['variations'][0]['art']['thumbnailImage']))
-
-            else:
-                print("bad")
+            if url is None:
+                # Stopped by the Supervisor.
+                self.cardQueue.task_done()
+                return
+            start = time.perf_counter()
+            handedOff = False
+
+            try:
+                handedOff = self.process(url)
+            except Exception:
+                deadLetters.add('cards', url)
+            finally:
+                # When the card was handed to the parsePool, the task will be done once the card is parsed.
+                if not handedOff:
+                    # Notify that we have finished one task.
+                    self.cardQueue.task_done()
+                pipelineStats.addWorkerTime('cards', time.perf_counter() - start, start - waitStart)
+
+    # Return True if the card was handed to the parsePool.
+    def process(self, url):
+        res = fetch(url, 'cards')
+
+        if res.status_code != 200:
+            deadLetters.add('cards', url, "HTTP %s" % res.status_code)
+            return False
+
+        # A page with the same html as in a previous crawl isn't parsed again.
+        if parseMemo is not None:
+            cardData = parseMemo.get(res.content)
+            if cardData is not None:
+                self.addCard(url, cardData)
+                return False
+
+        if self.parsePool is None:
+            # Send the html to the siteHandler module for processing.
+            # Return a card.
+            cardData, seconds = stats.timedCall(siteHandler.getCardJson, res.content)
+            pipelineStats.addParse(seconds)
+            if parseMemo is not None:
+                parseMemo.add(res.content, cardData)
+            self.addCard(url, cardData)
+            return False
+
+        # Wait while the parsePool is behind, instead of piling up the html of the cards in memory.
+        self.parseSlots.acquire()
+        try:
+            future = self.parsePool.submit(stats.timedCall, siteHandler.getCardJson, res.content)
+        except Exception:
+            self.parseSlots.release()
+            raise
+        future.add_done_callback(functools.partial(self.onParsed, url, res.content))
+        return True
+
+    # Called with the future of the card of url parsed in the parsePool from content.
+    def onParsed(self, url, content, future):
+        try:
+            cardData, seconds = future.result()
+            pipelineStats.addParse(seconds)
+            if parseMemo is not None:
+                parseMemo.add(content, cardData)
+            self.addCard(url, cardData)
+        except Exception:
+            deadLetters.add('cards', url)
+        finally:
+            self.parseSlots.release()
             # Notify that we have finished one task.
             self.cardQueue.task_done()
 
+    # Add the key to the card parsed from url, record it in the journal and queue it for saving.
+    def addCard(self, url, cardData):
+        key = getNameKey(cardData['name'])
+        cardData['key'] = key
+        if tableIndex is not None:
+            tableIndex.setKey(url, key)
+        journal.addCard(url, cardData)
+        self.finalDataQueue.put(cardData)
+        queueImages(cardData, self.imageQueue)
+
+
+# Class responsible for appending the processed cards to the output as soon as they are ready.
+class WriterThread(threading.Thread):
+    def __init__(self, finalDataQueue, writer):
+        threading.Thread.__init__(self)
+        self.finalDataQueue = finalDataQueue
+        self.writer = writer
+
+    def run(self):
+        while True:
+            cardData = self.finalDataQueue.get()
+            if cardData is None:
+                # Stopped by the Supervisor.
+                self.finalDataQueue.task_done()
+                return
+            try:
+                self.writer.add(cardData)
+            except Exception:
+                deadLetters.add('writer', cardData.get('key'))
+            finally:
+                # Notify that we have finished one task.
+                self.finalDataQueue.task_done()
+
+
+# Send a GET request for the url, going through the HTTP cache when it is enabled.
+# The returned object have at least the status_code and content attributes.
+# stage is the name under which the request is recorded in the pipelineStats.
+def fetch(url, stage):
+    start = time.perf_counter()
+
+    if httpCache is not None:
+        res = httpCache.get(url, headers=siteHandler.HEADERS, timeout=TIMEOUT)
+    else:
+        res = httpPool.get(url, headers=siteHandler.HEADERS, timeout=TIMEOUT)
+
+    # A page reused from the cache isn't transferred again.
+    size = 0 if getattr(res, 'fromCache', False) else len(res.content)
+    pipelineStats.addFetch(stage, time.perf_counter() - start, size)
+    return res
+
 
 # Transform the given name to an url friendly format.
 def getNameKey(name):
@@ -138,58 +392,405 @@ class ImageThread(threading.Thread):
 
     def run(self):
         while True:
+            waitStart = time.perf_counter()
+            item = self.imageQueue.get()
+            if item is None:
+                # Stopped by the Supervisor.
+                self.imageQueue.task_done()
+                return
             # The name will be used for saving the file
-            name, url = self.imageQueue.get()
-            res = requests.get(url, headers=HEADERS, timeout=TIMEOUT, stream=True)
+            name, url = item
+            start = time.perf_counter()
+            size = 0
+
+            try:
+                size = self.process(name, url)
+            except Exception:
+                deadLetters.add('images', url)
+            finally:
+                end = time.perf_counter()
+                pipelineStats.addFetch('images', end - start, size)
+                pipelineStats.addWorkerTime('images', end - start, start - waitStart)
+                # Notify that we have finished one task.
+                self.imageQueue.task_done()
+
+    # Download the artwork. Return the number of bytes downloaded.
+    def process(self, name, url):
+        size = 0
 
-            if res.status_code == 200:
-                content_type = res.headers['content-type']
-                # With the content type received from the web server, use mimetypes to guess the file extension.
-                extension = mimetypes.guess_extension(content_type)
+        while True:
+            # The store adds the validators of the saved artwork, or a range to resume an interrupted download.
+            download = imageStore.start(name, url)
+            headers = dict(siteHandler.HEADERS, **download.headers)
+            res = httpPool.get(url, headers=headers, timeout=TIMEOUT, stream=True)
 
-                filepath = os.path.join('./' + IMAGE_FOLDER + '/' + name + extension)
-                with open(filepath, 'wb') as f:
+            try:
+                if download.handle(res.status_code, res.headers):
                     # Stream the files.
-                    for chunk in res:
-                        f.write(chunk)
-            # Notify that we have finished one task.
-            self.imageQueue.task_done()
+                    for chunk in res.iter_content(64 * 1024):
+                        download.write(chunk)
+                        size += len(chunk)
+                    download.finish()
+            finally:
+                download.close()
+                # Give the connection back to the pool, even if the body wasn't read.
+                res.close()
+
+            # The partial download couldn't be resumed and was dropped: download the whole artwork.
+            if not download.retry:
+                break
+
+        if res.status_code in (200, 206, 304):
+            journal.addImage(name)
+        else:
+            deadLetters.add('images', url, "HTTP %s" % res.status_code)
+        return size
+
+
+# Queue the card of a row of the table view.
+# A card already crawled by an interrupted run isn't crawled again. With --table-first, a card whose row didn't
+# change is sent directly to the finalDataQueue, and its artworks are queued like the artworks of the other cards.
+def queueRow(row, cardQueue, finalDataQueue, imageQueue):
+    key = journal.getCardKey(row['url'])
+    if key is not None:
+        if tableIndex is not None:
+            tableIndex.addRow(row, key)
+        return
+
+    cardData = None
+    if tableIndex is not None:
+        cardData = tableIndex.getUnchangedCard(row)
+
+    if cardData is None:
+        cardQueue.put(row['url'])
+    else:
+        journal.addCard(row['url'], cardData)
+        finalDataQueue.put(cardData)
+        queueImages(cardData, imageQueue)
+
+
+# Queue the artworks of a card, except the ones already downloaded by an interrupted run.
+# Nothing is queued unless the artworks are downloaded.
+def queueImages(cardData, imageQueue):
+    if not DOWNLOAD_ARTWORK:
+        return
+
+    art = cardData['variations'][0]['art']
+    for name, url in [(cardData['key'], art['fullsizeImage']), (cardData['key'] + "_thumbnail", art['thumbnailImage'])]:
+        if not journal.hasImage(name):
+            imageQueue.put((name, url))
+
 
 # Function to retrieve a list of URL for every pages of cards.
 # The url parameter is the entry point of the website where we might extract the information.
 def getPages(url):
     listPages = []
 
-    res = requests.get(url, headers=HEADERS, timeout=TIMEOUT)
+    try:
+        res = fetch(url, 'pages')
 
-    if res.status_code == 200:
-        # Process the html and return a list of URL for every available pages.
-        listPages = siteHandler.getPages(res.content)
-        listPages.append(url)
-    else:
-        print("bad")
+        if res.status_code == 200:
+            # Process the html and return a list of URL for every available pages.
+            listPages = siteHandler.getPages(res.content)
+            listPages.append(url)
+        else:
+            deadLetters.add('pages', url, "HTTP %s" % res.status_code)
+    except Exception:
+        deadLetters.add('pages', url)
 
     return listPages
 
 
+# Return the path of the output files, without the extension.
+# The files are saved in the output folder under the path where the script is ran from.
+def getOutputPath(filename):
+    return os.path.join('./' + OUTPUT_FOLDER + '/' + filename)
+
+
 # Save a list of cards in a file in the json format.
 # filename is the name under which the file will be saved.
-# cardList is the list of cards.
-# The file is saved in the same path as where the script is ran from.
+# cardList is the list of cards. The cards are saved sorted by name.
 def saveJson(filename, cardList):
-    filepath = os.path.join('./output/' + filename)
-    print("Saving %s cards to: %s" % (len(cardList), filepath))
-    with open(filepath + ".json", "w", encoding="utf-8", newline="\n") as f:
-        json.dump(cardList, f, ensure_ascii=False, sort_keys=True, indent=2, separators=(',', ': '))
-    with open(filepath + ".jsonl", "w", encoding="utf-8", newline="\n") as f:
-        isFirst = True
-        for card in cardList:
-            if not isFirst:
-                f.write("\n")
+    writer = CardWriter(getOutputPath(filename))
+    for card in cardList:
+        writer.add(card)
+    closeWriter(writer)
+
+
+# Build the final output files of a writer.
+def closeWriter(writer):
+    print("Saving %s cards to: %s" % (writer.count, writer.filepath))
+    writer.close()
+
+
+
+# Run the crawl with the ThreadPage, CardThread and ImageThread pools.
+# Every card is added to the writer. deadline is a time.monotonic() value, or None to wait as long as needed.
+# Return False if the deadline was reached before the end of the crawl.
+def crawlThreads(parsePool, writer, deadline=None):
+    openHttpPool()
+    httpStats = getHttpStats(httpCache, httpPool)
+
+    # Every queue is bounded, so a stage waits for the next one instead of piling up its work in memory.
+    global pageQueue, cardQueue, finalDataQueue, imageQueue
+    pageQueue = queue.Queue(args.queue_size)
+    cardQueue = queue.Queue(args.queue_size)
+    finalDataQueue = queue.Queue(args.queue_size)
+    imageQueue = queue.Queue(args.queue_size)
+
+    pipelineStats.watch('pageQueue', pageQueue.qsize)
+    pipelineStats.watch('cardQueue', cardQueue.qsize)
+    pipelineStats.watch('imageQueue', imageQueue.qsize)
+    pipelineStats.watch('finalDataQueue', finalDataQueue.qsize)
+
+    # Cards handed to the parsePool and not parsed yet, bounded like the queues.
+    parseSlots = threading.BoundedSemaphore(args.queue_size)
+
+    # Restarts the threads that die, waits for the queues and stops the threads.
+    # Every stage is started before the stages feeding its queue, so nothing waits on a queue nobody consumes.
+    supervisor = Supervisor()
+
+    try:
+        # Start args.threads number of thread working on downloading the artwork for the cards.
+        if DOWNLOAD_ARTWORK:
+            supervisor.start(lambda: ImageThread(imageQueue), imageQueue, args.threads)
+
+        # Start the thread appending the cards to the output.
+        supervisor.start(lambda: WriterThread(finalDataQueue, writer), finalDataQueue, 1)
+
+        # Start args.threads number of thread working on retrieving card data from card URL.
+        supervisor.start(lambda: CardThread(cardQueue, finalDataQueue, imageQueue, parsePool, parseSlots), cardQueue,
+                         args.threads)
+
+        # Start args.threads number of thread working on retrieving cards URL from a page URL.
+        supervisor.start(lambda: ThreadPage(pageQueue, cardQueue, finalDataQueue, imageQueue), pageQueue, args.threads)
+
+        # The cards crawled by an interrupted run are saved again before any new card is recorded.
+        for cardData in journal.iterCards():
+            finalDataQueue.put(cardData)
+            queueImages(cardData, imageQueue)
+
+        # Retrieve the URL of all pages, unless an interrupted run already did.
+        if journal.pages is None:
+            pages = getPages(siteHandler.HOST)
+            if pages:
+                journal.addPages(pages)
+
+        # Populate the page queue. The rows of the pages done by an interrupted run are queued without downloading
+        # the pages again.
+        for page in journal.pages or []:
+            if page in journal.pageRows:
+                for row in journal.pageRows[page]:
+                    queueRow(row, cardQueue, finalDataQueue, imageQueue)
+            else:
+                pageQueue.put(page)
+
+        # for page in test:
+        #    pageQueue.put(page)
+
+        # Blocks until every queue is finished processing, in the order of the pipeline, or until the deadline.
+        stages = [('pages', pageQueue), ('cards', cardQueue), ('writer', finalDataQueue)]
+        if DOWNLOAD_ARTWORK:
+            stages.append(('images', imageQueue))
+        finished = all(supervisor.join(workQueue, deadline) for stage, workQueue in stages)
+
+        # Past the deadline, the work not started yet is reported as failed. The work in flight is allowed to finish,
+        # so the cards already downloaded are saved, but anything it queues is reported as failed too.
+        while not finished:
+            for stage, workQueue in stages:
+                if stage != 'writer':
+                    drainQueue(stage, workQueue)
+            # Checked often, so the work queued meanwhile is drained before it starts.
+            if all(supervisor.join(workQueue, time.monotonic() + 0.05) for stage, workQueue in stages):
+                break
+    finally:
+        # Every queue is empty unless the crawl was interrupted. Its progress is in the journal anyway.
+        supervisor.stop(discard=True)
+
+    printHttpStats(httpCache, httpPool, httpStats)
+    return finished
+
+
+# Create the pool of connections used by fetch, and the HTTP cache.
+def openHttpPool():
+    # Every thread sends its requests through the same pool of keep-alive connections.
+    # In daemon mode, the pool of the first crawl is kept by the next ones.
+    global httpPool
+    if httpPool is not None:
+        return
+    proxies = None
+    if args.proxy:
+        proxies = {'http': args.proxy, 'https': args.proxy}
+    httpPool = HttpPool(args.pool_size, proxies, scheduler)
+
+    # Reuse the pages saved by the previous runs when the server tells us they didn't change.
+    global httpCache
+    if not args.no_cache:
+        httpCache = HttpCache(httpPool)
+
+
+# Return the counters of the HttpCache and of the connections at the start of a crawl. pool is the HttpPool or the
+# AsyncCrawler. In daemon mode they are kept by every crawl, so the counters of a crawl are the difference.
+def getHttpStats(cache, pool):
+    return (cache.stats() if cache is not None else None), pool.stats()
+
+
+# Print the counters of the HttpCache and of the connections since getHttpStats returned start.
+def printHttpStats(cache, pool, start):
+    cacheStats, poolStats = start
+    if cache is not None:
+        print("HTTP cache: %(hits)s hits, %(misses)s misses" % stats.difference(cache.stats(), cacheStats))
+    poolStats = stats.difference(pool.stats(), poolStats)
+    poolStats['reused'] = max(poolStats['requests'] - poolStats['connections'], 0)
+    print("HTTP pool: %(requests)s requests over %(connections)s connections (%(reused)s reused)" % poolStats)
+
+
+# Empty a queue, recording every item left as failed because of the deadline.
+def drainQueue(stage, workQueue):
+    while True:
+        try:
+            item = workQueue.get_nowait()
+        except queue.Empty:
+            return
+        # The name of an artwork is followed by its URL.
+        deadLetters.add(stage, item[1] if isinstance(item, tuple) else item, "Deadline exceeded")
+        workQueue.task_done()
+
+
+# Run the crawl as coroutines on a single event loop.
+# Same parameters and return value as crawlThreads.
+def crawlAsyncio(parsePool, writer, deadline=None):
+    # Imported here so aiohttp is only needed by the users of the asyncio engine.
+    from asyncEngine import AsyncCrawler
+
+    # In daemon mode, the crawler of the first crawl, with its connections and its cache, is kept by the next ones.
+    global asyncCrawler
+    if asyncCrawler is None:
+        cache = None
+        if not args.no_cache:
+            cache = HttpCache(None)
+        asyncCrawler = AsyncCrawler(siteHandler.HEADERS, TIMEOUT, getNameKey, imageStore, cache=cache,
+                                    poolSize=args.pool_size, pageLimit=args.page_concurrency,
+                                    cardLimit=args.card_concurrency, imageLimit=args.image_concurrency,
+                                    downloadArtwork=DOWNLOAD_ARTWORK, parsePool=parsePool, proxy=args.proxy,
+                                    scheduler=scheduler, queueSize=args.queue_size, parseMemo=parseMemo)
+    asyncCrawler.setCrawl(pipelineStats=pipelineStats, tableIndex=tableIndex, journal=journal,
+                          deadLetters=deadLetters)
+
+    httpStats = getHttpStats(asyncCrawler.cache, asyncCrawler)
+    finished = asyncCrawler.run(siteHandler.HOST, writer, deadline)
+    printHttpStats(asyncCrawler.cache, asyncCrawler, httpStats)
+    return finished
+
+
+# Run the crawl with workers in other processes, started with distributed.py on this machine or any other.
+# The pages are downloaded here and the URL of every card is published in a WorkQueue. The cards parsed by the
+# workers are taken from the queue as they come and added to the writer, and their artworks downloaded here.
+# Same parameters and return value as crawlThreads. The parsePool isn't used: the workers parse the cards.
+def crawlDistributed(parsePool, writer, deadline=None):
+    openHttpPool()
+    httpStats = getHttpStats(httpCache, httpPool)
+
+    queuePath = args.queue_path or getOutputPath(FILE_NAME) + ".queue.db"
+    workQueue = WorkQueue(queuePath)
+    # The cards done by the workers of an interrupted crawl are kept, the failed ones are tried again.
+    # Without a crawl to resume, the queue left by another crawl is emptied.
+    workQueue.reset(journal.resumed)
+
+    global imageQueue
+    imageQueue = queue.Queue(args.queue_size)
+    supervisor = Supervisor()
+    finished = True
+
+    try:
+        if DOWNLOAD_ARTWORK:
+            supervisor.start(lambda: ImageThread(imageQueue), imageQueue, args.threads)
+
+        # The cards themselves are kept in the work queue. The journal only records the pages, so the next crawl
+        # knows there is a crawl to resume.
+        if journal.pages is None:
+            pages = getPages(siteHandler.HOST)
+            if pages:
+                journal.addPages(pages)
+
+        with ThreadPoolExecutor(args.threads) as executor:
+            pageUrls = executor.map(functools.partial(getCardUrls, writer=writer), journal.pages or [])
+            urls = [url for cardUrls in pageUrls for url in cardUrls]
+        workQueue.publish(urls)
+        print("Published %s cards to: %s" % (len(urls), queuePath))
+
+        while True:
+            # Counted first, so the results of the last cards are taken below.
+            unfinished = workQueue.unfinished()
+            for url, cardData, error in workQueue.takeResults():
+                if cardData is None:
+                    deadLetters.add('cards', url, error)
+                    continue
+                cardData['key'] = getNameKey(cardData['name'])
+                if tableIndex is not None:
+                    tableIndex.setKey(url, cardData['key'])
+                writer.add(cardData)
+                queueImages(cardData, imageQueue)
+
+            if not unfinished:
+                break
+            if deadline is not None and time.monotonic() > deadline:
+                for url in workQueue.cancel("Deadline exceeded"):
+                    deadLetters.add('cards', url, "Deadline exceeded")
+                finished = False
+                break
+            time.sleep(POLL_INTERVAL)
+
+        if DOWNLOAD_ARTWORK and not supervisor.join(imageQueue, deadline):
+            drainQueue('images', imageQueue)
+            finished = False
+
+        counts = workQueue.counts()
+        print("Work queue: %s cards done, %s failed" % (counts['done'], counts['failed']))
+        if finished:
+            # Every card was saved, none of them must be given again to the next crawl.
+            workQueue.reset()
+    finally:
+        supervisor.stop(discard=True)
+        workQueue.close()
+
+    printHttpStats(httpCache, httpPool, httpStats)
+    return finished
+
+
+# Download a page of the table view and return the URL of the cards to download.
+# With --table-first, the cards whose row didn't change are added to the writer instead.
+def getCardUrls(url, writer):
+    urls = []
+
+    try:
+        res = fetch(url, 'pages')
+        if res.status_code != 200:
+            deadLetters.add('pages', url, "HTTP %s" % res.status_code)
+            return urls
+
+        for row in siteHandler.getCardRows(res.content):
+            cardData = None
+            if tableIndex is not None:
+                cardData = tableIndex.getUnchangedCard(row)
+
+            if cardData is None:
+                urls.append(row['url'])
             else:
-                isFirst = False
-            json.dump(card, f, ensure_ascii=False, sort_keys=True)
+                writer.add(cardData)
+                queueImages(cardData, imageQueue)
+    except Exception:
+        deadLetters.add('pages', url)
+
+    return urls
+
 
+# Print the retries and the concurrency reached for every host.
+def printSchedulerStats():
+    schedulerStats = scheduler.stats()
+    limits = ", ".join("%s: %s" % item for item in sorted(schedulerStats['limits'].items()))
+    print("Scheduler: %s retries, %s failed requests, requests in flight per host: %s" % (
+        schedulerStats['retries'], schedulerStats['failures'], limits))
 
 
 def main():
@@ -200,55 +801,38 @@ def main():
     if args.image:
         DOWNLOAD_ARTWORK = args.image
 
+    global TIMEOUT
+    TIMEOUT = args.timeout
+
+    # Every request of the crawl goes through the same scheduler, whatever the engine.
+    global scheduler
+    scheduler = AdaptiveScheduler(args.pool_size, args.rate, args.burst, args.max_retries)
+
     # Folder where the artworks are saved.
     imageFolderPath = os.path.join('./' + IMAGE_FOLDER)
 
     if not os.path.exists(imageFolderPath):
         os.makedirs(imageFolderPath)
 
-    # Start THREADS_COUNT number of thread working on retrieving cards URL from a page URL.
-    for i in range(THREADS_COUNT):
-        t = ThreadPage(pageQueue, cardQueue)
-        t.setDaemon(True)
-        t.start()
-
-    # Retrieve the URL of all pages.
-    pages = getPages(HOST)
-
-    # Populate the page queue.
-    for page in pages:
-        pageQueue.put(page)
-
-    # for page in test:
-    #    pageQueue.put(page)
-
-    # Start THREADS_COUNT number of thread working on retrieving card data from card URL.
-    for i in range(THREADS_COUNT):
-        c = CardThread(cardQueue, finalDataQueue, imageQueue)
-        c.setDaemon(True)
-        c.start()
-
-    # Start THREADS_COUNT number of thread working on downloading the artwork for the cards.
+    global imageStore
     if DOWNLOAD_ARTWORK:
-        for i in range(THREADS_COUNT):
-            it = ImageThread(imageQueue)
-            it.setDaemon(True)
-            it.start()
-
-    # Blocks until the queue is finished processing.
-    pageQueue.join()
+        imageStore = ImageStore(imageFolderPath)
 
-    # Blocks until the queue is finished processing.
-    cardQueue.join()
+    # Folder where the json files are saved.
+    outputFolderPath = os.path.join('./' + OUTPUT_FOLDER)
 
-    if DOWNLOAD_ARTWORK:
-        imageQueue.join()
+    if not os.path.exists(outputFolderPath):
+        os.makedirs(outputFolderPath)
 
-    cardList = list(finalDataQueue.queue)
+    siteHandler.setParser(args.parser)
 
-    # Sort the cards in the list by the name of the cards in order to get a predictable output.
-    # Makes it easier to see difference when using a diff tool.
-    cardList = sorted(cardList, key=lambda element: element['name'])
+    # Processes parsing the cards, so the parsing isn't limited to a single core by the GIL.
+    # The parser selected above must also be selected in every process.
+    # The distributed engine doesn't need them: its workers parse the cards.
+    parsePool = None
+    if args.parse_workers > 0 and args.engine != 'distributed':
+        parsePool = ProcessPoolExecutor(args.parse_workers, initializer=siteHandler.setParser,
+                                        initargs=(siteHandler.parserName,))
 
     # Attribute for the default file name used to save the data.
     global FILE_NAME
@@ -257,14 +841,174 @@ def main():
     if args.output:
         FILE_NAME = args.output
 
-    saveJson(FILE_NAME, cardList)
+    # The card pages with the same html as in a previous crawl are taken from the parse memo instead of parsed.
+    global parseMemo
+    if not args.no_parse_memo:
+        parseMemo = ParseMemo(maxSize=int(args.parse_memo_size * 1024 * 1024))
+
+    try:
+        if args.daemon:
+            return runDaemon(parsePool)
+        return crawlOnce(parsePool)
+    finally:
+        if parsePool is not None:
+            parsePool.shutdown()
+        if parseMemo is not None:
+            parseMemo.close()
+        if asyncCrawler is not None:
+            asyncCrawler.close()
+
+
+# Crawl the website and save the outputs. Return False if the deadline was reached before the end of the crawl.
+# In daemon mode, the outputs and the index are only saved when the cards changed since the last crawl.
+def crawlOnce(parsePool):
+    # The cards whose row didn't change are taken from the output of the last run, before it's replaced.
+    global tableIndex
+    if args.table_first:
+        tableIndex = TableIndex(TableIndex.loadCards(getOutputPath(FILE_NAME) + ".jsonl"))
+
+    # The cards are written to the disk as soon as they are parsed.
+    writer = CardWriter(getOutputPath(FILE_NAME))
+
+    # Everything crawled is recorded in the journal until the outputs are saved.
+    global journal
+    journal = Journal(getOutputPath(FILE_NAME) + ".journal", args.resume)
+    if journal.resumed:
+        print("Resuming the last crawl: %s pages and %s cards already done" % (
+            len(journal.pageRows), len(journal.cardKeys)))
+    elif args.resume:
+        print("No crawl to resume, starting a new one")
+
+    # Every failure is recorded instead of stopping the crawl.
+    global deadLetters
+    deadLetters = DeadLetters(getOutputPath(FILE_NAME) + ".failed.jsonl")
+
+    deadline = None
+    if args.deadline:
+        deadline = time.monotonic() + args.deadline
+
+    # In daemon mode, every crawl has its own telemetry.
+    global pipelineStats
+    pipelineStats = stats.PipelineStats()
+    pipelineStats.startSampling()
+    finished = False
+
+    try:
+        if args.engine == 'asyncio':
+            finished = crawlAsyncio(parsePool, writer, deadline)
+        elif args.engine == 'distributed':
+            finished = crawlDistributed(parsePool, writer, deadline)
+        else:
+            finished = crawlThreads(parsePool, writer, deadline)
+    finally:
+        pipelineStats.stopSampling()
+
+    if not finished:
+        print("Deadline of %s seconds reached, the crawl is incomplete" % args.deadline)
+
+    printSchedulerStats()
+
+    if parseMemo is not None:
+        # Save the cards parsed by this crawl, so they are found by the next one even if the process is killed.
+        parseMemo.flush()
+        print("Parse memo: %(hits)s hits, %(misses)s misses, %(evicted)s evicted" % parseMemo.stats())
+
+    # Same cards as the outputs already saved: nothing to save or index.
+    global savedDigests
+    unchanged = finished and savedDigests is not None and writer.digests() == savedDigests
+    if not finished:
+        # The outputs of the last complete crawl are kept, so the readers of the outputs (cardServer.py, --table-first)
+        # never see a partial set of cards. The cards already crawled are in the journal for --resume.
+        print("The outputs are left as they are, the %s cards crawled are kept for --resume" % writer.count)
+        writer.discard()
+    elif unchanged:
+        print("No change in the %s cards, the outputs are left as they are" % writer.count)
+        writer.discard()
+    else:
+        if args.daemon:
+            savedDigests = writer.digests()
+
+        with pipelineStats.timed('saveJson'):
+            closeWriter(writer)
+
+        if args.format == 'binary':
+            with pipelineStats.timed('saveBinary'):
+                print("Saving the binary snapshot to: %s.bin" % writer.filepath)
+                binarySnapshot.save(writer.filepath + ".bin", writer.iterCards())
+
+    # The outputs are complete, the crawl won't need to be resumed. Otherwise the journal is kept for --resume.
+    journal.close(remove=finished)
+
+    if imageStore is not None:
+        imageStore.saveManifest()
+        print("Artworks: %(downloaded)s downloaded, %(resumed)s resumed, %(unchanged)s unchanged, "
+              "%(deduplicated)s deduplicated" % imageStore.stats())
+
+    # The rows of an incomplete crawl would point at cards missing from the outputs kept.
+    if tableIndex is not None and finished:
+        tableIndex.saveIndex()
+        print("Table view: %s cards reused from the last run" % tableIndex.reused)
 
     # Run the indexer to have a gross summary of changes between evert run of the script.
-    indexer.Indexer(cardList)
+    # An incomplete crawl would show the cards left as removed.
+    if finished and not unchanged:
+        with pipelineStats.timed('Indexer'):
+            indexer.Indexer(writer.iterCards())
+
+        # Keep the changes of every run, so the cards can be queried as they were at any run.
+        if not args.no_history:
+            with pipelineStats.timed('history'), History(getOutputPath(FILE_NAME) + ".history.db") as history:
+                run = history.addRun(writer.iterCards())
+            if run is not None:
+                print("Saved run %s in the history" % run)
+
+        # Only the cards whose text changed since the last run are indexed again.
+        if not args.no_text_index:
+            with pipelineStats.timed('textIndex'):
+                textIndex = TextIndex.load(getOutputPath(FILE_NAME) + ".text.json")
+                counts = textIndex.update(writer.iterCards())
+                textIndex.save(getOutputPath(FILE_NAME) + ".text.json")
+            print("Text index: %(added)s added, %(changed)s changed, %(removed)s removed" % counts)
+
+    if args.stats:
+        pipelineStats.save(args.stats)
+
+    deadLetters.close()
+    deadLetters.printReport()
+    return finished
+
+
+# Crawl the website every args.interval seconds until the process is stopped.
+# The connections, the parsePool and the cards parsed by the last crawl are kept between the crawls, and the
+# outputs are only saved again when the cards changed, so a crawl that finds no change is cheap.
+def runDaemon(parsePool):
+    global savedDigests
+    savedDigests = CardWriter.loadDigests(getOutputPath(FILE_NAME))
+
+    # SIGTERM stops the daemon between two crawls.
+    stopEvent = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopEvent.set())
+
+    while not stopEvent.is_set():
+        start = time.monotonic()
+        try:
+            crawlOnce(parsePool)
+        except Exception:
+            # The next crawl might succeed, the daemon keeps running.
+            traceback.print_exc()
+
+        wait = max(args.interval - (time.monotonic() - start), 0)
+        print("Crawl done in %.1f seconds, next crawl in %.1f seconds" % (time.monotonic() - start, wait))
+        stopEvent.wait(wait)
+
+    return True
+
 
 if __name__ == '__main__':
     setParser()
     print("Starting")
     start = time.time()
-    main()
+    finished = main()
     print("Elapsed Time: %s" % (time.time() - start))
+    if not finished:
+        sys.exit(1)
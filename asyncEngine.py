@@ -0,0 +1,392 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import time
+import asyncio
+
+import aiohttp
+
+import gwentifyHandler as siteHandler
+import stats
+from scheduler import AdaptiveScheduler
+
+
+# Run the same pages -> cards -> images pipeline as the ThreadPage, CardThread and ImageThread classes of arachas.py,
+# but as coroutines on a single event loop. A request waiting on the network costs a coroutine instead of a thread.
+# Every stage has its own limit on the number of requests in flight.
+class AsyncCrawler:
+    # keyFunction transforms the name of a card into its key.
+    # imageStore is the ImageStore where the artworks are saved.
+    # cache is an HttpCache used for the pages and the cards, or None to disable it.
+    # parsePool is an executor where the cards are parsed, or None to parse them on the event loop.
+    # proxy is the URL of an HTTP proxy used for every request.
+    # pipelineStats is a stats.PipelineStats recording the telemetry of the crawl.
+    # tableIndex is a TableIndex used to skip the cards whose row didn't change, or None to download every card.
+    # scheduler is the AdaptiveScheduler limiting the requests in flight and retrying the failed ones.
+    # By default, a scheduler allowing up to poolSize requests in flight is used.
+    # journal is the Journal recording the progress of the crawl, or None. The crawl continues from the records of an
+    # interrupted crawl found in the journal.
+    # deadLetters is the DeadLetters where the failures are recorded, or None to only print them.
+    # queueSize is the maximum number of tasks of a stage not finished yet, like the size of the queues of the threads.
+    # A stage scheduling a task waits while the next stage is full.
+    # parseMemo is the ParseMemo where the parsed cards are kept, so the pages already parsed aren't parsed again, or
+    # None to parse every page.
+    def __init__(self, headers, timeout, keyFunction, imageStore, cache=None, poolSize=10,
+                 pageLimit=10, cardLimit=10, imageLimit=10, downloadArtwork=False, parsePool=None, proxy=None,
+                 pipelineStats=None, tableIndex=None, scheduler=None, journal=None, deadLetters=None, queueSize=1000,
+                 parseMemo=None):
+        self.headers = headers
+        self.timeout = timeout
+        self.keyFunction = keyFunction
+        self.imageStore = imageStore
+        self.cache = cache
+        self.poolSize = poolSize
+        self.pageLimit = pageLimit
+        self.cardLimit = cardLimit
+        self.imageLimit = imageLimit
+        self.downloadArtwork = downloadArtwork
+        self.parsePool = parsePool
+        self.proxy = proxy
+        self.pipelineStats = pipelineStats or stats.PipelineStats()
+        self.tableIndex = tableIndex
+        self.scheduler = scheduler or AdaptiveScheduler(poolSize)
+        self.journal = journal
+        self.deadLetters = deadLetters
+        self.queueSize = queueSize
+        self.parseMemo = parseMemo
+
+        self.writer = None
+        # Number of requests sent and connections opened, reported the same way as HttpPool.stats.
+        self.requestsCount = 0
+        self.connectionsCount = 0
+
+        # The event loop and the session are kept by every run, so the connections of a crawl are reused by the next
+        # ones in daemon mode. They are released by close.
+        self.loop = None
+        self.session = None
+
+    # Crawl every card reachable from host. Every card is added to writer, a CardWriter.
+    # deadline is a time.monotonic() value, or None to wait as long as needed.
+    # Return False if the deadline was reached before the end of the crawl.
+    def run(self, host, writer, deadline=None):
+        self.writer = writer
+        if self.loop is None:
+            self.loop = asyncio.new_event_loop()
+        return self.loop.run_until_complete(self.crawl(host, deadline))
+
+    # Set the objects of a new crawl, the same as the parameters of __init__, so a crawler and its connections are
+    # kept by every crawl of the daemon.
+    def setCrawl(self, pipelineStats=None, tableIndex=None, journal=None, deadLetters=None):
+        self.pipelineStats = pipelineStats or stats.PipelineStats()
+        self.tableIndex = tableIndex
+        self.journal = journal
+        self.deadLetters = deadLetters
+
+    # Close the connections and the event loop.
+    def close(self):
+        if self.loop is None:
+            return
+        if self.session is not None:
+            self.loop.run_until_complete(self.session.close())
+            self.session = None
+        self.loop.close()
+        self.loop = None
+
+    # Return a dict with the number of requests sent and connections opened.
+    def stats(self):
+        return {'requests': self.requestsCount, 'connections': self.connectionsCount,
+                'reused': max(self.requestsCount - self.connectionsCount, 0)}
+
+    async def crawl(self, host, deadline=None):
+        # The semaphores are created here so they belong to the running loop.
+        self.pageSemaphore = asyncio.Semaphore(self.pageLimit)
+        self.cardSemaphore = asyncio.Semaphore(self.cardLimit)
+        self.imageSemaphore = asyncio.Semaphore(self.imageLimit)
+        # Stage and item of every task not finished yet, to report them if the deadline is reached.
+        # The pages schedule cards and the cards schedule images.
+        self.taskItems = {}
+        # Number of tasks of every stage not finished yet. It's the equivalent of the queues of the threads.
+        self.pending = {'pages': 0, 'cards': 0, 'images': 0}
+        self.slots = {stage: asyncio.Semaphore(self.queueSize) for stage in self.pending}
+        # Set when no task is left.
+        self.idle = asyncio.Event()
+        self.idle.set()
+
+        self.pipelineStats.watch('pageQueue', lambda: self.pending['pages'])
+        self.pipelineStats.watch('cardQueue', lambda: self.pending['cards'])
+        self.pipelineStats.watch('imageQueue', lambda: self.pending['images'])
+        self.pipelineStats.watch('finalDataQueue', lambda: 0)
+
+        if self.session is None:
+            connector = aiohttp.TCPConnector(limit_per_host=self.poolSize)
+            timeout = aiohttp.ClientTimeout(total=self.timeout)
+            # trust_env makes aiohttp honor the proxy environment variables like requests does.
+            self.session = aiohttp.ClientSession(connector=connector, timeout=timeout, headers=self.headers,
+                                                 trace_configs=[self.traceConfig()], trust_env=True)
+        session = self.session
+
+        if self.journal is None or self.journal.pages is None:
+            pages = await self.getPages(session, host)
+            if self.journal is not None and pages:
+                self.journal.addPages(pages)
+        else:
+            # Same as arachas.crawlThreads: continue the interrupted crawl.
+            pages = self.journal.pages
+            for cardData in self.journal.iterCards():
+                self.writer.add(cardData)
+                await self.scheduleImages(session, cardData)
+
+        for page in pages:
+            if self.journal is not None and page in self.journal.pageRows:
+                for row in self.journal.pageRows[page]:
+                    await self.queueRow(session, row)
+            else:
+                await self.schedule('pages', page, self.processPage, session, page)
+
+        # Wait for every stage to finish. New tasks might be scheduled while we wait.
+        timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+        try:
+            await asyncio.wait_for(self.idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            await self.cancelTasks()
+            return False
+
+        return True
+
+    # Cancel the tasks left, reporting their items as failed.
+    async def cancelTasks(self):
+        while self.taskItems:
+            tasks = list(self.taskItems)
+            for task in tasks:
+                if not task.done():
+                    stage, item = self.taskItems[task]
+                    self.fail(stage, item, "Deadline exceeded")
+                    task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    # Record the failure of an item. When error is None, the exception being handled is recorded.
+    def fail(self, stage, item, error=None):
+        if self.deadLetters is not None:
+            self.deadLetters.add(stage, item, error)
+        else:
+            print("Failed %s: %s (%s)" % (stage, item, error))
+
+    # Run function(*args) as a task of the stage. item is the URL reported if it fails.
+    async def supervise(self, stage, item, function, *args):
+        try:
+            await function(*args)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self.fail(stage, item)
+
+    # Schedule function(*args) as a task of the stage. A failure is recorded with item instead of stopping the crawl.
+    # Wait first while queueSize tasks of the stage are not finished.
+    async def schedule(self, stage, item, function, *args):
+        await self.slots[stage].acquire()
+        self.pending[stage] += 1
+        self.idle.clear()
+        task = asyncio.ensure_future(self.supervise(stage, item, function, *args))
+        self.taskItems[task] = (stage, item)
+        task.add_done_callback(self.onTaskDone)
+
+    def onTaskDone(self, task):
+        stage, item = self.taskItems.pop(task)
+        self.pending[stage] -= 1
+        self.slots[stage].release()
+        if not any(self.pending.values()):
+            self.idle.set()
+
+    # Count the requests and the new connections to measure how many connections were reused.
+    def traceConfig(self):
+        async def onRequestStart(session, context, params):
+            self.requestsCount += 1
+
+        async def onConnectionCreate(session, context, params):
+            self.connectionsCount += 1
+
+        traceConfig = aiohttp.TraceConfig()
+        traceConfig.on_request_start.append(onRequestStart)
+        traceConfig.on_connection_create_end.append(onConnectionCreate)
+        return traceConfig
+
+    # Send a GET request for the url, going through the HTTP cache when it is enabled.
+    # Return a tuple of the status code and the body.
+    # stage is the name under which the request is recorded in the pipelineStats.
+    async def fetch(self, session, url, stage):
+        while True:
+            start = time.perf_counter()
+            headers = None
+            if self.cache is not None:
+                headers = self.cache.requestHeaders(url)
+
+            async with await self.get(session, url, headers) as res:
+                content = await res.read()
+                status = res.status
+
+            self.pipelineStats.addFetch(stage, time.perf_counter() - start, len(content))
+
+            if self.cache is None:
+                return status, content
+            cachedResponse = self.cache.handleResponse(url, status, res.headers, content)
+            if cachedResponse is not None:
+                return cachedResponse.status_code, cachedResponse.content
+            # The body of the cache entry was missing and the entry was dropped: send the request without validators.
+
+    # Send a GET request for the url once the scheduler allows it, and send it again after a backoff if it's
+    # throttled or fails. Return the last response, or raise the last error once the retries are exhausted.
+    # Like HttpPool.get with a scheduler. The response must be released by the caller.
+    async def get(self, session, url, headers=None):
+        attempt = 0
+        while True:
+            await self.scheduler.acquireAsync(url)
+            start = time.perf_counter()
+            try:
+                res = await session.get(url, headers=headers, proxy=self.proxy)
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                self.scheduler.release(url, time.perf_counter() - start, None)
+                delay = self.scheduler.retryDelay(attempt)
+                if delay is None:
+                    raise
+            else:
+                self.scheduler.release(url, time.perf_counter() - start, res.status)
+                delay = None
+                if self.scheduler.shouldRetry(res.status):
+                    delay = self.scheduler.retryDelay(attempt, res.headers.get('Retry-After'))
+                if delay is None:
+                    return res
+                res.release()
+
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    # Same as arachas.getPages.
+    async def getPages(self, session, url):
+        listPages = []
+
+        try:
+            status, content = await self.fetch(session, url, 'pages')
+
+            if status == 200:
+                listPages = siteHandler.getPages(content)
+                listPages.append(url)
+            else:
+                self.fail('pages', url, "HTTP %s" % status)
+        except Exception:
+            self.fail('pages', url)
+
+        return listPages
+
+    # Same as ThreadPage.run for a single page.
+    async def processPage(self, session, url):
+        async with self.pageSemaphore:
+            status, content = await self.fetch(session, url, 'pages')
+
+        if status == 200:
+            rows = siteHandler.getCardRows(content)
+            for row in rows:
+                await self.queueRow(session, row)
+            if self.journal is not None:
+                self.journal.addPage(url, rows)
+        else:
+            self.fail('pages', url, "HTTP %s" % status)
+
+    # Same as arachas.queueRow.
+    async def queueRow(self, session, row):
+        key = self.journal.getCardKey(row['url']) if self.journal is not None else None
+        if key is not None:
+            if self.tableIndex is not None:
+                self.tableIndex.addRow(row, key)
+            return
+
+        cardData = None
+        if self.tableIndex is not None:
+            cardData = self.tableIndex.getUnchangedCard(row)
+
+        if cardData is None:
+            await self.schedule('cards', row['url'], self.processCard, session, row['url'])
+        else:
+            if self.journal is not None:
+                self.journal.addCard(row['url'], cardData)
+            self.writer.add(cardData)
+            await self.scheduleImages(session, cardData)
+
+    # Same as CardThread.run for a single card.
+    async def processCard(self, session, url):
+        async with self.cardSemaphore:
+            status, content = await self.fetch(session, url, 'cards')
+
+        if status == 200:
+            cardData = await self.parseCard(content)
+            cardData['key'] = self.keyFunction(cardData['name'])
+            if self.tableIndex is not None:
+                self.tableIndex.setKey(url, cardData['key'])
+            if self.journal is not None:
+                self.journal.addCard(url, cardData)
+            self.writer.add(cardData)
+            await self.scheduleImages(session, cardData)
+        else:
+            self.fail('cards', url, "HTTP %s" % status)
+
+    # Same as arachas.queueImages.
+    async def scheduleImages(self, session, cardData):
+        if not self.downloadArtwork:
+            return
+
+        art = cardData['variations'][0]['art']
+        for name, url in [(cardData['key'], art['fullsizeImage']),
+                          (cardData['key'] + "_thumbnail", art['thumbnailImage'])]:
+            if self.journal is None or not self.journal.hasImage(name):
+                await self.schedule('images', url, self.processImage, session, name, url)
+
+    # Parse the card in the parsePool if there is one, so the event loop keeps running in the meantime.
+    async def parseCard(self, content):
+        if self.parseMemo is not None:
+            cardData = self.parseMemo.get(content)
+            if cardData is not None:
+                return cardData
+
+        if self.parsePool is None:
+            cardData, seconds = stats.timedCall(siteHandler.getCardJson, content)
+        else:
+            loop = asyncio.get_event_loop()
+            cardData, seconds = await loop.run_in_executor(self.parsePool, stats.timedCall, siteHandler.getCardJson,
+                                                           content)
+
+        self.pipelineStats.addParse(seconds)
+        if self.parseMemo is not None:
+            self.parseMemo.add(content, cardData)
+        return cardData
+
+    # Same as ImageThread.run for a single artwork.
+    async def processImage(self, session, name, url):
+        async with self.imageSemaphore:
+            start = time.perf_counter()
+            size = 0
+
+            while True:
+                # The store adds the validators of the saved artwork, or a range to resume an interrupted download.
+                download = self.imageStore.start(name, url)
+
+                try:
+                    async with await self.get(session, url, download.headers) as res:
+                        status = res.status
+                        if download.handle(res.status, res.headers):
+                            # Stream the files.
+                            async for chunk in res.content.iter_chunked(64 * 1024):
+                                download.write(chunk)
+                                size += len(chunk)
+                            download.finish()
+                finally:
+                    download.close()
+
+                # The partial download couldn't be resumed and was dropped: download the whole artwork.
+                if not download.retry:
+                    break
+
+            if status not in (200, 206, 304):
+                self.fail('images', url, "HTTP %s" % status)
+            elif self.journal is not None:
+                self.journal.addImage(name)
+
+            self.pipelineStats.addFetch('images', time.perf_counter() - start, size)
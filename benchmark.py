@@ -0,0 +1,234 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import os.path
+import sys
+import json
+import time
+import shlex
+import shutil
+import argparse
+import tempfile
+import threading
+import contextlib
+import subprocess
+
+# Not available on Windows. The peak memory isn't reported there.
+try:
+    import resource
+except ImportError:
+    resource = None
+
+import arachas
+import indexer
+import gwentifyHandler as siteHandler
+from corpus import Corpus
+from replayServer import ReplayServer
+
+# Path of the crawler script, started in a subprocess for the end to end benchmark.
+SCRIPT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'arachas.py')
+
+# Columns of the printed report.
+COLUMNS = ['stage', 'count', 'seconds', 'perSecond', 'p50Ms', 'p99Ms', 'peakRssMb']
+
+
+# Return the value found at percent of the values.
+def percentile(values, percent):
+    if not values:
+        return 0.0
+
+    values = sorted(values)
+    return values[int(round(percent / 100.0 * (len(values) - 1)))]
+
+
+# Return the peak memory in MB of this process, or of its biggest finished child when children is True.
+def peakMemory(children=False):
+    if resource is None:
+        return None
+
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes everywhere else.
+    if sys.platform == 'darwin':
+        usage /= 1024.0
+    return usage / 1024.0
+
+
+# Build the result of a benchmark. latencies are in seconds.
+def makeResult(stage, count, seconds, latencies, memory):
+    return {
+        'stage': stage,
+        'count': count,
+        'seconds': seconds,
+        'perSecond': count / seconds if seconds else 0.0,
+        'p50Ms': percentile(latencies, 50) * 1000,
+        'p99Ms': percentile(latencies, 99) * 1000,
+        'peakRssMb': memory
+    }
+
+
+# Call function with every item and measure the time of every call.
+# Return a tuple of the result of the benchmark and the list of values returned by function.
+def benchmarkStage(stage, function, items):
+    latencies = []
+    values = []
+
+    start = time.perf_counter()
+    for item in items:
+        callStart = time.perf_counter()
+        values.append(function(item))
+        latencies.append(time.perf_counter() - callStart)
+    seconds = time.perf_counter() - start
+
+    return makeResult(stage, len(items), seconds, latencies, peakMemory()), values
+
+
+# Run every stage of the crawler in this process on the bodies found in the corpus.
+# Every body is processed repeat times. The stages writing files run in workFolder.
+def benchmarkStages(corpus, workFolder, repeat):
+    results = []
+
+    # The listing pages are the entry point of the crawl and every page matching the paging pattern.
+    listingUrls = [url for url in corpus.urls('text/html')
+                   if url == siteHandler.HOST or siteHandler.pageRegex.match(url)]
+    cardUrls = [url for url in corpus.urls('text/html') if url not in listingUrls]
+
+    entryPoint = corpus.get(siteHandler.HOST)[2]
+    listings = [corpus.get(url)[2] for url in listingUrls] * repeat
+    cardPages = [corpus.get(url)[2] for url in cardUrls] * repeat
+
+    result, values = benchmarkStage('getPages', siteHandler.getPages, [entryPoint] * repeat)
+    results.append(result)
+
+    result, values = benchmarkStage('getCardsUrl', siteHandler.getCardsUrl, listings)
+    results.append(result)
+
+    result, cardList = benchmarkStage('getCardJson', siteHandler.getCardJson, cardPages)
+    results.append(result)
+
+    for cardData in cardList:
+        cardData['key'] = arachas.getNameKey(cardData['name'])
+    cardList = cardList[:len(cardUrls)]
+
+    # saveJson and Indexer use paths relative to the current directory and print a summary.
+    currentFolder = os.getcwd()
+    os.chdir(workFolder)
+    try:
+        os.makedirs(arachas.OUTPUT_FOLDER, exist_ok=True)
+        with contextlib.redirect_stdout(open(os.devnull, 'w')):
+            result, values = benchmarkStage('saveJson', lambda cards: arachas.saveJson(arachas.FILE_NAME, cards),
+                                            [cardList] * repeat)
+            results.append(result)
+
+            result, values = benchmarkStage('Indexer', indexer.Indexer, [cardList] * repeat)
+            results.append(result)
+    finally:
+        os.chdir(currentFolder)
+
+    return results
+
+
+# Run arachas.py from start to end against the replay server.
+# The latencies are the time taken by the server to answer every request, including the simulated latency.
+def benchmarkCrawl(server, workFolder, crawlerArgs):
+    proxy = 'http://%s:%s' % server.server_address
+    command = [sys.executable, SCRIPT_PATH, '--proxy', proxy, '--no-cache'] + crawlerArgs
+
+    start = time.perf_counter()
+    subprocess.run(command, cwd=workFolder, stdout=subprocess.DEVNULL, check=True)
+    seconds = time.perf_counter() - start
+
+    with open(os.path.join(workFolder, arachas.OUTPUT_FOLDER, arachas.FILE_NAME + '.json'), 'r',
+              encoding='utf-8') as f:
+        count = len(json.load(f))
+
+    return makeResult('arachas.main', count, seconds, list(server.requestTimes), peakMemory(children=True))
+
+
+# Print the results as a table. When baseline results are given, also print the change of throughput.
+def printResults(results, baseline=None):
+    baselineMap = {result['stage']: result for result in baseline or []}
+
+    print(("{:<14}{:>8}{:>10}{:>12}{:>10}{:>10}{:>13}" + ("{:>10}" if baseline else "")).format(
+        *(COLUMNS + (['change'] if baseline else []))))
+
+    for result in results:
+        memory = result['peakRssMb']
+        line = "{:<14}{:>8}{:>10.3f}{:>12.1f}{:>10.2f}{:>10.2f}{:>13}".format(
+            result['stage'], result['count'], result['seconds'], result['perSecond'], result['p50Ms'],
+            result['p99Ms'], "%.1f" % memory if memory is not None else "n/a")
+
+        if result['stage'] in baselineMap:
+            line += "{:>+9.1f}%".format(getChange(result, baselineMap[result['stage']]) * 100)
+        print(line)
+
+
+# Return the relative change of throughput against the baseline. Negative when slower.
+def getChange(result, baselineResult):
+    if not baselineResult['perSecond']:
+        return 0.0
+    return result['perSecond'] / baselineResult['perSecond'] - 1
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure the throughput of the crawler against a recorded corpus, '
+                                                 'from start to end and for every stage.')
+    parser.add_argument('corpus', help='Folder of a corpus recorded with replayServer.py --record.')
+    parser.add_argument('--latency', help='Simulated latency of every response, in seconds.',
+                        type=float, default=0.0, required=False)
+    parser.add_argument('--jitter', help='Random variation of the latency, in seconds.',
+                        type=float, default=0.0, required=False)
+    parser.add_argument('--repeat', help='Number of times every stage processes the corpus.',
+                        type=int, default=1, required=False)
+    parser.add_argument('--parser', help='HTML parser used by the stages.',
+                        choices=['auto'] + siteHandler.PARSERS, default='auto', required=False)
+    parser.add_argument('--crawler-args', help='Arguments given to arachas.py, for example "--engine asyncio".',
+                        default='', required=False)
+    parser.add_argument('--skip-crawl', help='Only run the stages.', action='store_true', required=False)
+    parser.add_argument('--skip-stages', help='Only run the crawl from start to end.',
+                        action='store_true', required=False)
+    parser.add_argument('--save', help='Save the results in this json file.', required=False)
+    parser.add_argument('--baseline', help='Compare with the results saved by a previous run.', required=False)
+    parser.add_argument('--tolerance', help='Exit with an error if a stage is slower than the baseline by more than '
+                                            'this fraction.', type=float, default=0.1, required=False)
+    args = parser.parse_args()
+
+    corpus = Corpus(args.corpus)
+    siteHandler.setParser(args.parser)
+    results = []
+    workFolder = tempfile.mkdtemp(prefix='arachas-benchmark-')
+
+    try:
+        # The crawl runs first, so the peak memory of its process isn't hidden by another child.
+        if not args.skip_crawl:
+            server = ReplayServer(('127.0.0.1', 0), corpus, args.latency, args.jitter)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            try:
+                results.append(benchmarkCrawl(server, workFolder, shlex.split(args.crawler_args)))
+            finally:
+                server.shutdown()
+                server.server_close()
+
+        if not args.skip_stages:
+            results += benchmarkStages(corpus, workFolder, args.repeat)
+    finally:
+        shutil.rmtree(workFolder, ignore_errors=True)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+
+    printResults(results, baseline)
+
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8', newline='\n') as f:
+            json.dump(results, f, sort_keys=True, indent=2, separators=(',', ': '))
+
+    if baseline:
+        baselineMap = {result['stage']: result for result in baseline}
+        regressions = [result['stage'] for result in results
+                       if result['stage'] in baselineMap
+                       and getChange(result, baselineMap[result['stage']]) < -args.tolerance]
+        if regressions:
+            print("Slower than the baseline: %s" % ", ".join(regressions))
+            sys.exit(1)
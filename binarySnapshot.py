@@ -0,0 +1,331 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import json
+import array
+import struct
+import argparse
+
+# Compact binary snapshot of the cards, saved next to the json outputs with --format binary.
+#
+# Every string (names, factions, categories, rarities, URLs...) is stored once in a string table and the cards refer
+# to it by index. The other values are stored in fixed-width columns, one value per card or per variation:
+#     header        MAGIC, VERSION, number of strings, number of columns
+#     strings       length of every string in characters (uint32), then the size in bytes and the utf-8 bytes of
+#                   every string one after another
+#     columns       for every column: name, type code, number of values, then the values (little-endian)
+# A list field (categories, positions, loyalty) is a column with the number of values of every card (-1 when the
+# card doesn't have the field) and a column with the values of every card one after another.
+# The fields that aren't part of the columns are kept as json in the extra column, so nothing is lost.
+MAGIC = b"ARCB"
+VERSION = 1
+
+# Index of a missing string and value of a missing number.
+NONE = 0xFFFFFFFF
+MISSING = -2 ** 31
+
+CARD_STRINGS = ['name', 'key', 'faction', 'type', 'info', 'flavor']
+CARD_NUMBERS = ['strength']
+CARD_LISTS = ['categories', 'positions', 'loyalty']
+# Every column of the variations, with the path of its value in the variation.
+VARIATION_STRINGS = {
+    'rarity': ('rarity',),
+    'availability': ('availability',),
+    'fullsizeImage': ('art', 'fullsizeImage'),
+    'thumbnailImage': ('art', 'thumbnailImage')
+}
+VARIATION_NUMBERS = {
+    'craftNormal': ('craft', 'normal'),
+    'craftPremium': ('craft', 'premium'),
+    'millNormal': ('mill', 'normal'),
+    'millPremium': ('mill', 'premium')
+}
+CARD_FIELDS = set(CARD_STRINGS + CARD_NUMBERS + CARD_LISTS + ['variations'])
+VARIATION_FIELDS = {'rarity', 'availability', 'art', 'craft', 'mill'}
+
+
+# Return the array type code of an unsigned (typecode 'I') or signed ('i') integer of 4 bytes on this platform.
+def getTypecode(signed):
+    for typecode in (['i', 'l'] if signed else ['I', 'L']):
+        if array.array(typecode).itemsize == 4:
+            return typecode
+    raise RuntimeError("No 4 bytes integer array on this platform")
+
+
+UINT32 = getTypecode(False)
+INT32 = getTypecode(True)
+
+
+# Lightweight card loaded from a snapshot. The list fields are None when the card doesn't have them.
+class Card:
+    __slots__ = CARD_STRINGS + CARD_NUMBERS + CARD_LISTS + ['variations', 'extra']
+
+    def __init__(self, name, key, faction, type, info, flavor, strength, categories, positions, loyalty, variations,
+                 extra):
+        self.name = name
+        self.key = key
+        self.faction = faction
+        self.type = type
+        self.info = info
+        self.flavor = flavor
+        self.strength = strength
+        self.categories = categories
+        self.positions = positions
+        self.loyalty = loyalty
+        self.variations = variations
+        self.extra = extra
+
+    # Return the card as a dict, the same as in the json outputs.
+    def toDict(self):
+        card = dict(self.extra) if self.extra else {}
+        for field in CARD_STRINGS + CARD_NUMBERS + CARD_LISTS:
+            value = getattr(self, field)
+            if value is not None:
+                card[field] = value
+        card['variations'] = [variation.toDict() for variation in self.variations]
+        return card
+
+
+# Lightweight variation of a card loaded from a snapshot.
+class Variation:
+    __slots__ = list(VARIATION_STRINGS) + list(VARIATION_NUMBERS) + ['extra']
+
+    def __init__(self, rarity, availability, fullsizeImage, thumbnailImage, craftNormal, craftPremium, millNormal,
+                 millPremium, extra):
+        self.rarity = rarity
+        self.availability = availability
+        self.fullsizeImage = fullsizeImage
+        self.thumbnailImage = thumbnailImage
+        self.craftNormal = craftNormal
+        self.craftPremium = craftPremium
+        self.millNormal = millNormal
+        self.millPremium = millPremium
+        self.extra = extra
+
+    def toDict(self):
+        variation = dict(self.extra) if self.extra else {}
+        for field, path in list(VARIATION_STRINGS.items()) + list(VARIATION_NUMBERS.items()):
+            value = getattr(self, field)
+            if value is not None:
+                setPath(variation, path, value)
+        return variation
+
+
+def getPath(value, path):
+    for name in path:
+        if not isinstance(value, dict) or name not in value:
+            return None
+        value = value[name]
+    return value
+
+
+def setPath(value, path, item):
+    for name in path[:-1]:
+        value = value.setdefault(name, {})
+    value[path[-1]] = item
+
+
+# Save the cards in a snapshot at filepath. The file is replaced in a single step.
+def save(filepath, cards):
+    strings = []
+    stringIds = {}
+
+    def intern(value):
+        if value is None:
+            return NONE
+        stringId = stringIds.get(value)
+        if stringId is None:
+            stringId = stringIds[value] = len(strings)
+            strings.append(value)
+        return stringId
+
+    def getExtra(value, fields):
+        extra = {name: item for name, item in value.items() if name not in fields}
+        return intern(json.dumps(extra, ensure_ascii=False, sort_keys=True)) if extra else NONE
+
+    columns = {}
+
+    def column(name, typecode):
+        if name not in columns:
+            columns[name] = array.array(typecode)
+        return columns[name]
+
+    for field in CARD_STRINGS + ['extra', 'variationCount']:
+        column(field, UINT32)
+    for field in CARD_NUMBERS:
+        column(field, INT32)
+    for field in CARD_LISTS:
+        column(field + 'Count', INT32)
+        column(field + 'Items', UINT32)
+    for field in list(VARIATION_STRINGS) + ['variationExtra']:
+        column(field, UINT32)
+    for field in VARIATION_NUMBERS:
+        column(field, INT32)
+
+    for card in cards:
+        for field in CARD_STRINGS:
+            columns[field].append(intern(card.get(field)))
+        for field in CARD_NUMBERS:
+            columns[field].append(card.get(field, MISSING))
+        for field in CARD_LISTS:
+            values = card.get(field)
+            columns[field + 'Count'].append(-1 if values is None else len(values))
+            columns[field + 'Items'].extend(intern(value) for value in values or [])
+        columns['extra'].append(getExtra(card, CARD_FIELDS))
+
+        variations = card.get('variations', [])
+        columns['variationCount'].append(len(variations))
+        for variation in variations:
+            for field, path in VARIATION_STRINGS.items():
+                columns[field].append(intern(getPath(variation, path)))
+            for field, path in VARIATION_NUMBERS.items():
+                value = getPath(variation, path)
+                columns[field].append(MISSING if value is None else value)
+            columns['variationExtra'].append(getExtra(variation, VARIATION_FIELDS))
+
+    # The strings are decoded in a single call when loaded, then cut with their lengths in characters.
+    lengths = array.array(UINT32, [len(string) for string in strings])
+    encoded = ''.join(strings).encode('utf-8')
+
+    with open(filepath + '.tmp', 'wb') as f:
+        f.write(MAGIC + struct.pack('<HII', VERSION, len(strings), len(columns)))
+        writeArray(f, lengths)
+        f.write(struct.pack('<I', len(encoded)) + encoded)
+
+        for name, values in sorted(columns.items()):
+            nameBytes = name.encode('ascii')
+            f.write(struct.pack('<B', len(nameBytes)) + nameBytes)
+            f.write(struct.pack('<cI', ('i' if values.typecode == INT32 else 'I').encode('ascii'), len(values)))
+            writeArray(f, values)
+
+    os.replace(filepath + '.tmp', filepath)
+
+
+def writeArray(f, values):
+    if sys.byteorder == 'big':
+        values = array.array(values.typecode, values)
+        values.byteswap()
+    f.write(values.tobytes())
+
+
+# Cards loaded from a snapshot.
+# The columns can be used directly for computations over every card: snapshot.columns['strength'] is an array of
+# the strength of every card (MISSING when it has none), snapshot.columns['faction'] an array of indexes in
+# snapshot.strings. cards() builds the Card objects.
+class Snapshot:
+    def __init__(self, strings, columns):
+        self.strings = strings
+        self.columns = columns
+
+    def __len__(self):
+        return len(self.columns['name'])
+
+    # Return the values of a string column as strings, None when missing.
+    def getStrings(self, name):
+        strings = self.strings
+        return [strings[stringId] if stringId != NONE else None for stringId in self.columns[name]]
+
+    # Return the values of a number column, None when missing.
+    def getNumbers(self, name):
+        return [value if value != MISSING else None for value in self.columns[name]]
+
+    # Return the values of a list field for every card, None when the card doesn't have it.
+    def getLists(self, field):
+        strings = self.strings
+        items = self.columns[field + 'Items']
+        lists = []
+        position = 0
+        for count in self.columns[field + 'Count']:
+            if count < 0:
+                lists.append(None)
+            else:
+                lists.append([strings[stringId] for stringId in items[position:position + count]])
+                position += count
+        return lists
+
+    # Return the extra fields of every card or variation, None when there are none.
+    def getExtras(self, name):
+        # Parsed once and shared by every card with the same extra fields.
+        extras = {}
+        for stringId in set(self.columns[name]):
+            if stringId != NONE:
+                extras[stringId] = json.loads(self.strings[stringId])
+        return [extras.get(stringId) for stringId in self.columns[name]]
+
+    # Build the Card object of every card, in the order they were saved.
+    # The objects are built column by column, without going through the dicts of the json outputs.
+    def cards(self):
+        variationColumns = [self.getStrings(field) for field in VARIATION_STRINGS]
+        variationColumns += [self.getNumbers(field) for field in VARIATION_NUMBERS]
+        variationColumns.append(self.getExtras('variationExtra'))
+        allVariations = list(map(Variation, *variationColumns))
+
+        variations = []
+        position = 0
+        for count in self.columns['variationCount']:
+            variations.append(allVariations[position:position + count])
+            position += count
+
+        cardColumns = [self.getStrings(field) for field in CARD_STRINGS]
+        cardColumns += [self.getNumbers(field) for field in CARD_NUMBERS]
+        cardColumns += [self.getLists(field) for field in CARD_LISTS]
+        cardColumns += [variations, self.getExtras('extra')]
+        return list(map(Card, *cardColumns))
+
+
+# Load a snapshot saved by save.
+def load(filepath):
+    with open(filepath, 'rb') as f:
+        data = f.read()
+
+    if data[:4] != MAGIC:
+        raise ValueError("Not a card snapshot: %s" % filepath)
+    version, stringCount, columnCount = struct.unpack_from('<HII', data, 4)
+    if version != VERSION:
+        raise ValueError("Unsupported snapshot version: %s" % version)
+    offset = 4 + struct.calcsize('<HII')
+
+    lengths, offset = readArray(data, offset, UINT32, stringCount)
+    size, = struct.unpack_from('<I', data, offset)
+    offset += 4
+    text = data[offset:offset + size].decode('utf-8')
+    offset += size
+
+    strings = []
+    position = 0
+    for length in lengths:
+        strings.append(text[position:position + length])
+        position += length
+
+    columns = {}
+    for i in range(columnCount):
+        nameLength = data[offset]
+        name = data[offset + 1:offset + 1 + nameLength].decode('ascii')
+        offset += 1 + nameLength
+        kind, count = struct.unpack_from('<cI', data, offset)
+        offset += struct.calcsize('<cI')
+        columns[name], offset = readArray(data, offset, INT32 if kind == b'i' else UINT32, count)
+
+    return Snapshot(strings, columns)
+
+
+def readArray(data, offset, typecode, count):
+    values = array.array(typecode)
+    end = offset + count * values.itemsize
+    values.frombytes(data[offset:end])
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values, end
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Convert a jsonl output of arachas.py to a binary snapshot.')
+    parser.add_argument('jsonl', help='jsonl output of the crawler.')
+    parser.add_argument('snapshot', help='Path of the binary snapshot.')
+    args = parser.parse_args()
+
+    with open(args.jsonl, 'r', encoding='utf-8') as f:
+        save(args.snapshot, (json.loads(line) for line in f))
+    print("Saved %s cards to: %s" % (len(load(args.snapshot)), args.snapshot))
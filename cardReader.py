@@ -0,0 +1,104 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import os
+import os.path
+import sys
+import json
+import mmap
+import argparse
+
+# Output of the crawler read by default, without the extension.
+DEFAULT_PATH = os.path.join('.', 'output', 'latest')
+
+
+# Read single cards of a jsonl output of the crawler by their key.
+# The jsonl output is memory mapped and only the lines of the requested cards are decoded, using the offsets saved
+# next to it by CardWriter. Opening the reader doesn't parse any card, so it's cheap for short-lived processes.
+# If the offsets are missing or don't match the jsonl output, they are rebuilt by scanning it once.
+#
+#     with CardReader('output/latest') as reader:
+#         reader.get('adrenaline_rush')
+class CardReader:
+    # filepath is the path of the outputs without the extension.
+    def __init__(self, filepath=DEFAULT_PATH):
+        self.filepath = filepath
+        self.file = open(filepath + ".jsonl", "rb")
+        size = os.fstat(self.file.fileno()).st_size
+        # An empty file can't be mapped.
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        self.offsets = self.loadOffsets(size)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __contains__(self, key):
+        return key in self.offsets
+
+    # Return the keys of every card.
+    def keys(self):
+        return self.offsets.keys()
+
+    # Return the card with that key, or None.
+    def get(self, key):
+        position = self.offsets.get(key)
+        if position is None:
+            return None
+
+        offset, length = position
+        return json.loads(self.data[offset:offset + length].decode("utf-8"))
+
+    # Return the cards with those keys, in the order of the jsonl output. The unknown keys are ignored.
+    def getMany(self, keys):
+        positions = sorted(self.offsets[key] for key in set(keys) if key in self.offsets)
+        return [json.loads(self.data[offset:offset + length].decode("utf-8")) for offset, length in positions]
+
+    # Load the offsets saved by CardWriter. Rebuild them if they are missing or were saved for another jsonl output.
+    def loadOffsets(self, size):
+        try:
+            with open(self.filepath + ".offsets.json", "r", encoding="utf-8") as f:
+                saved = json.load(f)
+            if saved['size'] == size:
+                return {key: tuple(position) for key, position in saved['cards'].items()}
+        except (FileNotFoundError, ValueError, KeyError):
+            pass
+
+        offsets = {}
+        offset = 0
+        while offset < size:
+            end = self.data.find(b"\n", offset)
+            if end == -1:
+                end = size
+            key = json.loads(self.data[offset:end].decode("utf-8")).get('key')
+            if key is not None and key not in offsets:
+                offsets[key] = (offset, end - offset)
+            offset = end + 1
+        return offsets
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.file.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Print the cards with the given keys from the output of arachas.py.')
+    parser.add_argument('keys', help='Keys of the cards, as saved in the "key" field.', nargs='+')
+    parser.add_argument('--file', help='Path of the output without the extension.', default=DEFAULT_PATH,
+                        required=False)
+    args = parser.parse_args()
+
+    with CardReader(args.file) as reader:
+        missing = [key for key in args.keys if key not in reader]
+        for card in reader.getMany(args.keys):
+            print(json.dumps(card, ensure_ascii=False, sort_keys=True))
+
+    if missing:
+        print("Unknown keys: %s" % ", ".join(missing), file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,231 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import os
+import os.path
+import sys
+import gzip
+import json
+import time
+import signal
+import hashlib
+import argparse
+import threading
+import collections
+from urllib.parse import urlsplit, parse_qs, unquote
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+
+import indexer
+
+# Output of the crawler served by default.
+DEFAULT_PATH = os.path.join('.', 'output', 'latest.jsonl')
+
+# Fields the list of cards can be filtered on.
+FILTERS = ['faction', 'type']
+
+# A precomputed response. etag is the strong validator of the body, without the quotes.
+Response = collections.namedtuple('Response', ['body', 'gzipBody', 'etag'])
+
+
+# Build a response from a json serializable value. hashes are the content hashes of the cards in the value.
+def makeResponse(value, hashes):
+    body = json.dumps(value, ensure_ascii=False, sort_keys=True).encode('utf-8')
+    etag = hashes[0] if len(hashes) == 1 else hashlib.sha1(" ".join(hashes).encode('ascii')).hexdigest()
+    return Response(body, gzip.compress(body), etag)
+
+
+# Every response of the API for one output of the crawler, serialized and compressed once when it's loaded.
+# The ETag of a card is the hash of its content computed like the indexer. The ETag of a list is the hash of the
+# hashes of its cards, so it changes as soon as one of them changes.
+class CardData:
+    def __init__(self, cards):
+        cards = list(cards)
+        hashes = [indexer.hashValue(card) for card in cards]
+
+        self.cards = makeResponse(cards, hashes)
+        self.byKey = {}
+        # Every filter and combination of filters, by the tuple of the lowercased values of FILTERS (None when unset).
+        self.filtered = {}
+
+        groups = {}
+        for card, cardHash in zip(cards, hashes):
+            if 'key' in card:
+                self.byKey[card['key']] = makeResponse(card, [cardHash])
+
+            values = [str(card.get(field, '')).lower() for field in FILTERS]
+            # Every subset of the filters this card matches: (faction, None), (None, type) and (faction, type).
+            for mask in range(1, 2 ** len(FILTERS)):
+                combination = tuple(value if mask & (1 << i) else None for i, value in enumerate(values))
+                groups.setdefault(combination, ([], []))
+                groups[combination][0].append(card)
+                groups[combination][1].append(cardHash)
+
+        for combination, (groupCards, groupHashes) in groups.items():
+            self.filtered[combination] = makeResponse(groupCards, groupHashes)
+
+        # The empty list, for the filters no card matches.
+        self.empty = makeResponse([], [])
+
+    # Load the cards of a jsonl output of the crawler.
+    @classmethod
+    def load(cls, filepath):
+        with open(filepath, 'r', encoding='utf-8') as f:
+            return cls([json.loads(line) for line in f])
+
+    # Return the response of the list of cards for the filters, a dict of FILTERS to values.
+    def getList(self, filters):
+        if not filters:
+            return self.cards
+        combination = tuple(filters[field].lower() if field in filters else None for field in FILTERS)
+        return self.filtered.get(combination, self.empty)
+
+
+# Read-only HTTP API over the output of the crawler:
+#     GET /cards                          every card
+#     GET /cards?faction=...&type=...     the cards matching every filter
+#     GET /cards/<key>                    a single card
+# The responses are precomputed, compressed with gzip when the client accepts it, and revalidated with If-None-Match.
+# When a new output is saved by the crawler, the responses are rebuilt in the background and swapped in a single
+# step: a request is always answered from one output or the other, never a mix of both.
+class CardServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    # filepath is the jsonl output of the crawler. It's checked for a new version every interval seconds.
+    def __init__(self, address, filepath=DEFAULT_PATH, interval=1.0):
+        HTTPServer.__init__(self, address, CardHandler)
+        self.filepath = filepath
+        self.interval = interval
+        self.version = self.getVersion()
+        self.data = CardData.load(filepath)
+        self.stopEvent = threading.Event()
+        self.watcher = threading.Thread(target=self.watch, daemon=True)
+
+    def serve_forever(self, *args, **kwargs):
+        self.watcher.start()
+        try:
+            HTTPServer.serve_forever(self, *args, **kwargs)
+        finally:
+            self.stopEvent.set()
+
+    # Identify the version of the output. The crawler replaces the output with a rename, so a new version always
+    # comes with a new modification time or size.
+    def getVersion(self):
+        stat = os.stat(self.filepath)
+        return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+    # Reload the output whenever it changes.
+    def watch(self):
+        while not self.stopEvent.wait(self.interval):
+            try:
+                version = self.getVersion()
+                if version == self.version:
+                    continue
+                data = CardData.load(self.filepath)
+            except (OSError, ValueError) as e:
+                # The output is being replaced or is invalid. Keep serving the last one.
+                print("Unable to reload %s: %s" % (self.filepath, e))
+                continue
+
+            self.data = data
+            self.version = version
+            print("Reloaded %s" % self.filepath)
+
+
+class CardHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.answer(True)
+
+    def do_HEAD(self):
+        self.answer(False)
+
+    def answer(self, withBody):
+        # Every response of a request comes from the same output, even if it's reloaded in the meantime.
+        data = self.server.data
+        url = urlsplit(self.path)
+        parts = [unquote(part) for part in url.path.strip('/').split('/')]
+
+        if parts[0] != 'cards' or len(parts) > 2:
+            self.sendError(404, "Not found", withBody)
+            return
+
+        if len(parts) == 2:
+            response = data.byKey.get(parts[1])
+            if response is None:
+                self.sendError(404, "Unknown card: %s" % parts[1], withBody)
+                return
+        else:
+            query = parse_qs(url.query)
+            unknown = [name for name in query if name not in FILTERS]
+            if unknown:
+                self.sendError(400, "Unknown filter: %s" % ", ".join(unknown), withBody)
+                return
+            response = data.getList({name: values[-1] for name, values in query.items()})
+
+        self.sendResponse(response, withBody)
+
+    def sendResponse(self, response, withBody):
+        useGzip = 'gzip' in self.headers.get('Accept-Encoding', '')
+        # Both encodings are different representations, so they need different strong ETags.
+        etag = '"%s%s"' % (response.etag, '-gzip' if useGzip else '')
+
+        ifNoneMatch = self.headers.get('If-None-Match')
+        if ifNoneMatch and (ifNoneMatch.strip() == '*' or etag in [tag.strip() for tag in ifNoneMatch.split(',')]):
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Vary', 'Accept-Encoding')
+            self.end_headers()
+            return
+
+        body = response.gzipBody if useGzip else response.body
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        if useGzip:
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('ETag', etag)
+        self.send_header('Vary', 'Accept-Encoding')
+        # Clients may keep the response, but must revalidate it.
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if withBody:
+            self.wfile.write(body)
+
+    def sendError(self, status, message, withBody):
+        body = json.dumps({'error': message}, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if withBody:
+            self.wfile.write(body)
+
+    # Don't print a line for every request.
+    def log_message(self, format, *args):
+        pass
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve the cards saved by arachas.py over a read-only HTTP API.')
+    parser.add_argument('--file', help='jsonl output of the crawler.', default=DEFAULT_PATH, required=False)
+    parser.add_argument('--host', help='Address to listen on.', default='127.0.0.1', required=False)
+    parser.add_argument('--port', help='Port to listen on.', type=int, default=8000, required=False)
+    parser.add_argument('--interval', help='Seconds between two checks for a new output.',
+                        type=float, default=1.0, required=False)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    server = CardServer((args.host, args.port), args.file, args.interval)
+    print("Serving %s cards from %s on http://%s:%s (loaded in %.3fs)" % (
+        len(server.data.byKey), args.file, args.host, args.port, time.perf_counter() - start))
+
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,170 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import os.path
+import re
+import json
+import bisect
+import argparse
+
+# Output of the crawler loaded by default.
+DEFAULT_PATH = os.path.join('.', 'output', 'latest.jsonl')
+
+# Fields with an inverted index. Every field maps to a function returning the values of a card for that field.
+# The values are matched without case.
+INVERTED_FIELDS = {
+    'faction': lambda card: [card['faction']] if 'faction' in card else [],
+    'type': lambda card: [card['type']] if 'type' in card else [],
+    'categories': lambda card: card.get('categories', []),
+    'positions': lambda card: card.get('positions', []),
+    'loyalty': lambda card: card.get('loyalty', []),
+    'rarity': lambda card: [variation['rarity'] for variation in card.get('variations', []) if 'rarity' in variation]
+}
+
+# Fields with a sorted index, for the range queries. A card has one value per variation for the costs.
+SORTED_FIELDS = {
+    'strength': lambda card: [card['strength']] if 'strength' in card else [],
+    'craft': lambda card: [variation['craft']['normal'] for variation in card.get('variations', [])],
+    'craftPremium': lambda card: [variation['craft']['premium'] for variation in card.get('variations', [])],
+    'mill': lambda card: [variation['mill']['normal'] for variation in card.get('variations', [])],
+    'millPremium': lambda card: [variation['mill']['premium'] for variation in card.get('variations', [])]
+}
+
+
+# Cards of an output of the crawler, with indexes to answer queries without scanning every card.
+# Every card is identified by its position in the output, so the results keep the order of the output (by name).
+#
+#     store = CardStore.load('output/latest.jsonl')
+#     store.query(faction='Monsters', type='Gold', categories='Relict', strength=(8, None))
+class CardStore:
+    def __init__(self, cards):
+        self.cards = list(cards)
+        self.keys = {card['key']: cardId for cardId, card in enumerate(self.cards)}
+        # For every inverted field, the set of the cards having every value.
+        self.inverted = {field: {} for field in INVERTED_FIELDS}
+        # Spelling of every value of the inverted fields, as found in the cards.
+        self.labels = {field: {} for field in INVERTED_FIELDS}
+        # For every sorted field, the sorted list of (value, card) pairs and the list of the values alone for bisect.
+        self.sorted = {}
+
+        for cardId, card in enumerate(self.cards):
+            for field, getValues in INVERTED_FIELDS.items():
+                for value in getValues(card):
+                    self.inverted[field].setdefault(value.lower(), set()).add(cardId)
+                    self.labels[field].setdefault(value.lower(), value)
+
+        for field, getValues in SORTED_FIELDS.items():
+            pairs = sorted((value, cardId) for cardId, card in enumerate(self.cards) for value in getValues(card))
+            self.sorted[field] = (pairs, [value for value, cardId in pairs])
+
+    # Load the cards of a jsonl output of the crawler.
+    @classmethod
+    def load(cls, filepath=DEFAULT_PATH):
+        with open(filepath, 'r', encoding='utf-8') as f:
+            return cls(json.loads(line) for line in f)
+
+    def __len__(self):
+        return len(self.cards)
+
+    # Return the card with that key, or None.
+    def get(self, key):
+        cardId = self.keys.get(key)
+        return self.cards[cardId] if cardId is not None else None
+
+    # Return the values of an inverted field with the number of cards having them, or the lowest and highest value
+    # of a sorted field.
+    def values(self, field):
+        if field in self.inverted:
+            return {self.labels[field][value]: len(cardIds) for value, cardIds in sorted(self.inverted[field].items())}
+        if field in self.sorted:
+            values = self.sorted[field][1]
+            return (values[0], values[-1]) if values else None
+        raise KeyError("Unknown field: %s" % field)
+
+    # Return the cards matching every filter, in the order of the output.
+    # A filter on an inverted field is a value, or a list of values the card must all have.
+    # A filter on a sorted field is a value, or a (low, high) tuple where both bounds are included and None is open.
+    def query(self, **filters):
+        return [self.cards[cardId] for cardId in sorted(self.queryIds(**filters))]
+
+    # Same as query, but return the set of the positions of the cards.
+    def queryIds(self, **filters):
+        matches = []
+
+        for field, value in filters.items():
+            if value is None:
+                continue
+            if field in self.inverted:
+                values = value if isinstance(value, (list, tuple, set)) else [value]
+                for single in values:
+                    matches.append(self.inverted[field].get(single.lower(), set()))
+            elif field in self.sorted:
+                low, high = value if isinstance(value, tuple) else (value, value)
+                matches.append(self.getRange(field, low, high))
+            else:
+                raise KeyError("Unknown field: %s" % field)
+
+        if not matches:
+            return set(range(len(self.cards)))
+
+        # Intersect from the smallest set, so every step is at most as long as the smallest set.
+        matches.sort(key=len)
+        result = set(matches[0])
+        for match in matches[1:]:
+            result.intersection_update(match)
+            if not result:
+                break
+        return result
+
+    # Return the set of the cards with a value of field between low and high, both included. None is open.
+    def getRange(self, field, low, high):
+        pairs, values = self.sorted[field]
+        start = 0 if low is None else bisect.bisect_left(values, low)
+        end = len(values) if high is None else bisect.bisect_right(values, high)
+        return {cardId for value, cardId in pairs[start:end]}
+
+
+# Return the command line flag of a field: craftPremium is --craft-premium.
+def getFlag(field):
+    return '--' + re.sub('([A-Z])', lambda match: '-' + match.group(1).lower(), field)
+
+
+# Parse a range given on the command line: "8", "8:", ":3" or "2:5".
+def parseRange(text):
+    if ':' not in text:
+        return (int(text), int(text))
+    low, high = text.split(':', 1)
+    return (int(low) if low else None, int(high) if high else None)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Query the cards saved by arachas.py.')
+    parser.add_argument('--file', help='jsonl output of the crawler.', default=DEFAULT_PATH, required=False)
+    for field in INVERTED_FIELDS:
+        parser.add_argument(getFlag(field), help='Cards with this %s. Can be repeated, the cards must have every '
+                                                 'value.' % field, dest=field, action='append', required=False)
+    for field in SORTED_FIELDS:
+        parser.add_argument(getFlag(field), help='Cards with a %s in this range, for example 8, 8:, :3 or 2:5.' % field,
+                            dest=field, type=parseRange, required=False)
+    parser.add_argument('--values', help='Print the values of this field instead of the cards.',
+                        choices=sorted(list(INVERTED_FIELDS) + list(SORTED_FIELDS)), required=False)
+    parser.add_argument('--json', help='Print the cards in the jsonl format instead of their names.',
+                        action='store_true', required=False)
+    args = parser.parse_args()
+
+    store = CardStore.load(args.file)
+
+    if args.values:
+        values = store.values(args.values)
+        if isinstance(values, dict):
+            for value, count in values.items():
+                print("%s: %s" % (value, count))
+        else:
+            print(values)
+    else:
+        filters = {field: getattr(args, field) for field in list(INVERTED_FIELDS) + list(SORTED_FIELDS)}
+        cards = store.query(**filters)
+        for card in cards:
+            print(json.dumps(card, ensure_ascii=False, sort_keys=True) if args.json else card['name'])
+        if not args.json:
+            print("%s cards" % len(cards))
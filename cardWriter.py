@@ -0,0 +1,123 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import os
+import os.path
+import json
+import hashlib
+import threading
+
+
+# Write the cards to the json and jsonl outputs while they are crawled.
+# Every card is appended to a temporary jsonl file as soon as it's added. Only the name and the position of every
+# card is kept in memory. Once the crawl is over, close builds both outputs sorted by name in a single pass over the
+# temporary file, and renames them in place. A crash never leaves a half-written output behind.
+# Next to the outputs, <filepath>.offsets.json maps the key of every card to the offset and the length of its line in
+# the jsonl output, so a single card can be read without parsing the whole file (see cardReader.py).
+class CardWriter:
+    # filepath is the path of the outputs without the extension.
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.partialPath = filepath + ".partial.jsonl"
+        self.lock = threading.Lock()
+        # (name, digest, offset, length, key) of every card in the temporary file.
+        self.entries = []
+        self.offset = 0
+        self.file = open(self.partialPath, "wb")
+
+    # Number of cards added so far.
+    @property
+    def count(self):
+        return len(self.entries)
+
+    # Append a card to the temporary file. Thread safe.
+    def add(self, card):
+        line = json.dumps(card, ensure_ascii=False, sort_keys=True).encode("utf-8")
+        # Cards sharing the same name are ordered by their content, so the output doesn't depend on the order
+        # in which the cards were crawled.
+        digest = hashlib.sha1(line).hexdigest()
+
+        with self.lock:
+            # Raises ValueError once the writer is closed.
+            self.file.write(line + b"\n")
+            self.entries.append((card['name'], digest, self.offset, len(line), card.get('key')))
+            self.offset += len(line) + 1
+
+    # Build the sorted json and jsonl outputs and remove the temporary file.
+    def close(self):
+        # A card added by a late thread fails instead of being lost silently.
+        with self.lock:
+            self.file.close()
+        # Sort the cards in the list by the name of the cards in order to get a predictable output.
+        # Makes it easier to see difference when using a diff tool.
+        self.entries.sort()
+
+        jsonPath = self.filepath + ".json"
+        jsonlPath = self.filepath + ".jsonl"
+        offsetsPath = self.filepath + ".offsets.json"
+        # Offset and length of every card in the jsonl output. The first card wins if two cards share a key.
+        offsets = {}
+        jsonlOffset = 0
+
+        with open(self.partialPath, "rb") as partial, \
+                open(jsonPath + ".tmp", "w", encoding="utf-8", newline="\n") as jsonFile, \
+                open(jsonlPath + ".tmp", "w", encoding="utf-8", newline="\n") as jsonlFile:
+            jsonFile.write("[")
+
+            for index, (name, digest, offset, length, key) in enumerate(self.entries):
+                partial.seek(offset)
+                line = partial.read(length).decode("utf-8")
+
+                if index:
+                    jsonFile.write(",")
+                    jsonlFile.write("\n")
+                    jsonlOffset += 1
+
+                if key is not None and key not in offsets:
+                    offsets[key] = [jsonlOffset, length]
+                jsonlOffset += length
+
+                # Same layout as json.dump of the whole list with indent=2: every card is indented one level.
+                pretty = json.dumps(json.loads(line), ensure_ascii=False, sort_keys=True, indent=2,
+                                    separators=(',', ': '))
+                jsonFile.write("\n  " + pretty.replace("\n", "\n  "))
+                jsonlFile.write(line)
+
+            jsonFile.write("\n]" if self.entries else "]")
+
+        os.replace(jsonPath + ".tmp", jsonPath)
+        os.replace(jsonlPath + ".tmp", jsonlPath)
+
+        # The size of the jsonl output lets the readers detect an index that doesn't match it.
+        with open(offsetsPath + ".tmp", "w", encoding="utf-8", newline="\n") as f:
+            json.dump({'size': jsonlOffset, 'cards': offsets}, f, ensure_ascii=False, sort_keys=True)
+        os.replace(offsetsPath + ".tmp", offsetsPath)
+
+        os.remove(self.partialPath)
+
+    # Return the sorted digests of the cards added. Two crawls with the same digests found exactly the same cards.
+    def digests(self):
+        with self.lock:
+            return sorted(entry[1] for entry in self.entries)
+
+    # Remove the temporary file without saving the outputs. The outputs of the last crawl are left as they are.
+    def discard(self):
+        with self.lock:
+            self.file.close()
+        os.remove(self.partialPath)
+
+    # Return the sorted digests of the cards of the jsonl output saved at filepath, like digests, or None if there is
+    # no output.
+    @staticmethod
+    def loadDigests(filepath):
+        try:
+            with open(filepath + ".jsonl", "rb") as f:
+                return sorted(hashlib.sha1(line.rstrip(b"\n")).hexdigest() for line in f)
+        except FileNotFoundError:
+            return None
+
+    # Iterate over the cards of the jsonl output, sorted by name. Only valid after close.
+    def iterCards(self):
+        with open(self.filepath + ".jsonl", "r", encoding="utf-8") as f:
+            for line in f:
+                yield json.loads(line)
@@ -0,0 +1,201 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import os.path
+import json
+import html
+import hashlib
+import argparse
+import threading
+
+import requests
+
+import gwentifyHandler as siteHandler
+
+# Pattern of the URL of the other pages of the table view, and of the page of a card.
+PAGE_URL = 'http://gwentify.com/cards/page/%s/?view=table'
+CARD_URL = 'http://gwentify.com/cards/%s/'
+
+# Number of rows of a page of the table view built by build.
+CARDS_PER_PAGE = 40
+
+
+# Collection of recorded HTTP responses (listing pages, card pages and artworks) saved in a folder.
+# The index maps every URL to its status, content type and the file holding its body.
+# It's filled by the recording proxy of replayServer.py and used to replay a crawl without the real website.
+class Corpus:
+    INDEX_NAME = "index.json"
+    # The index is saved every SAVE_INTERVAL responses, so an interrupted recording is still usable.
+    SAVE_INTERVAL = 50
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.lock = threading.Lock()
+
+        if not os.path.exists(self.folder):
+            os.makedirs(self.folder)
+
+        try:
+            with open(os.path.join(self.folder, self.INDEX_NAME), 'r', encoding='utf-8') as f:
+                self.index = json.load(f)
+        except FileNotFoundError:
+            self.index = {}
+
+    # Record a response.
+    def add(self, url, status, contentType, content):
+        filename = hashlib.sha1(url.encode('utf-8')).hexdigest()
+
+        with open(os.path.join(self.folder, filename), 'wb') as f:
+            f.write(content)
+
+        with self.lock:
+            self.index[url] = {'status': status, 'contentType': contentType, 'file': filename}
+            if len(self.index) % self.SAVE_INTERVAL == 0:
+                self.saveIndex()
+
+    # Return a tuple of the status, content type and body recorded for the url, or None if it was never recorded.
+    def get(self, url):
+        entry = self.index.get(url)
+        if entry is None:
+            return None
+
+        with open(os.path.join(self.folder, entry['file']), 'rb') as f:
+            return entry['status'], entry['contentType'], f.read()
+
+    # Return the recorded URLs whose content type starts with contentType.
+    def urls(self, contentType=''):
+        return sorted(url for url, entry in self.index.items() if (entry['contentType'] or '').startswith(contentType))
+
+    # Save the index. Must be called once the recording is over.
+    def saveIndex(self):
+        filepath = os.path.join(self.folder, self.INDEX_NAME)
+        with open(filepath + '.tmp', 'w', encoding='utf-8', newline='\n') as f:
+            json.dump(self.index, f, ensure_ascii=False, sort_keys=True, indent=2, separators=(',', ': '))
+        os.replace(filepath + '.tmp', filepath)
+
+
+# Return the URL of the page of a card on the website.
+def getCardUrl(card):
+    return CARD_URL % card['key'].replace('_', '-')
+
+
+# Return the html of the page of a card, with the markup read by gwentifyHandler.getCardJson.
+# newline separates the lines of the page. Some tags span two lines, like on the website.
+def renderCardPage(card, newline='\n'):
+    variation = card['variations'][0]
+    items = ['<li><strong>Group:</strong> <a>%s</a></li>' % escapeText(card['type']),
+             '<li><strong>Rarity:</strong> <a>%s</a></li>' % escapeText(variation['rarity']),
+             '<li><strong>Faction:</strong> <a>%s</a></li>' % escapeText(card['faction'])]
+    if 'strength' in card:
+        items.append('<li><strong>Strength:</strong> %s</li>' % card['strength'])
+    if 'loyalty' in card:
+        items.append('<li><strong>Loyalty:</strong> %s</li>' % ", ".join(
+            '<a>%s</a>' % escapeText(loyalty) for loyalty in card['loyalty']))
+    if 'categories' in card:
+        items.append('<li><strong>Type:</strong> %s</li>' % ", ".join(
+            '<a>%s</a>' % escapeText(category) for category in card['categories']))
+    for label, field in (('Craft:', 'craft'), ('Mill:', 'mill')):
+        if field in variation:
+            items.append('<li><strong>%s</strong> %s/%s</li>' % (label, variation[field]['normal'],
+                                                                 variation[field]['premium']))
+    if card.get('positions'):
+        # The website shows the cards playable on every lane as "Multiple".
+        lane = "Multiple" if len(card['positions']) == 3 else card['positions'][0]
+        items.append('<li><strong>Position:</strong> <a>%s</a></li>' % escapeText(lane))
+
+    lines = ['<!DOCTYPE html>',
+             '<html>',
+             '<head><meta charset="utf-8"><title>%s</title></head>' % escapeText(card['name']),
+             '<body>',
+             '<div class="content-area"',
+             ' id="primary">',
+             '<main class="site-main">',
+             '<h1>%s</h1>' % escapeText(card['name']),
+             '<div class="card-img"><a',
+             ' href="%s"><img src="%s"></a></div>' % (escapeAttribute(variation['art']['fullsizeImage']),
+                                                      escapeAttribute(variation['art']['thumbnailImage'])),
+             '<div class="entry-content">',
+             '<ul class="card-cats">'] + items + ['</ul>']
+    if variation['availability'] == 'NonOwnable':
+        lines.append('<strong>Availability: <a>Uncollectible</a></strong>')
+    if 'info' in card:
+        lines.append('<div class="card-text"><p>%s</p></div>' % escapeText(card['info']))
+    if 'flavor' in card:
+        lines.append('<p class="flavor">%s</p>' % escapeText(card['flavor']))
+    lines += ['</div>', '</main>', '</div>', '</body>', '</html>', '']
+    return newline.join(lines)
+
+
+# Return the html of a page of the table view, with the markup read by gwentifyHandler.getCardRows and getPages.
+# lastPage is the number of the last page of the table view. newline is the same as for renderCardPage.
+def renderListingPage(cards, lastPage, newline='\n'):
+    lines = ['<!DOCTYPE html>',
+             '<html>',
+             '<head><meta charset="utf-8"><title>Cards</title></head>',
+             '<body>',
+             '<table>',
+             '<tr><th>Name</th><th>Faction</th><th>Group</th><th>Rarity</th><th>Strength</th></tr>']
+    for card in cards:
+        lines += ['<tr><td><a',
+                  ' href="%s">%s</a></td><td>%s</td><td>%s</td><td>%s</td><td>%s</td></tr>' % (
+                      escapeAttribute(getCardUrl(card)), escapeText(card['name']), escapeText(card['faction']),
+                      escapeText(card['type']), escapeText(card['variations'][0]['rarity']),
+                      card.get('strength', ''))]
+    lines += ['</table>',
+              '<ul class="pagination">',
+              '<li><a class="last" href="%s">Last</a></li>' % escapeAttribute(PAGE_URL % lastPage),
+              '</ul>',
+              '</body>',
+              '</html>',
+              '']
+    return newline.join(lines)
+
+
+def escapeText(text):
+    return html.escape(text, quote=False)
+
+
+def escapeAttribute(text):
+    return html.escape(text, quote=True)
+
+
+# Fill corpus with the pages of the website rendered from cards, the cards of an output of the crawler: the table
+# view, the page of every card and a placeholder for every artwork. A crawl of the corpus gives back the same cards.
+# It stands in for a recording now that the website is gone.
+def build(corpus, cards, perPage=CARDS_PER_PAGE):
+    cards = sorted(cards, key=lambda card: card['name'])
+    lastPage = max((len(cards) + perPage - 1) // perPage, 1)
+    if not siteHandler.pageRegex.match(PAGE_URL % lastPage):
+        raise ValueError("The crawler can't read the number of the last page: %s. Change the number of cards per "
+                         "page." % lastPage)
+
+    for page in range(1, lastPage + 1):
+        content = renderListingPage(cards[(page - 1) * perPage:page * perPage], lastPage).encode('utf-8')
+        corpus.add(siteHandler.HOST if page == 1 else PAGE_URL % page, 200, 'text/html; charset=UTF-8', content)
+
+    for card in cards:
+        corpus.add(getCardUrl(card), 200, 'text/html; charset=UTF-8', renderCardPage(card).encode('utf-8'))
+        art = card['variations'][0]['art']
+        for url in (art['fullsizeImage'], art['thumbnailImage']):
+            # Every artwork has its own content, so none of them is deduplicated by the ImageStore.
+            # The URLs are saved as sent by requests, with the characters that aren't ASCII percent-encoded.
+            corpus.add(requests.utils.requote_uri(url), 200, 'image/png', b'\x89PNG\r\n\x1a\n' + url.encode('utf-8'))
+
+    corpus.saveIndex()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build a corpus for replayServer.py and benchmark.py from the cards '
+                                                 'of an output of arachas.py.')
+    parser.add_argument('corpus', help='Folder of the corpus.')
+    parser.add_argument('--from-output', help='jsonl output of the crawler.', required=True)
+    parser.add_argument('--per-page', help='Number of cards on every page of the table view.', type=int,
+                        default=CARDS_PER_PAGE, required=False)
+    args = parser.parse_args()
+
+    with open(args.from_output, 'r', encoding='utf-8') as f:
+        outputCards = [json.loads(line) for line in f]
+
+    corpus = Corpus(args.corpus)
+    build(corpus, outputCards, args.per_page)
+    print("Built %s responses from %s cards in: %s" % (len(corpus.index), len(outputCards), args.corpus))
@@ -0,0 +1,193 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import sys
+import json
+import argparse
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+import gwentifyHandler as siteHandler
+from arachas import getNameKey
+from httpCache import HttpCache
+from httpPool import HttpPool
+from scheduler import AdaptiveScheduler
+
+# Settings of a crawl, hashable so the crawlers can be reused by config.
+#     host          entry point of the website, the first page of the table view
+#     threads       number of threads downloading the pages and the cards
+#     poolSize      most connections kept open, and most requests in flight, to a single host
+#     queueSize     most cards downloaded or parsed and not consumed yet
+#     parseWorkers  number of processes parsing the cards, 0 to parse them in the downloading threads
+#     parser        HTML parser, 'auto' for the fastest installed
+#     cacheFolder   folder of the HttpCache, None to download every page again
+#     proxy         URL of an HTTP proxy used for every request
+#     timeout, rate, burst, maxRetries    same as the options of arachas.py
+Config = namedtuple('Config', ['host', 'threads', 'poolSize', 'queueSize', 'parseWorkers', 'parser', 'cacheFolder',
+                               'proxy', 'timeout', 'rate', 'burst', 'maxRetries'])
+Config.__new__.__defaults__ = (siteHandler.HOST, 10, 10, 100, 0, 'auto', HttpCache.FOLDER_NAME, None, 5.0, 0.0, 1, 5)
+
+
+# Crawl the website from Python. The connections, the HTTP cache and the parse processes are kept between the
+# crawls, so only the first crawl pays for them:
+#
+#     crawler = Crawler(Config(parseWorkers=4))
+#     for card in crawler.crawl():
+#         ...
+#
+# The cards are yielded as soon as they are parsed, in no particular order, with their key. Nothing is saved: that's
+# left to the caller. A crawler can be used by several threads at the same time.
+class Crawler:
+    def __init__(self, config=None):
+        self.config = config or Config()
+        siteHandler.setParser(self.config.parser)
+
+        proxies = None
+        if self.config.proxy:
+            proxies = {'http': self.config.proxy, 'https': self.config.proxy}
+        self.scheduler = AdaptiveScheduler(self.config.poolSize, self.config.rate, self.config.burst,
+                                           self.config.maxRetries)
+        self.httpPool = HttpPool(self.config.poolSize, proxies, self.scheduler)
+        self.httpCache = None
+        if self.config.cacheFolder is not None:
+            self.httpCache = HttpCache(self.httpPool, self.config.cacheFolder)
+
+        self.parsePool = None
+        if self.config.parseWorkers > 0:
+            # The parser selected above must also be selected in every process.
+            self.parsePool = ProcessPoolExecutor(self.config.parseWorkers, initializer=siteHandler.setParser,
+                                                 initargs=(siteHandler.parserName,))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    # Yield every card of the website as soon as it's parsed.
+    # onError is called with the stage ('pages' or 'cards'), the URL and the error of every failure. By default the
+    # failures are skipped.
+    # Stopping the iteration early cancels the cards not downloaded yet.
+    def crawl(self, onError=None):
+        onError = onError or (lambda stage, url, error: None)
+
+        with ThreadPoolExecutor(self.config.threads) as executor:
+            # Most cards downloaded and not consumed yet. The downloads wait while the caller is behind.
+            pending = set()
+            try:
+                pages = self.getPages(onError)
+                for rows in executor.map(lambda page: self.getCardRows(page, onError), pages):
+                    for row in rows:
+                        if len(pending) >= self.config.queueSize:
+                            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                            yield from self.getResults(done)
+                        pending.add(executor.submit(self.getCard, row['url'], onError))
+
+                while pending:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    yield from self.getResults(done)
+            finally:
+                for future in pending:
+                    future.cancel()
+
+    def getResults(self, futures):
+        for future in futures:
+            cardData = future.result()
+            if cardData is not None:
+                yield cardData
+
+    def fetch(self, url):
+        if self.httpCache is not None:
+            return self.httpCache.get(url, headers=siteHandler.HEADERS, timeout=self.config.timeout)
+        return self.httpPool.get(url, headers=siteHandler.HEADERS, timeout=self.config.timeout)
+
+    # Return the URL of every page of the table view.
+    def getPages(self, onError):
+        try:
+            res = self.fetch(self.config.host)
+            if res.status_code == 200:
+                return siteHandler.getPages(res.content) + [self.config.host]
+            onError('pages', self.config.host, "HTTP %s" % res.status_code)
+        except Exception as e:
+            onError('pages', self.config.host, e)
+        return []
+
+    # Return the rows of a page of the table view.
+    def getCardRows(self, url, onError):
+        try:
+            res = self.fetch(url)
+            if res.status_code == 200:
+                return siteHandler.getCardRows(res.content)
+            onError('pages', url, "HTTP %s" % res.status_code)
+        except Exception as e:
+            onError('pages', url, e)
+        return []
+
+    # Return the card of url with its key, or None if it failed.
+    def getCard(self, url, onError):
+        try:
+            res = self.fetch(url)
+            if res.status_code != 200:
+                onError('cards', url, "HTTP %s" % res.status_code)
+                return None
+
+            if self.parsePool is None:
+                cardData = siteHandler.getCardJson(res.content)
+            else:
+                cardData = self.parsePool.submit(siteHandler.getCardJson, res.content).result()
+            cardData['key'] = getNameKey(cardData['name'])
+            return cardData
+        except Exception as e:
+            onError('cards', url, e)
+            return None
+
+    # Close the connections and stop the parse processes.
+    def close(self):
+        if self.parsePool is not None:
+            self.parsePool.shutdown()
+        self.httpPool.close()
+
+
+# Crawler of every config used with crawl.
+crawlers = {}
+crawlersLock = threading.Lock()
+
+
+# Yield every card of the website as soon as it's parsed, like Crawler.crawl.
+# The crawler of the config is kept for the next calls with the same config, so they reuse its connections.
+def crawl(config=None, onError=None):
+    config = config or Config()
+    with crawlersLock:
+        crawler = crawlers.get(config)
+        if crawler is None:
+            crawler = crawlers[config] = Crawler(config)
+    return crawler.crawl(onError)
+
+
+# Close the crawlers kept by crawl.
+def close():
+    with crawlersLock:
+        for crawler in crawlers.values():
+            crawler.close()
+        crawlers.clear()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Print every card of the website as a json line as soon as it\'s '
+                                                 'parsed, without saving anything.')
+    parser.add_argument('--threads', help='Number of threads downloading the pages and the cards.', type=int,
+                        default=10, required=False)
+    parser.add_argument('--parse-workers', help='Number of processes parsing the cards.', type=int, default=0,
+                        required=False)
+    parser.add_argument('--proxy', help='URL of an HTTP proxy used for every request.', required=False)
+    parser.add_argument('--no-cache', help='Ignore the HTTP cache and download every page again.',
+                        action='store_true', required=False)
+    args = parser.parse_args()
+
+    config = Config(threads=args.threads, poolSize=args.threads, parseWorkers=args.parse_workers, proxy=args.proxy,
+                    cacheFolder=None if args.no_cache else HttpCache.FOLDER_NAME)
+    with Crawler(config) as crawler:
+        for card in crawler.crawl(lambda stage, url, error: print("Failed %s: %s (%s)" % (stage, url, error),
+                                                                 file=sys.stderr)):
+            print(json.dumps(card, ensure_ascii=False, sort_keys=True))
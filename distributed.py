@@ -0,0 +1,266 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import time
+import socket
+import sqlite3
+import argparse
+import threading
+
+import gwentifyHandler as siteHandler
+import stats
+from httpCache import HttpCache
+from httpPool import HttpPool
+from scheduler import AdaptiveScheduler
+
+# Number of seconds a worker has to finish the cards it claimed before they are given to another worker.
+LEASE = 120.0
+# Number of times a card is claimed before it's reported as failed, when its workers keep dying.
+MAX_ATTEMPTS = 3
+
+# State of a card in the WorkQueue.
+PENDING = 'pending'
+LEASED = 'leased'
+DONE = 'done'
+FAILED = 'failed'
+
+
+# Durable queue of the card URLs of a distributed crawl, shared by the coordinator and the workers in a SQLite file.
+# The coordinator publishes the URLs and takes the results. A worker claims a few URLs with a lease, and reports the
+# card or the error of every one of them. If a worker dies, its lease expires and the URLs are claimed by another
+# worker. A result is only accepted from the worker holding the lease, so a card is never saved twice.
+class WorkQueue:
+    # filepath is the SQLite file of the queue, created if needed.
+    def __init__(self, filepath, maxAttempts=MAX_ATTEMPTS):
+        self.filepath = filepath
+        self.maxAttempts = maxAttempts
+        # A SQLite connection can't be shared between threads.
+        self.local = threading.local()
+
+        with self.transaction() as db:
+            db.execute("CREATE TABLE IF NOT EXISTS tasks (url TEXT PRIMARY KEY, state TEXT NOT NULL, worker TEXT, "
+                       "leaseExpiry REAL, attempts INTEGER NOT NULL DEFAULT 0, result TEXT, error TEXT, "
+                       "taken INTEGER NOT NULL DEFAULT 0)")
+            db.execute("CREATE INDEX IF NOT EXISTS tasksState ON tasks (state, taken)")
+
+    # Empty the queue. When resume is True, the cards already done by an interrupted crawl are kept instead and given
+    # again to the coordinator, and the failed ones are tried again.
+    def reset(self, resume=False):
+        with self.transaction() as db:
+            if resume:
+                db.execute("UPDATE tasks SET state = ?, attempts = 0, error = NULL WHERE state = ?", (PENDING, FAILED))
+                db.execute("UPDATE tasks SET taken = 0")
+            else:
+                db.execute("DELETE FROM tasks")
+
+    # Return the connection of the current thread.
+    def connection(self):
+        db = getattr(self.local, 'db', None)
+        if db is None:
+            # The transactions are started explicitly. timeout is how long to wait for the lock of another process.
+            db = self.local.db = sqlite3.connect(self.filepath, timeout=60, isolation_level=None)
+        return db
+
+    # Run the statements of a with block in a single transaction, holding the write lock of the file from the start.
+    def transaction(self):
+        return Transaction(self.connection())
+
+    # Add the URLs to the queue. The URLs already in the queue are left as they are.
+    def publish(self, urls):
+        with self.transaction() as db:
+            db.executemany("INSERT OR IGNORE INTO tasks (url, state) VALUES (?, ?)", [(url, PENDING) for url in urls])
+
+    # Claim up to count URLs for worker, for lease seconds. Return the claimed URLs.
+    def claim(self, worker, count=1, lease=LEASE):
+        now = time.time()
+        with self.transaction() as db:
+            # The URLs of the workers that died too many times are given up.
+            db.execute("UPDATE tasks SET state = ?, error = ?, worker = NULL "
+                       "WHERE state = ? AND leaseExpiry < ? AND attempts >= ?",
+                       (FAILED, "Lease expired %s times" % self.maxAttempts, LEASED, now, self.maxAttempts))
+            urls = [row[0] for row in db.execute(
+                "SELECT url FROM tasks WHERE state = ? OR (state = ? AND leaseExpiry < ?) LIMIT ?",
+                (PENDING, LEASED, now, count))]
+            db.executemany("UPDATE tasks SET state = ?, worker = ?, leaseExpiry = ?, attempts = attempts + 1 "
+                           "WHERE url = ?", [(LEASED, worker, now + lease, url) for url in urls])
+        return urls
+
+    # Save the card parsed from url by worker. Return False if the lease of the worker was lost.
+    def complete(self, url, worker, card):
+        return self.finish(url, worker, DONE, json.dumps(card, ensure_ascii=False), None)
+
+    # Save the error of url. Return False if the lease of the worker was lost.
+    def fail(self, url, worker, error):
+        return self.finish(url, worker, FAILED, None, error)
+
+    def finish(self, url, worker, state, result, error):
+        with self.transaction() as db:
+            cursor = db.execute("UPDATE tasks SET state = ?, result = ?, error = ?, worker = NULL "
+                                "WHERE url = ? AND state = ? AND worker = ?",
+                                (state, result, error, url, LEASED, worker))
+        return cursor.rowcount == 1
+
+    # Return the URLs done or failed since the last call, as (url, card, error) tuples. card is None if it failed.
+    def takeResults(self):
+        with self.transaction() as db:
+            rows = db.execute("SELECT url, state, result, error FROM tasks WHERE state IN (?, ?) AND taken = 0",
+                              (DONE, FAILED)).fetchall()
+            db.executemany("UPDATE tasks SET taken = 1 WHERE url = ?", [(row[0],) for row in rows])
+        return [(url, json.loads(result) if state == DONE else None, error) for url, state, result, error in rows]
+
+    # Give up the URLs not done yet. Return them.
+    def cancel(self, error):
+        with self.transaction() as db:
+            urls = [row[0] for row in db.execute("SELECT url FROM tasks WHERE state IN (?, ?)", (PENDING, LEASED))]
+            db.execute("UPDATE tasks SET state = ?, error = ?, worker = NULL, taken = 1 WHERE state IN (?, ?)",
+                       (FAILED, error, PENDING, LEASED))
+        return urls
+
+    # Return the number of URLs in every state.
+    def counts(self):
+        counts = {PENDING: 0, LEASED: 0, DONE: 0, FAILED: 0}
+        counts.update(self.connection().execute("SELECT state, COUNT(*) FROM tasks GROUP BY state"))
+        return counts
+
+    # Number of URLs not done yet.
+    def unfinished(self):
+        counts = self.counts()
+        return counts[PENDING] + counts[LEASED]
+
+    # Close the connection of the current thread.
+    def close(self):
+        db = getattr(self.local, 'db', None)
+        if db is not None:
+            db.close()
+            self.local.db = None
+
+
+# A transaction holding the write lock from its start, so two workers never claim the same URL.
+class Transaction:
+    def __init__(self, db):
+        self.db = db
+
+    def __enter__(self):
+        self.db.execute("BEGIN IMMEDIATE")
+        return self.db
+
+    def __exit__(self, excType, excValue, tb):
+        self.db.execute("COMMIT" if excType is None else "ROLLBACK")
+
+
+# Worker of a distributed crawl: claims card URLs from the WorkQueue, downloads and parses the cards and reports them.
+# Any number of workers can run at the same time, on any machine that can open the queue.
+class Worker:
+    # httpPool sends the requests, through cache when it's an HttpCache.
+    # name identifies the worker in the queue. batch is the number of URLs claimed at once by every thread.
+    def __init__(self, workQueue, httpPool, cache=None, name=None, batch=5, lease=LEASE, timeout=5.0):
+        self.workQueue = workQueue
+        self.httpPool = httpPool
+        self.cache = cache
+        self.name = name or "%s-%s" % (socket.gethostname(), os.getpid())
+        self.batch = batch
+        self.lease = lease
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.done = 0
+        self.failed = 0
+        self.lost = 0
+
+    # Run threads threads until there is nothing to claim for idleTimeout seconds.
+    def run(self, threads, idleTimeout=60.0, pollInterval=1.0):
+        workers = [threading.Thread(target=self.work, args=(idleTimeout, pollInterval)) for i in range(threads)]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+
+    def work(self, idleTimeout, pollInterval):
+        idleSince = time.monotonic()
+        try:
+            while True:
+                urls = self.workQueue.claim(self.name, self.batch, self.lease)
+                if not urls:
+                    # The coordinator might not have published the cards yet, or a lease might expire.
+                    if time.monotonic() - idleSince > idleTimeout:
+                        return
+                    time.sleep(pollInterval)
+                    continue
+
+                for url in urls:
+                    self.process(url)
+                idleSince = time.monotonic()
+        finally:
+            self.workQueue.close()
+
+    # Download and parse the card of url, and report it to the queue.
+    def process(self, url):
+        card = None
+        try:
+            getter = self.cache if self.cache is not None else self.httpPool
+            res = getter.get(url, headers=siteHandler.HEADERS, timeout=self.timeout)
+            if res.status_code == 200:
+                card, seconds = stats.timedCall(siteHandler.getCardJson, res.content)
+            else:
+                error = "HTTP %s" % res.status_code
+        except Exception as e:
+            card = None
+            error = "%s: %s" % (type(e).__name__, e)
+
+        if card is not None:
+            accepted = self.workQueue.complete(url, self.name, card)
+        else:
+            accepted = self.workQueue.fail(url, self.name, error)
+
+        with self.lock:
+            if not accepted:
+                # The lease expired and the card was given to another worker.
+                self.lost += 1
+            elif card is not None:
+                self.done += 1
+            else:
+                self.failed += 1
+
+    def stats(self):
+        with self.lock:
+            return {'done': self.done, 'failed': self.failed, 'lost': self.lost}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Worker of a distributed crawl: download and parse the cards '
+                                                 'published by arachas.py --engine distributed.')
+    parser.add_argument('queue', help='SQLite file of the work queue.')
+    parser.add_argument('--threads', help='Number of threads downloading the cards.', type=int, default=10,
+                        required=False)
+    parser.add_argument('--batch', help='Number of cards claimed at once by every thread.', type=int, default=5,
+                        required=False)
+    parser.add_argument('--lease', help='Seconds the worker has to finish the cards it claimed before they are '
+                                        'given to another worker.', type=float, default=LEASE, required=False)
+    parser.add_argument('--idle-timeout', help='Stop after this many seconds without any card to claim.',
+                        type=float, default=60.0, required=False)
+    parser.add_argument('--timeout', help='Timeout of every request, in seconds.', type=float, default=5.0,
+                        required=False)
+    parser.add_argument('--max-retries', help='Number of times a throttled or failed request is sent again.',
+                        type=int, default=5, required=False)
+    parser.add_argument('--proxy', help='URL of an HTTP proxy used for every request.', required=False)
+    parser.add_argument('--parser', help='HTML parser used to extract the data.',
+                        choices=['auto'] + siteHandler.PARSERS, default='auto', required=False)
+    parser.add_argument('--no-cache', help='Ignore the HTTP cache and download every card again.',
+                        action='store_true', required=False)
+    args = parser.parse_args()
+
+    siteHandler.setParser(args.parser)
+
+    proxies = None
+    if args.proxy:
+        proxies = {'http': args.proxy, 'https': args.proxy}
+    httpPool = HttpPool(args.threads, proxies, AdaptiveScheduler(args.threads, maxRetries=args.max_retries))
+    cache = None if args.no_cache else HttpCache(httpPool)
+
+    worker = Worker(WorkQueue(args.queue), httpPool, cache, batch=args.batch, lease=args.lease, timeout=args.timeout)
+    print("Worker %s claiming cards from: %s" % (worker.name, args.queue))
+    start = time.time()
+    worker.run(args.threads, args.idle_timeout)
+    print("Cards: %(done)s done, %(failed)s failed, %(lost)s lost to another worker" % worker.stats())
+    print("Elapsed Time: %s" % (time.time() - start))
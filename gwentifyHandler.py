@@ -1,9 +1,46 @@
 #!/usr/bin/python3
 # -*- coding: utf-8 -*-
 
+import os.path
 import re
-
-from bs4 import BeautifulSoup
+import sys
+import json
+import hashlib
+
+from bs4 import BeautifulSoup, SoupStrainer, UnicodeDammit
+from bs4.builder import builder_registry
+
+# URL where we can begin the crawl, the first page of the table view.
+HOST = 'http://gwentify.com/cards/?view=table'
+
+# Headers of every request sent to the website.
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0'
+}
+
+# Columns of the table view that can be copied directly in a card, by the text of their header.
+# The other fields (art, info, flavor, craft and mill costs...) are only found on the page of the card.
+TABLE_COLUMNS = {
+    "Name": "name",
+    "Faction": "faction",
+    "Group": "type",
+    "Rarity": "rarity",
+    "Strength": "strength"
+}
+
+# Parsers that BeautifulSoup can use to build the documents, from the fastest to the slowest.
+# lxml is backed by a C library, the others are pure Python. Only html.parser is always installed.
+PARSERS = ['lxml', 'html.parser', 'html5lib']
+
+# Name of the parser currently in use. Change it with setParser.
+parserName = 'html.parser'
+
+# Only the parts of the documents that we actually read are turned into a tree.
+# Skipping the header, the sidebars and the scripts saves most of the parsing time.
+# Note: html5lib doesn't support it and always builds the whole document.
+cardsTableStrainer = SoupStrainer('table')
+pagingStrainer = SoupStrainer('li')
+cardStrainer = SoupStrainer('div', id='primary')
 
 # Match against the following case: "200/800"
 # Used to extract mill and craft cost from the website.
@@ -14,21 +51,134 @@ costRegex = re.compile("^([0-9]+)/([0-9]+)")
 # generate the url for all the other pages without having to explore and send more than one web request.
 pageRegex = re.compile("^(http://gwentify.com[a-z/=?&]+)([1-9]+)([a-z/=?&]+)$")
 
+# Match the tags and the comments of a document. Everything between them is text.
+markupRegex = re.compile(r'(<!--.*?-->|<[a-zA-Z/!?](?:"[^"]*"|\'[^\']*\'|[^\'">])*>)', re.DOTALL)
+
+# Pages saved for the conformance check of the parsers, along with the results expected from them.
+FIXTURES_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+# Return the list of parsers installed on this system, from the fastest to the slowest.
+def getAvailableParsers():
+    return [name for name in PARSERS if builder_registry.lookup(name) is not None]
+
+
+# Select the parser used by every function of this module.
+# "auto" picks the fastest parser installed.
+def setParser(name):
+    global parserName
+
+    availableParsers = getAvailableParsers()
+
+    if name == 'auto':
+        name = availableParsers[0]
+    elif name not in availableParsers:
+        raise ValueError("The parser %s is not installed. Available parsers: %s" % (name, ", ".join(availableParsers)))
+
+    parserName = name
+
+
+# Return an identifier of the code extracting the cards and of the parser in use. It changes whenever the cards
+# extracted from the same html might change, so the cards saved by parseMemo.ParseMemo are only reused by the same
+# version.
+def getParserVersion():
+    import bs4
+    with open(__file__, 'rb') as f:
+        source = f.read()
+    return hashlib.sha1(source + (" %s %s" % (parserName, bs4.__version__)).encode('utf-8')).hexdigest()
+
+
+# Build the tree of the parts of html matching strainer.
+def parse(html, strainer):
+    # Decode the document ourselves so every parser works on the same text. Otherwise html5lib
+    # guesses the encoding on its own and can get a different result than the others.
+    if isinstance(html, bytes):
+        html = UnicodeDammit(html, is_html=True).unicode_markup
+
+    return BeautifulSoup(keepCarriageReturns(html), parserName, parse_only=strainer)
+
+
+# lxml and html5lib follow the HTML specification and turn every "\r\n" into "\n" while html.parser keeps them.
+# A character reference keeps the carriage returns of the text with all the parsers. It's only used in the text: in
+# a tag, like <a\r\nhref="...">, it would be read as an attribute.
+def keepCarriageReturns(html):
+    if '\r' not in html:
+        return html
+
+    # The text and the markup alternate, starting with the text.
+    parts = markupRegex.split(html)
+    parts[::2] = [text.replace('\r', '&#13;') for text in parts[::2]]
+    return "".join(parts)
+
+
+# Run function on html with every parser installed.
+# Return a map of the parser name to the result.
+def compareParsers(function, html):
+    results = {}
+    currentParser = parserName
+
+    try:
+        for name in getAvailableParsers():
+            setParser(name)
+            results[name] = function(html)
+    finally:
+        setParser(currentParser)
+
+    return results
+
 
 # Extract the url of every individual cards found in the html of a page
 def getCardsUrl(html):
-    listCards = []
+    return [row['url'] for row in getCardRows(html)]
+
 
-    soup = BeautifulSoup(html, 'html.parser')
-    tableRows = soup.find('table').find_all('tr')
+# Extract every row of the table found in the html of a page.
+# Return a list of maps with the url of the card, the fields of the card found in the row (see TABLE_COLUMNS)
+# and a fingerprint of the row. The fingerprint changes whenever anything displayed in the row changes.
+def getCardRows(html):
+    listRows = []
+
+    soup = parse(html, cardsTableStrainer)
+    table = soup.find('table')
+
+    # The headers tell us which column holds which field. Without them we only know the URL of the cards.
+    headers = [header.get_text().strip().rstrip(':') for header in table.find_all('th')]
 
     # The data is present inside a table. We iterate over every rows.
-    for row in tableRows:
+    for row in table.find_all('tr'):
+        cells = row.find_all('td')
+        # Skip the header row.
+        if not cells:
+            continue
+
         # Get the URL for the card of that row.
         cardUrl = row.td.a.get('href')
-        listCards.append(cardUrl)
-
-    return listCards
+        texts = [cell.get_text().strip() for cell in cells]
+
+        fields = {}
+        for header, text in zip(headers, texts):
+            field = TABLE_COLUMNS.get(header)
+            if field == "strength":
+                # Cards without strength have an empty cell.
+                if text.isdigit():
+                    fields[field] = int(text)
+            elif field and text:
+                fields[field] = text
+
+        fingerprint = hashlib.sha1("\x1f".join([cardUrl] + texts).encode('utf-8')).hexdigest()
+        listRows.append({'url': cardUrl, 'fields': fields, 'fingerprint': fingerprint})
+
+    return listRows
+
+
+# Copy the fields extracted from a row of the table into a card.
+def applyTableFields(dataMap, fields):
+    for field, value in fields.items():
+        # Currently, we don't have any other variation so we only work with the single variation.
+        if field == "rarity":
+            dataMap["variations"][0]["rarity"] = value
+        else:
+            dataMap[field] = value
 
 
 # From the main website, extract data relative to the pagination (card are available in different pages).
@@ -37,7 +187,7 @@ def getCardsUrl(html):
 def getPages(html):
     listPages = []
 
-    soup = BeautifulSoup(html, 'html.parser')
+    soup = parse(html, pagingStrainer)
     # The website have a link that point to the last page.
     # We are interested in it because we will learn both
     # the pattern used by the link and also the number of pages in total.
@@ -68,7 +218,7 @@ def getPages(html):
 def getCardJson(html):
     dataMap = {}
 
-    soup = BeautifulSoup(html, 'html.parser')
+    soup = parse(html, cardStrainer)
     # All the information is found inside this element.
     cardArticle = soup.find('div', id='primary').main
 
@@ -206,3 +356,73 @@ def getCardJson(html):
         # dataMap["flavor"] = ""
 
     return dataMap
+
+
+# Return the rows and the pages found in the html of a page of the table view.
+def getListing(html):
+    return {'rows': getCardRows(html), 'pages': getPages(html)}
+
+
+# Return the result of function on html, or the error it raised, so a parser failing is reported like a difference.
+def getResultOrError(function, html):
+    try:
+        return function(html)
+    except Exception as e:
+        return Exception("%s: %s" % (type(e).__name__, e))
+
+
+# Check the parsers on the page saved in filename with function. Every parser installed must give the same result
+# as html.parser, and html.parser the result saved next to the page, if any. Return False on any difference.
+def checkPage(filename, function):
+    with open(filename, 'rb') as f:
+        results = compareParsers(lambda html: getResultOrError(function, html), f.read())
+
+    expected = results['html.parser']
+    expectedPath = os.path.splitext(filename)[0] + ".json"
+    matching = True
+
+    if os.path.exists(expectedPath):
+        with open(expectedPath, 'r', encoding='utf-8') as f:
+            if json.load(f) != expected:
+                matching = False
+                print("%s: html.parser doesn't give the result saved in %s" % (filename, expectedPath))
+
+    for name, result in sorted(results.items()):
+        if isinstance(result, Exception):
+            matching = False
+            print("%s: %s fails: %s" % (filename, name, result))
+        elif result != expected:
+            matching = False
+            print("%s: %s gives a different result than html.parser" % (filename, name))
+
+    return matching
+
+
+# Return the pages of the conformance check: the card pages and the pages of the table view saved in FIXTURES_FOLDER,
+# as (filename, function) pairs.
+def getFixtures():
+    fixtures = []
+    for folder, function in (('cards', getCardJson), ('pages', getListing)):
+        path = os.path.join(FIXTURES_FOLDER, folder)
+        fixtures += [(os.path.join(path, name), function) for name in sorted(os.listdir(path))
+                     if name.endswith('.html')]
+    return fixtures
+
+
+# Conformance check of the parsers: every parser installed must extract the same data from the same page.
+# Usage: python gwentifyHandler.py [<card page>...]
+# Without any page, the pages saved in FIXTURES_FOLDER are checked, some of them with "\r\n" line breaks.
+# Exit with an error code if any of the pages gives a different result with one of the parsers.
+if __name__ == '__main__':
+    if sys.argv[1:]:
+        pages = [(filename, getCardJson) for filename in sys.argv[1:]]
+    else:
+        pages = getFixtures()
+
+    mismatch = False
+    for filename, function in pages:
+        if not checkPage(filename, function):
+            mismatch = True
+
+    print("Parsers checked on %s pages: %s" % (len(pages), ", ".join(getAvailableParsers())))
+    sys.exit(1 if mismatch else 0)
@@ -0,0 +1,240 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import os.path
+import sys
+import json
+import sqlite3
+import argparse
+from datetime import datetime
+
+import pytz
+
+import indexer
+from DictDiffer import DictDiffer as differ
+
+# History saved by the crawler by default.
+DEFAULT_PATH = os.path.join('.', 'output', 'latest.history.db')
+
+# Number of runs between two full checkpoints.
+CHECKPOINT_INTERVAL = 10
+
+# Kind of a version of a card.
+FULL = 'full'
+DELTA = 'delta'
+REMOVED = 'removed'
+
+
+# History of the cards of every run of the crawler, saved in a SQLite file.
+# A run only saves the cards that were added, changed or removed since the previous run. A changed card is saved as
+# the delta of its fields: {"set": {field: value}, "unset": [field]}. Every CHECKPOINT_INTERVAL runs, a checkpoint
+# saves every card in full, so a card is rebuilt from its last checkpoint with at most CHECKPOINT_INTERVAL deltas,
+# never by replaying the whole history.
+#
+#     history = History('output/latest.history.db')
+#     history.getCard('geralt_igni', history.findRun(datetime(2017, 7, 1)))
+#     history.getChanges(3, 7)
+class History:
+    def __init__(self, filepath=DEFAULT_PATH, checkpointInterval=CHECKPOINT_INTERVAL):
+        self.filepath = filepath
+        self.checkpointInterval = checkpointInterval
+        self.db = sqlite3.connect(filepath)
+
+        with self.db:
+            self.db.execute("CREATE TABLE IF NOT EXISTS runs (run INTEGER PRIMARY KEY, createdOn TEXT NOT NULL, "
+                            "time REAL NOT NULL, count INTEGER NOT NULL, checkpoint INTEGER NOT NULL)")
+            # changed is 0 for the copies of the unchanged cards saved by a checkpoint.
+            self.db.execute("CREATE TABLE IF NOT EXISTS versions (key TEXT NOT NULL, run INTEGER NOT NULL, "
+                            "kind TEXT NOT NULL, hash TEXT, data TEXT, changed INTEGER NOT NULL, "
+                            "PRIMARY KEY (key, run))")
+            self.db.execute("CREATE INDEX IF NOT EXISTS versionsRun ON versions (run, changed)")
+            # Hash of every card of the last run.
+            self.db.execute("CREATE TABLE IF NOT EXISTS head (key TEXT PRIMARY KEY, hash TEXT NOT NULL)")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    # Save the cards of a new run. Return the run, or None if the cards are the same as the last run.
+    # createdOn is the date of the run, now by default.
+    def addRun(self, cards, createdOn=None):
+        createdOn = createdOn or datetime.now(pytz.utc)
+        cards = {card['key']: card for card in cards}
+        hashes = {key: indexer.hashValue(card) for key, card in cards.items()}
+        head = dict(self.db.execute("SELECT key, hash FROM head"))
+        lastRun = self.getLastRun()
+
+        diff = differ(hashes, head)
+        added = diff.added()
+        removed = diff.removed()
+        changed = diff.changed()
+        if lastRun is not None and not (added or removed or changed):
+            return None
+
+        run = (lastRun or 0) + 1
+        checkpoint = (run - 1) % self.checkpointInterval == 0
+
+        versions = []
+        for key in sorted(cards):
+            card = cards[key]
+            if key in changed and not checkpoint:
+                delta = getDelta(self.getCard(key, lastRun), card)
+                versions.append((key, run, DELTA, hashes[key], dump(delta), 1))
+            elif key in changed or key in added:
+                versions.append((key, run, FULL, hashes[key], dump(card), 1))
+            elif checkpoint:
+                versions.append((key, run, FULL, hashes[key], dump(card), 0))
+        for key in sorted(removed):
+            versions.append((key, run, REMOVED, None, None, 1))
+
+        with self.db:
+            self.db.execute("INSERT INTO runs (run, createdOn, time, count, checkpoint) VALUES (?, ?, ?, ?, ?)",
+                            (run, str(createdOn), createdOn.timestamp(), len(cards), int(checkpoint)))
+            self.db.executemany("INSERT INTO versions (key, run, kind, hash, data, changed) VALUES (?, ?, ?, ?, ?, ?)",
+                                versions)
+            self.db.execute("DELETE FROM head")
+            self.db.executemany("INSERT INTO head (key, hash) VALUES (?, ?)", hashes.items())
+        return run
+
+    def getLastRun(self):
+        return self.db.execute("SELECT MAX(run) FROM runs").fetchone()[0]
+
+    # Return every run as a dict with the run, createdOn, count (of cards) and checkpoint.
+    def getRuns(self):
+        return [{'run': run, 'createdOn': createdOn, 'count': count, 'checkpoint': bool(checkpoint)}
+                for run, createdOn, count, checkpoint in
+                self.db.execute("SELECT run, createdOn, count, checkpoint FROM runs ORDER BY run")]
+
+    # Return the last run saved at or before when, a datetime (UTC if it's naive), or None.
+    def findRun(self, when):
+        if when.tzinfo is None:
+            when = pytz.utc.localize(when)
+        return self.db.execute("SELECT MAX(run) FROM runs WHERE time <= ?", (when.timestamp(),)).fetchone()[0]
+
+    # Return the card with that key as it was at the given run (the last one by default), or None if it didn't
+    # exist. The card is rebuilt from the last checkpoint before the run.
+    def getCard(self, key, run=None):
+        if run is None:
+            run = self.getLastRun()
+            if run is None:
+                return None
+
+        checkpoint = self.db.execute("SELECT MAX(run) FROM runs WHERE checkpoint = 1 AND run <= ?",
+                                     (run,)).fetchone()[0] or 0
+        card = None
+        for kind, data in self.db.execute("SELECT kind, data FROM versions WHERE key = ? AND run BETWEEN ? AND ? "
+                                          "ORDER BY run", (key, checkpoint, run)):
+            if kind == FULL:
+                card = json.loads(data)
+            elif kind == DELTA:
+                card = applyDelta(card, json.loads(data))
+            else:
+                card = None
+        return card
+
+    # Return the hash of the card with that key at the given run, or None if it didn't exist.
+    def getHash(self, key, run):
+        row = self.db.execute("SELECT hash FROM versions WHERE key = ? AND run <= ? ORDER BY run DESC LIMIT 1",
+                              (key, run)).fetchone()
+        return row[0] if row else None
+
+    # Return the changes between the runs first and last, like the changelog of the Indexer:
+    # {'added': [key], 'removed': [key], 'changed': {key: [field]}}.
+    # Only the cards saved as changed by the runs in between are compared.
+    def getChanges(self, first, last):
+        keys = [row[0] for row in self.db.execute("SELECT DISTINCT key FROM versions "
+                                                  "WHERE run > ? AND run <= ? AND changed = 1", (first, last))]
+        changes = {'added': [], 'removed': [], 'changed': {}}
+        for key in sorted(keys):
+            before = self.getHash(key, first)
+            after = self.getHash(key, last)
+            if before == after:
+                continue
+            if before is None:
+                changes['added'].append(key)
+            elif after is None:
+                changes['removed'].append(key)
+            else:
+                changes['changed'][key] = indexer.getChangedFields(
+                    indexer.getCardHashes(self.getCard(key, last))['fields'],
+                    indexer.getCardHashes(self.getCard(key, first))['fields'])
+        return changes
+
+    def close(self):
+        self.db.close()
+
+
+def dump(value):
+    return json.dumps(value, ensure_ascii=False, sort_keys=True)
+
+
+# Return the delta between two versions of a card.
+def getDelta(previous, card):
+    diff = differ(card, previous)
+    return {
+        'set': {field: card[field] for field in diff.added() | diff.changed()},
+        'unset': sorted(diff.removed())
+    }
+
+
+def applyDelta(card, delta):
+    card = dict(card)
+    card.update(delta['set'])
+    for field in delta['unset']:
+        card.pop(field, None)
+    return card
+
+
+# Parse a date given on the command line, in UTC.
+def parseDate(value):
+    for dateFormat in ('%Y-%m-%dT%H:%M:%S', '%Y-%m-%d %H:%M:%S', '%Y-%m-%d'):
+        try:
+            return pytz.utc.localize(datetime.strptime(value, dateFormat))
+        except ValueError:
+            pass
+    raise argparse.ArgumentTypeError("Invalid date: %s" % value)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Query the history of the cards saved by arachas.py.')
+    parser.add_argument('--file', help='History file.', default=DEFAULT_PATH, required=False)
+    parser.add_argument('--runs', help='List the runs.', action='store_true', required=False)
+    parser.add_argument('--card', help='Print the card with this key, as of --run or --date.', required=False)
+    parser.add_argument('--run', help='Run to query. Defaults to the last one.', type=int, required=False)
+    parser.add_argument('--date', help='Query the last run before this date (UTC), as 2017-07-14 or '
+                                       '2017-07-14T12:00:00.', type=parseDate, required=False)
+    parser.add_argument('--changes', help='Print the changes between two runs.', type=int, nargs=2,
+                        metavar=('FIRST', 'LAST'), required=False)
+    parser.add_argument('--add', help='Save the cards of a jsonl output as a new run.', required=False)
+    args = parser.parse_args()
+
+    if not os.path.exists(args.file) and not args.add:
+        parser.error("History not found: %s" % args.file)
+
+    with History(args.file) as history:
+        run = args.run
+        if args.date is not None:
+            run = history.findRun(args.date)
+            if run is None:
+                print("No run before %s" % args.date, file=sys.stderr)
+                sys.exit(1)
+
+        if args.add:
+            with open(args.add, 'r', encoding='utf-8') as f:
+                added = history.addRun(json.loads(line) for line in f)
+            print("Saved run %s" % added if added is not None else "No change since the last run")
+        elif args.runs:
+            for item in history.getRuns():
+                print("%(run)s\t%(createdOn)s\t%(count)s cards" % item + ("\tcheckpoint" if item['checkpoint'] else ""))
+        elif args.changes:
+            print(json.dumps(history.getChanges(*args.changes), ensure_ascii=False, sort_keys=True, indent=2))
+        elif args.card:
+            card = history.getCard(args.card, run)
+            if card is None:
+                print("Unknown card: %s" % args.card, file=sys.stderr)
+                sys.exit(1)
+            print(json.dumps(card, ensure_ascii=False, sort_keys=True))
+        else:
+            parser.print_help()
@@ -0,0 +1,142 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import os.path
+import json
+import hashlib
+import threading
+from collections import namedtuple
+
+# Response returned by the cache. It mimics the few attributes of a requests response that the crawler uses.
+# fromCache is True when the server answered 304 Not Modified and the body was read from the disk.
+CachedResponse = namedtuple('CachedResponse', ['status_code', 'content', 'fromCache'])
+
+
+# On-disk HTTP cache relying on conditional requests.
+# For every URL we keep the body of the last 200 response along with its ETag/Last-Modified validators.
+# The next time the URL is requested, the validators are sent back to the server and a 304 reuses the stored body.
+class HttpCache:
+    # Default folder for the cache. Start with dot for making it hidden on linux.
+    FOLDER_NAME = ".http_cache"
+
+    # session is anything with a requests-like get method (the requests module itself or a Session).
+    def __init__(self, session, folder=FOLDER_NAME):
+        self.session = session
+        self.folder = folder
+        # Number of responses served from the disk (304) and downloaded from the server.
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+        if not os.path.exists(self.folder):
+            os.makedirs(self.folder)
+
+    # Send a GET request for the url. Return a CachedResponse.
+    def get(self, url, headers=None, timeout=None):
+        res = self.session.get(url, headers=self.requestHeaders(url, headers), timeout=timeout)
+        cachedResponse = self.handleResponse(url, res.status_code, res.headers, res.content)
+        if cachedResponse is None:
+            # The entry was dropped, the request is sent again without validators.
+            res = self.session.get(url, headers=self.requestHeaders(url, headers), timeout=timeout)
+            cachedResponse = self.handleResponse(url, res.status_code, res.headers, res.content)
+        return cachedResponse
+
+    # Return a copy of headers with the validators of the stored entry added to it.
+    def requestHeaders(self, url, headers=None):
+        headers = dict(headers or {})
+        entry = self.loadEntry(url)
+
+        if entry is not None:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('lastModified'):
+                headers['If-Modified-Since'] = entry['lastModified']
+
+        return headers
+
+    # Process the answer of the server for a request built with requestHeaders.
+    # A 304 is turned into a 200 with the stored body so the callers don't have to care about the cache.
+    # Return None if the server answered 304 but the stored body is missing (deleted, or an entry left without its
+    # body): the entry is dropped and the caller must send the request again, without validators this time.
+    # Otherwise the stale validators would be sent again and again, and the url would never be downloaded.
+    def handleResponse(self, url, status, responseHeaders, content):
+        if status == 304:
+            body = self.loadBody(url)
+            if body is not None:
+                with self.lock:
+                    self.hits += 1
+                return CachedResponse(200, body, True)
+            if self.removeEntry(url):
+                return None
+
+        with self.lock:
+            self.misses += 1
+
+        if status == 200:
+            self.saveEntry(url, responseHeaders, content)
+
+        return CachedResponse(status, content, False)
+
+    # Return a dict with the hit and miss counters.
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses}
+
+    # The entries are saved under a name derived from the URL. Return the path without extension.
+    def entryPath(self, url):
+        digest = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        return os.path.join(self.folder, digest)
+
+    # Load the validators saved for the url. Return None if the url was never cached.
+    def loadEntry(self, url):
+        try:
+            with open(self.entryPath(url) + '.json', 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    # Load the body saved for the url. Return None if it's missing.
+    def loadBody(self, url):
+        try:
+            with open(self.entryPath(url) + '.body', 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    # Remove the validators and the body saved for the url. Return False if there were no validators.
+    def removeEntry(self, url):
+        path = self.entryPath(url)
+        removed = True
+        # The validators first, so they never point to a missing body.
+        for filepath in (path + '.json', path + '.body'):
+            try:
+                os.remove(filepath)
+            except FileNotFoundError:
+                if filepath.endswith('.json'):
+                    removed = False
+        return removed
+
+    # Save the body and the validators of a response.
+    # Responses without any validator are not saved since we would never be able to revalidate them.
+    def saveEntry(self, url, responseHeaders, content):
+        etag = responseHeaders.get('ETag')
+        lastModified = responseHeaders.get('Last-Modified')
+
+        if not (etag or lastModified):
+            return
+
+        entry = {'url': url, 'etag': etag, 'lastModified': lastModified}
+        path = self.entryPath(url)
+
+        # Write the body before the validators, and use a rename for both, so a crash never leaves
+        # validators pointing to a truncated body.
+        HttpCache.writeAtomic(path + '.body', content)
+        HttpCache.writeAtomic(path + '.json', json.dumps(entry, ensure_ascii=False, sort_keys=True).encode('utf-8'))
+
+    # Write data to a temporary file then rename it to filepath.
+    @staticmethod
+    def writeAtomic(filepath, data):
+        tmpPath = '%s.%s.tmp' % (filepath, threading.get_ident())
+        with open(tmpPath, 'wb') as f:
+            f.write(data)
+        os.replace(tmpPath, filepath)
@@ -0,0 +1,94 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import time
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+# Keep-alive connection pool shared by every worker thread of the crawler.
+# requests.Session objects are not guaranteed to be thread safe, so every thread gets its own session.
+# All those sessions are mounted on the same HTTPAdapter, whose urllib3 pool manager is thread safe.
+# This way the TCP connections opened by one thread are reused by the others.
+class HttpPool:
+    # poolSize is the maximum number of connections kept open for a single host.
+    # When every connection is busy, the threads wait for one to be returned instead of opening a new one.
+    # proxies is a requests proxies dict, for example {'http': 'http://127.0.0.1:8080'}.
+    # scheduler is an AdaptiveScheduler limiting the requests in flight and retrying the failed ones, or None.
+    def __init__(self, poolSize=10, proxies=None, scheduler=None):
+        self.poolSize = poolSize
+        self.proxies = proxies
+        self.scheduler = scheduler
+        self.adapter = HTTPAdapter(pool_connections=poolSize, pool_maxsize=poolSize, pool_block=True)
+        self.local = threading.local()
+
+    # Return the session of the calling thread, creating it on first use.
+    def session(self):
+        session = getattr(self.local, 'session', None)
+
+        if session is None:
+            session = requests.Session()
+            session.mount('http://', self.adapter)
+            session.mount('https://', self.adapter)
+            if self.proxies:
+                session.proxies.update(self.proxies)
+            self.local.session = session
+
+        return session
+
+    # Same signature as requests.get.
+    # With a scheduler, the request waits for its turn, and throttled requests, server errors and connection errors
+    # are sent again after a backoff. The last response is returned, or the last error raised, once the retries
+    # are exhausted.
+    def get(self, url, **kwargs):
+        if self.scheduler is None:
+            return self.session().get(url, **kwargs)
+
+        attempt = 0
+        while True:
+            self.scheduler.acquire(url)
+            start = time.perf_counter()
+            try:
+                res = self.session().get(url, **kwargs)
+            except requests.RequestException:
+                self.scheduler.release(url, time.perf_counter() - start, None)
+                delay = self.scheduler.retryDelay(attempt)
+                if delay is None:
+                    raise
+            else:
+                self.scheduler.release(url, time.perf_counter() - start, res.status_code)
+                delay = None
+                if self.scheduler.shouldRetry(res.status_code):
+                    delay = self.scheduler.retryDelay(attempt, res.headers.get('Retry-After'))
+                if delay is None:
+                    return res
+                # Give the connection back to the pool before waiting.
+                res.close()
+
+            time.sleep(delay)
+            attempt += 1
+
+    # Return a dict with the number of requests sent and connections opened for every host.
+    # A request that didn't need a new connection reused one from the pool.
+    def stats(self):
+        requestsCount = 0
+        connectionsCount = 0
+        # The connections made through a proxy are kept by a separate manager.
+        managers = [self.adapter.poolmanager] + list(self.adapter.proxy_manager.values())
+
+        for manager in managers:
+            for key in manager.pools.keys():
+                pool = manager.pools.get(key)
+                if pool is None:
+                    continue
+                requestsCount += pool.num_requests
+                connectionsCount += pool.num_connections
+
+        return {'requests': requestsCount, 'connections': connectionsCount,
+                'reused': max(requestsCount - connectionsCount, 0)}
+
+    # Close every connection of the pool.
+    def close(self):
+        self.adapter.close()
@@ -0,0 +1,258 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import os
+import os.path
+import re
+import json
+import shutil
+import hashlib
+import mimetypes
+import threading
+
+# Match the Content-Range header of a 206 response: "bytes <first>-<last>/<total or *>".
+contentRangeRegex = re.compile(r"^bytes (\d+)-(\d+)/(\d+|\*)$")
+
+
+# Content-addressed store for the artworks.
+# Every artwork is saved once under blobs/, named after the hash of its content, so identical artworks are
+# deduplicated. The manifest maps the name of every artwork (the key of the card, or the key followed by
+# "_thumbnail") to its source URL, its blob and the validators sent by the server. On the next run, the validators
+# are sent back and an unchanged artwork isn't downloaded again.
+# Downloads are written to a partial file and resumed with a Range request if they were interrupted.
+# The artworks stay available as <name>.<extension> in the folder, as hard links to the blobs.
+#
+# The store doesn't send the requests itself so it can be used by any HTTP client:
+#     download = store.start(name, url)
+#     (send the request with download.headers)
+#     if download.handle(status, responseHeaders):
+#         (for every chunk of the body) download.write(chunk)
+#         download.finish()
+#     download.close()
+#     (if download.retry, start again: the partial download couldn't be resumed and was dropped)
+class ImageStore:
+    BLOB_FOLDER = "blobs"
+    PARTIAL_FOLDER = ".partial"
+    MANIFEST_NAME = "manifest.json"
+    # The manifest is saved every SAVE_INTERVAL downloads, so an interrupted run keeps most of its validators.
+    SAVE_INTERVAL = 50
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.lock = threading.Lock()
+        self.updates = 0
+        # Number of artworks downloaded, found unchanged on the server, found identical to another blob and resumed.
+        self.counters = {'downloaded': 0, 'unchanged': 0, 'deduplicated': 0, 'resumed': 0}
+
+        for subfolder in [self.BLOB_FOLDER, self.PARTIAL_FOLDER]:
+            path = os.path.join(self.folder, subfolder)
+            if not os.path.exists(path):
+                os.makedirs(path)
+
+        try:
+            with open(os.path.join(self.folder, self.MANIFEST_NAME), 'r', encoding='utf-8') as f:
+                self.manifest = json.load(f)
+        except FileNotFoundError:
+            self.manifest = {}
+
+    # Begin the download of the artwork name from url. Return a Download.
+    def start(self, name, url):
+        return Download(self, name, url)
+
+    # Return the manifest entry of name if it's still valid for url, otherwise None.
+    def getEntry(self, name, url):
+        with self.lock:
+            entry = self.manifest.get(name)
+
+        if entry and entry['url'] == url and os.path.exists(self.blobPath(entry['blob'])):
+            return entry
+        return None
+
+    def blobPath(self, blob):
+        return os.path.join(self.folder, self.BLOB_FOLDER, blob[:2], blob)
+
+    def partialPath(self, name, url):
+        digest = hashlib.sha1((name + "\n" + url).encode('utf-8')).hexdigest()
+        return os.path.join(self.folder, self.PARTIAL_FOLDER, digest)
+
+    # Make <name>.<extension> point to the blob.
+    def link(self, name, entry):
+        extension = os.path.splitext(entry['blob'])[1]
+        filepath = os.path.join(self.folder, name + extension)
+        blobPath = self.blobPath(entry['blob'])
+
+        # Renaming a link over another link to the same file does nothing, so we have to check it first.
+        if os.path.exists(filepath) and os.path.samefile(blobPath, filepath):
+            return
+
+        tmpPath = filepath + '.tmp'
+        if os.path.exists(tmpPath):
+            os.remove(tmpPath)
+        try:
+            os.link(blobPath, tmpPath)
+        except OSError:
+            # Hard links aren't supported by every file system.
+            shutil.copyfile(blobPath, tmpPath)
+        os.replace(tmpPath, filepath)
+
+    # Record a finished download in the manifest.
+    def addEntry(self, name, entry, counter):
+        with self.lock:
+            self.manifest[name] = entry
+            self.counters[counter] += 1
+            self.updates += 1
+            if self.updates % self.SAVE_INTERVAL == 0:
+                self.saveManifestLocked()
+
+    def countUnchanged(self):
+        with self.lock:
+            self.counters['unchanged'] += 1
+
+    # Return a copy of the counters.
+    def stats(self):
+        with self.lock:
+            return dict(self.counters)
+
+    def saveManifest(self):
+        with self.lock:
+            self.saveManifestLocked()
+
+    def saveManifestLocked(self):
+        filepath = os.path.join(self.folder, self.MANIFEST_NAME)
+        with open(filepath + '.tmp', 'w', encoding='utf-8', newline='\n') as f:
+            json.dump(self.manifest, f, ensure_ascii=False, sort_keys=True, indent=2, separators=(',', ': '))
+        os.replace(filepath + '.tmp', filepath)
+
+
+# Download of a single artwork. See ImageStore.
+class Download:
+    def __init__(self, store, name, url):
+        self.store = store
+        self.name = name
+        self.url = url
+        self.entry = store.getEntry(name, url)
+        self.partialPath = store.partialPath(name, url)
+        self.file = None
+        # True when the partial download couldn't be resumed and was dropped. The artwork must be downloaded again.
+        self.retry = False
+        # Size of the whole artwork announced by a 206 response, or None.
+        self.totalLength = None
+
+        # Headers to add to the request.
+        self.headers = {}
+
+        if self.entry is not None:
+            if self.entry.get('etag'):
+                self.headers['If-None-Match'] = self.entry['etag']
+            if self.entry.get('lastModified'):
+                self.headers['If-Modified-Since'] = self.entry['lastModified']
+
+        # Resume an interrupted download, as long as the artwork didn't change in the meantime.
+        self.partial = self.loadPartial()
+        self.offset = 0
+        if self.partial and os.path.exists(self.partialPath):
+            offset = os.path.getsize(self.partialPath)
+            validator = self.partial.get('etag') or self.partial.get('lastModified')
+            if offset and validator:
+                self.offset = offset
+                self.headers['Range'] = 'bytes=%s-' % offset
+                self.headers['If-Range'] = validator
+
+    # Process the status and the headers of the response.
+    # Return True if the body must be streamed to write, otherwise the download is over.
+    def handle(self, status, responseHeaders):
+        if status == 304 and self.entry is not None:
+            self.store.link(self.name, self.entry)
+            self.store.countUnchanged()
+            return False
+
+        if status not in (200, 206) or (status == 206 and not self.checkRange(responseHeaders)):
+            if 'Range' in self.headers:
+                # The partial download can't be resumed, for example a 416 when the last run wrote the whole artwork
+                # but stopped before finish. Kept, it would fail the same way on every run.
+                self.discardPartial()
+                self.retry = True
+            return False
+
+        self.contentType = responseHeaders.get('content-type')
+        self.resumed = status == 206
+        self.validators = {'etag': responseHeaders.get('ETag'), 'lastModified': responseHeaders.get('Last-Modified')}
+        self.digest = hashlib.sha256()
+
+        if self.resumed:
+            # The hash covers the whole artwork, including the part downloaded by the last run.
+            with open(self.partialPath, 'rb') as f:
+                for chunk in iter(lambda: f.read(64 * 1024), b''):
+                    self.digest.update(chunk)
+            self.file = open(self.partialPath, 'ab')
+        else:
+            self.file = open(self.partialPath, 'wb')
+            # Remember the validators so the download can be resumed if it's interrupted.
+            with open(self.partialPath + '.json', 'w', encoding='utf-8') as f:
+                json.dump(self.validators, f)
+
+        return True
+
+    # Return True if a 206 response continues the partial file. Remember the size of the whole artwork.
+    def checkRange(self, responseHeaders):
+        match = contentRangeRegex.match(responseHeaders.get('Content-Range') or '')
+        if not match or int(match.group(1)) != self.offset:
+            return False
+        if match.group(3) != '*':
+            self.totalLength = int(match.group(3))
+        return True
+
+    # Remove the partial file and its validators.
+    def discardPartial(self):
+        for filepath in (self.partialPath, self.partialPath + '.json'):
+            if os.path.exists(filepath):
+                os.remove(filepath)
+
+    def write(self, chunk):
+        self.file.write(chunk)
+        self.digest.update(chunk)
+
+    # Move the downloaded artwork to its blob and update the manifest.
+    def finish(self):
+        self.file.close()
+        self.file = None
+
+        if self.resumed and self.totalLength is not None and os.path.getsize(self.partialPath) != self.totalLength:
+            # A part of the artwork is missing, the next run downloads it again from the start.
+            size = os.path.getsize(self.partialPath)
+            self.discardPartial()
+            raise ValueError("Resumed artwork of %s bytes instead of %s: %s" % (size, self.totalLength, self.url))
+
+        extension = mimetypes.guess_extension(self.contentType or '') or ''
+        blob = self.digest.hexdigest() + extension
+        blobPath = self.store.blobPath(blob)
+
+        if os.path.exists(blobPath):
+            # The same artwork is already stored, maybe for another card.
+            os.remove(self.partialPath)
+            counter = 'deduplicated'
+        else:
+            if not os.path.exists(os.path.dirname(blobPath)):
+                os.makedirs(os.path.dirname(blobPath), exist_ok=True)
+            os.replace(self.partialPath, blobPath)
+            counter = 'resumed' if self.resumed else 'downloaded'
+
+        if os.path.exists(self.partialPath + '.json'):
+            os.remove(self.partialPath + '.json')
+
+        entry = dict(self.validators, url=self.url, blob=blob, contentType=self.contentType)
+        self.store.link(self.name, entry)
+        self.store.addEntry(self.name, entry, counter)
+
+    # Close the partial file if the download was interrupted. It will be resumed by the next run.
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+    # Load the validators of a partial download. Return None if there is none.
+    def loadPartial(self):
+        try:
+            with open(self.partialPath + '.json', 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
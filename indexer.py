@@ -4,6 +4,7 @@
 import os.path
 import json
 import ctypes
+import hashlib
 import pytz
 from datetime import datetime
 from DictDiffer import DictDiffer as differ
@@ -15,24 +16,62 @@ FILE_ATTRIBUTE_NORMAL = 0x80
 WINDOWS_FILE_NOT_FOUND_ERRNO = 2
 
 
+# Return a stable hash of any json serializable value.
+# The keys are sorted so the hash doesn't depend on the order in which the fields were added.
+def hashValue(value):
+    return hashlib.sha1(json.dumps(value, ensure_ascii=False, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+# Return the hash of the whole card and the hash of every field of the card.
+def getCardHashes(card):
+    return {
+        'hash': hashValue(card),
+        'fields': {field: hashValue(value) for field, value in getFields(card).items()}
+    }
+
+
+# Flatten the nested maps of a card (and the lists of maps, like the variations) into a single map.
+# The names of the nested fields are joined with dots, for example "variations.0.rarity".
+def getFields(value, prefix=""):
+    if isinstance(value, dict):
+        items = value.items()
+    elif isinstance(value, list) and any(isinstance(element, dict) for element in value):
+        items = enumerate(value)
+    else:
+        return {prefix: value}
+
+    fields = {}
+    for name, element in items:
+        fields.update(getFields(element, "%s.%s" % (prefix, name) if prefix else str(name)))
+    return fields
+
+
+# Return the sorted list of the fields that are different between two maps of field hashes.
+def getChangedFields(currentFields, savedFields):
+    diff = differ(currentFields, savedFields)
+    return sorted(diff.added() | diff.removed() | diff.changed())
+
+
 # s
 class Indexer:
     # Default name for the index. Start with dot for making it hidden on linux.
     FILE_NAME = ".card_index"
+    # Machine friendly log of the changes found by the last run.
+    CHANGELOG_NAME = "card_changelog.json"
 
-    # Takes as a parameter a list of cards.
+    # Takes as a parameter a list of cards, or any iterable of cards.
     def __init__(self, cardList):
 
-        # The data format of the index is just the key value of the card.
-        # We put True as a value but we only care if the key exist or not.
-        indexCards = {value['key']: True for value in cardList}
+        # The index maps the key of every card to the hash of the card and the hash of every one of its fields.
+        # Comparing the hashes is enough to know which cards and which fields changed between two runs.
+        indexCards = {value['key']: getCardHashes(value) for value in cardList}
 
         # The new index made up from the fresh data.
         currentIndexMap = {}
         currentIndexMap['cards'] = indexCards
         # We use pytz to make our datetime in UTC time.
         currentIndexMap['createdOn'] = str(datetime.now(pytz.utc))
-        currentIndexMap['count'] = len(cardList)
+        currentIndexMap['count'] = len(indexCards)
         self.currentIndexMap = currentIndexMap
 
         # We try to load a previously saved index file.
@@ -95,31 +134,53 @@ class Indexer:
 
     # Verify the saved index against the fresh data.
     # Return true if the saved index needs to be refreshed, otherwise false.
-    # Will print a summary of deleted/added cards.
+    # Will print a summary of deleted/added/changed cards and save it in the changelog.
     def verifyIndex(self):
         needReIndex = False
 
+        currentCards = self.currentIndexMap['cards']
+        savedCards = self.savedIndex['cards']
+
         # Object used to calculate the difference between the two dict.
-        # We only pass the "cards" key because it contain all the cards and we are not interested in the card
-        # counts or the createdOn key.
-        diff = differ(self.currentIndexMap['cards'], self.savedIndex['cards'])
+        # We only pass the hash of the cards because we are not interested in the card counts or the createdOn key.
+        # Indexes saved by older versions only have True instead of the hashes. Their cards can't be compared
+        # but the index is upgraded.
+        diff = differ({key: value['hash'] for key, value in currentCards.items()},
+                      {key: value['hash'] if isinstance(value, dict) else None for key, value in savedCards.items()})
         # Set of keys that were added.
         added = diff.added()
         # Set of keys that were removed.
         removed = diff.removed()
+        # Map of the keys that were changed to the list of the fields that were changed.
+        changed = {key: getChangedFields(currentCards[key]['fields'], savedCards[key]['fields'])
+                   for key in diff.changed() if isinstance(savedCards[key], dict)}
 
-        if len(added) > 0 or len(removed) > 0:
+        if len(added) > 0 or len(removed) > 0 or len(diff.changed()) > 0:
             needReIndex = True
 
-        self.printSummary(added, removed)
+        self.printSummary(added, removed, changed)
+        self.saveChangelog(added, removed, changed)
 
         return needReIndex
         # Todo: prompt action if something changed.
-        # Todo: Write a machine friendly log that could be used to automate.
 
-    def printSummary(self, added, removed):
+    # Save the changes in a json file that can be used to automate.
+    def saveChangelog(self, added, removed, changed):
+        changelog = {
+            'createdOn': self.currentIndexMap['createdOn'],
+            'previousCreatedOn': self.savedIndex.get('createdOn'),
+            'added': sorted(added),
+            'removed': sorted(removed),
+            'changed': changed
+        }
+
+        filepath = os.path.join('./' + self.CHANGELOG_NAME)
+        with open(filepath, "w", encoding="utf-8", newline="\n") as f:
+            json.dump(changelog, f, ensure_ascii=False, sort_keys=True, indent=2, separators=(',', ': '))
+
+    def printSummary(self, added, removed, changed):
 
-        if not (len(added) or len(removed)):
+        if not (len(added) or len(removed) or len(changed)):
             return
         message = "SUMMARY OF CHANGES"
 
@@ -142,6 +203,13 @@ class Indexer:
                 print(colored(card, "red"))
             print()
 
+        if len(changed) > 0:
+            print()
+            print("The following cards were changed: \n")
+            for card, fields in sorted(changed.items()):
+                print(colored(card, "yellow") + " (" + ", ".join(fields) + ")")
+            print()
+
         if len(removed) > 0 and len(added) > 0:
             print(colored("WARNING: ", "yellow"))
             print("It's possible one of the card(s) was renamed.\n")
@@ -0,0 +1,116 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import os
+import os.path
+import json
+import threading
+
+
+# Record the progress of a crawl, so a crawl that died halfway can be resumed instead of started over.
+# Every record is a json line appended to the journal and flushed right away, so it survives a crash of the process:
+#     {"type": "pages", "urls": [...]}                    the pages of the table view
+#     {"type": "page", "url": ..., "rows": [...]}         a page whose rows were all queued
+#     {"type": "card", "url": ..., "card": {...}}         a card ready to be saved
+#     {"type": "image", "name": ...}                      an artwork downloaded
+# The journal is removed once the outputs are saved.
+class Journal:
+    # filepath is the path of the journal. When resume is True, the records of the interrupted crawl are loaded and
+    # the new records are appended to them. Otherwise the journal starts empty.
+    def __init__(self, filepath, resume=False):
+        self.filepath = filepath
+        self.lock = threading.Lock()
+        # The pages of the table view, or None if they weren't found yet.
+        self.pages = None
+        # Rows of every page done.
+        self.pageRows = {}
+        # Key of every card done, by url.
+        self.cardKeys = {}
+        # Name of every artwork done.
+        self.images = set()
+
+        if resume and os.path.exists(filepath):
+            self.load()
+            self.file = open(filepath, "ab")
+        else:
+            self.file = open(filepath, "wb")
+
+    # True if the journal has the records of an interrupted crawl.
+    @property
+    def resumed(self):
+        return self.pages is not None
+
+    def addPages(self, urls):
+        self.pages = urls
+        self.write({'type': 'pages', 'urls': urls})
+
+    def addPage(self, url, rows):
+        self.pageRows[url] = rows
+        self.write({'type': 'page', 'url': url, 'rows': rows})
+
+    def addCard(self, url, card):
+        self.write({'type': 'card', 'url': url, 'card': card})
+        with self.lock:
+            self.cardKeys[url] = card['key']
+
+    def addImage(self, name):
+        self.write({'type': 'image', 'name': name})
+        with self.lock:
+            self.images.add(name)
+
+    # Return the key of the card of url if it's done, otherwise None.
+    def getCardKey(self, url):
+        with self.lock:
+            return self.cardKeys.get(url)
+
+    def hasImage(self, name):
+        with self.lock:
+            return name in self.images
+
+    def write(self, record):
+        line = json.dumps(record, ensure_ascii=False, sort_keys=True).encode("utf-8")
+        with self.lock:
+            self.file.write(line + b"\n")
+            self.file.flush()
+
+    # Iterate over the cards recorded by the interrupted crawl. They aren't kept in memory.
+    def iterCards(self):
+        with open(self.filepath, "rb") as f:
+            for line in f:
+                record = json.loads(line)
+                if record['type'] == 'card':
+                    yield record['card']
+
+    # Load the records of the interrupted crawl.
+    def load(self):
+        validLength = 0
+
+        with open(self.filepath, "rb") as f:
+            for line in f:
+                try:
+                    if not line.endswith(b"\n"):
+                        raise ValueError("Incomplete record")
+                    record = json.loads(line)
+                except ValueError:
+                    # The crash happened while the last record was written.
+                    break
+                validLength += len(line)
+
+                if record['type'] == 'pages':
+                    self.pages = record['urls']
+                elif record['type'] == 'page':
+                    self.pageRows[record['url']] = record['rows']
+                elif record['type'] == 'card':
+                    self.cardKeys[record['url']] = record['card']['key']
+                elif record['type'] == 'image':
+                    self.images.add(record['name'])
+
+        # Drop the half-written record, so the new records start on a line of their own.
+        with open(self.filepath, "r+b") as f:
+            f.truncate(validLength)
+
+    # Close the journal. When remove is True, the crawl is over and the journal is removed.
+    def close(self, remove=True):
+        self.file.close()
+        if remove:
+            os.remove(self.filepath)
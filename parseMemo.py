@@ -0,0 +1,135 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import os.path
+import sys
+import json
+import time
+import hashlib
+import sqlite3
+import argparse
+import threading
+
+import gwentifyHandler as siteHandler
+
+# Default file of the memo. Start with dot for making it hidden on linux.
+DEFAULT_PATH = ".parse_memo.db"
+
+# Default most bytes of cards kept in the memo.
+MAX_SIZE = 100 * 1024 * 1024
+
+# Number of cards added between two commits.
+COMMIT_INTERVAL = 100
+
+
+# Cards already parsed, saved in a SQLite file by the hash of the html of their page and of the parser version (see
+# gwentifyHandler.getParserVersion). A card page with the same bytes as in a previous crawl isn't parsed again, even
+# when the server doesn't answer the conditional requests of the HttpCache.
+# When the cards take more than maxSize bytes, the least recently used ones are evicted by flush.
+# A memo can be used by several threads at the same time.
+class ParseMemo:
+    def __init__(self, filepath=DEFAULT_PATH, maxSize=MAX_SIZE):
+        self.filepath = filepath
+        self.maxSize = maxSize
+        self.version = siteHandler.getParserVersion().encode('ascii')
+        self.lock = threading.Lock()
+        # Number of cards found in the memo, parsed and evicted.
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        # Digests of the cards found since the last flush, whose last use is saved by flush.
+        self.used = set()
+        self.pending = 0
+
+        self.db = sqlite3.connect(filepath, check_same_thread=False)
+        with self.db:
+            self.db.execute("CREATE TABLE IF NOT EXISTS memo (digest BLOB PRIMARY KEY, card TEXT NOT NULL, "
+                            "size INTEGER NOT NULL, used REAL NOT NULL)")
+            self.db.execute("CREATE INDEX IF NOT EXISTS memoUsed ON memo (used)")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def digest(self, content):
+        return hashlib.sha1(self.version + content).digest()
+
+    # Return the card parsed from content, the html of a card page, or None if it's not in the memo.
+    def get(self, content):
+        digest = self.digest(content)
+        with self.lock:
+            row = self.db.execute("SELECT card FROM memo WHERE digest = ?", (digest,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.used.add(digest)
+        return json.loads(row[0])
+
+    # Save the card parsed from content.
+    def add(self, content, card):
+        digest = self.digest(content)
+        card = json.dumps(card, ensure_ascii=False, sort_keys=True)
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO memo (digest, card, size, used) VALUES (?, ?, ?, ?)",
+                            (digest, card, len(digest) + len(card.encode('utf-8')), time.time()))
+            self.pending += 1
+            if self.pending >= COMMIT_INTERVAL:
+                self.db.commit()
+                self.pending = 0
+
+    # Save the cards added and the last use of the cards found, then evict the least recently used cards until they
+    # take less than 90% of maxSize, so the next crawls don't evict on every flush.
+    def flush(self):
+        with self.lock:
+            now = time.time()
+            self.db.executemany("UPDATE memo SET used = ? WHERE digest = ?", [(now, digest) for digest in self.used])
+            self.used.clear()
+            self.pending = 0
+
+            total = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM memo").fetchone()[0]
+            if total > self.maxSize:
+                evicted = []
+                for digest, size in self.db.execute("SELECT digest, size FROM memo ORDER BY used"):
+                    if total <= self.maxSize * 0.9:
+                        break
+                    evicted.append((digest,))
+                    total -= size
+                self.db.executemany("DELETE FROM memo WHERE digest = ?", evicted)
+                self.evicted += len(evicted)
+            self.db.commit()
+
+    # Return a dict with the hit, miss and eviction counters.
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evicted': self.evicted}
+
+    # Return the number of cards and the bytes they take.
+    def size(self):
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM memo").fetchone()
+
+    def close(self):
+        self.flush()
+        self.db.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Show or clear the cards parsed by arachas.py and kept in the '
+                                                 'parse memo.')
+    parser.add_argument('--file', help='Parse memo file.', default=DEFAULT_PATH, required=False)
+    parser.add_argument('--clear', help='Remove every card from the memo.', action='store_true', required=False)
+    args = parser.parse_args()
+
+    if not os.path.exists(args.file):
+        print("Parse memo not found: %s" % args.file, file=sys.stderr)
+        sys.exit(1)
+
+    with ParseMemo(args.file) as memo:
+        if args.clear:
+            with memo.db:
+                memo.db.execute("DELETE FROM memo")
+            memo.db.execute("VACUUM")
+        print("%s cards, %s bytes" % memo.size())
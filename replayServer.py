@@ -0,0 +1,137 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import sys
+import time
+import signal
+import random
+import hashlib
+import argparse
+import threading
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+
+import requests
+
+import gwentifyHandler as siteHandler
+from corpus import Corpus
+
+# Timeout for the requests module when recording.
+TIMEOUT = 30.0
+
+
+# Local stand-in for the website. It's used as an HTTP proxy by the crawler (arachas.py --proxy), so the crawler
+# keeps requesting the real URLs and no link has to be rewritten.
+# When replaying, every response comes from the corpus after a simulated network latency.
+# When recording, every request is forwarded to the real website and the response is added to the corpus.
+class ReplayServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    # latency and jitter are in seconds. Every response is delayed by latency plus or minus a random jitter.
+    def __init__(self, address, corpus, latency=0.0, jitter=0.0, record=False):
+        HTTPServer.__init__(self, address, ReplayHandler)
+        self.corpus = corpus
+        self.latency = latency
+        self.jitter = jitter
+        self.record = record
+        # Time spent answering every request, used by the benchmark.
+        self.requestTimes = []
+        self.lock = threading.Lock()
+
+    # Sleep for the simulated network latency.
+    def delay(self):
+        seconds = self.latency + random.uniform(-self.jitter, self.jitter)
+        if seconds > 0:
+            time.sleep(seconds)
+
+    def addRequestTime(self, seconds):
+        with self.lock:
+            self.requestTimes.append(seconds)
+
+
+class ReplayHandler(BaseHTTPRequestHandler):
+    # Keep the connections alive like the real website.
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        start = time.perf_counter()
+
+        # A proxy receives the absolute URL. Also accept direct requests to the server.
+        url = self.path
+        if not url.startswith('http'):
+            url = 'http://' + self.headers.get('Host', '') + self.path
+
+        if self.server.record:
+            self.recordUrl(url)
+        else:
+            self.server.delay()
+
+        recorded = self.server.corpus.get(url)
+
+        if recorded is None:
+            self.sendResponse(404, None, b'')
+        else:
+            status, contentType, content = recorded
+            etag = '"%s"' % hashlib.sha1(content).hexdigest()
+
+            if status == 200 and self.headers.get('If-None-Match') == etag:
+                self.sendResponse(304, None, b'', etag)
+            else:
+                self.sendResponse(status, contentType, content, etag)
+
+        self.server.addRequestTime(time.perf_counter() - start)
+
+    # Download the url from the real website and add it to the corpus.
+    def recordUrl(self, url):
+        try:
+            res = requests.get(url, headers=siteHandler.HEADERS, timeout=TIMEOUT)
+        except requests.RequestException as e:
+            print("Unable to record %s: %s" % (url, e))
+            return
+
+        self.server.corpus.add(url, res.status_code, res.headers.get('content-type'), res.content)
+
+    def sendResponse(self, status, contentType, content, etag=None):
+        self.send_response(status)
+        if contentType:
+            self.send_header('Content-Type', contentType)
+        if etag:
+            self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    # Don't print a line for every request.
+    def log_message(self, format, *args):
+        pass
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Replay a recorded corpus of the website, or record a new one. '
+                                                 'Run the crawler with --proxy http://<host>:<port> to use it.')
+    parser.add_argument('corpus', help='Folder of the corpus.')
+    parser.add_argument('--host', help='Address to listen on.', default='127.0.0.1', required=False)
+    parser.add_argument('--port', help='Port to listen on.', type=int, default=8080, required=False)
+    parser.add_argument('--latency', help='Simulated latency of every response, in seconds.',
+                        type=float, default=0.0, required=False)
+    parser.add_argument('--jitter', help='Random variation of the latency, in seconds.',
+                        type=float, default=0.0, required=False)
+    parser.add_argument('--record', help='Forward the requests to the real website and record the responses.',
+                        action='store_true', required=False)
+    args = parser.parse_args()
+
+    server = ReplayServer((args.host, args.port), Corpus(args.corpus), args.latency, args.jitter, args.record)
+    print("%s on http://%s:%s" % ("Recording" if args.record else "Replaying", args.host, args.port))
+
+    # Also save the recording when the server is stopped with a SIGTERM.
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if args.record:
+            server.corpus.saveIndex()
+            print("Recorded %s responses." % len(server.corpus.index))
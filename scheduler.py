@@ -0,0 +1,183 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import time
+import random
+import asyncio
+import threading
+from urllib.parse import urlsplit
+
+# Factor applied to the concurrency limit of a host after an error or a throttled response.
+ERROR_DECREASE = 0.5
+# Factor applied to the concurrency limit of a host when its latency goes up.
+LATENCY_DECREASE = 0.75
+# The latency of a host is considered to go up when it's LATENCY_TOLERANCE times the best latency seen, and at least
+# MIN_LATENCY_INCREASE seconds more. Without the minimum, the noise of a fast host would be taken for congestion.
+LATENCY_TOLERANCE = 3.0
+MIN_LATENCY_INCREASE = 0.1
+# The best latency seen slowly follows the latency, so a host that became slower for good isn't seen as congested
+# forever.
+BEST_LATENCY_DRIFT = 0.01
+# Weight of the last request in the moving average of the latency.
+LATENCY_SMOOTHING = 0.2
+# Longest time a waiting request sleeps before checking again if it can be sent.
+POLL_INTERVAL = 0.05
+
+
+# Concurrency limit and rate limit of a single host.
+# The concurrency limit follows an AIMD scheme: it grows by one request per round trip while the host answers
+# quickly, and it's divided on errors, throttled responses or when the latency goes up.
+# The rate limit is a token bucket refilled at rate requests per second, holding up to burst tokens.
+class HostLimiter:
+    def __init__(self, maxLimit, rate=0.0, burst=1):
+        self.maxLimit = maxLimit
+        self.limit = max(1.0, maxLimit / 2.0)
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.lastRefill = time.monotonic()
+        self.inFlight = 0
+        self.latency = None
+        self.bestLatency = None
+        self.lastDecrease = 0.0
+
+    # Take a slot for a request if possible. Return 0 if the request can be sent, otherwise the time to wait
+    # in seconds before trying again.
+    def tryAcquire(self):
+        now = time.monotonic()
+
+        if self.rate > 0:
+            self.tokens = min(self.burst, self.tokens + (now - self.lastRefill) * self.rate)
+            self.lastRefill = now
+
+        if self.inFlight >= int(self.limit):
+            return POLL_INTERVAL
+
+        if self.rate > 0:
+            if self.tokens < 1:
+                return min((1 - self.tokens) / self.rate, POLL_INTERVAL)
+            self.tokens -= 1
+
+        self.inFlight += 1
+        return 0
+
+    # Give back the slot of a request. latency is in seconds.
+    # failed is True when the request raised an error, was throttled or the server failed.
+    def release(self, latency, failed):
+        self.inFlight -= 1
+        now = time.monotonic()
+
+        if failed:
+            self.decrease(ERROR_DECREASE, now)
+            return
+
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency += LATENCY_SMOOTHING * (latency - self.latency)
+        if self.bestLatency is None or self.latency < self.bestLatency:
+            self.bestLatency = self.latency
+        else:
+            self.bestLatency += BEST_LATENCY_DRIFT * (self.latency - self.bestLatency)
+
+        threshold = max(self.bestLatency * LATENCY_TOLERANCE, self.bestLatency + MIN_LATENCY_INCREASE)
+        if self.latency > threshold:
+            self.decrease(LATENCY_DECREASE, now)
+        else:
+            # Additive increase: about one more request in flight for every round trip of the whole window.
+            self.limit = min(self.maxLimit, self.limit + 1.0 / self.limit)
+
+    # Multiplicative decrease. Only once per round trip, since the requests already in flight were sent
+    # with the old limit and will report the same problem.
+    def decrease(self, factor, now):
+        if now - self.lastDecrease < (self.latency or 0):
+            return
+        self.limit = max(1.0, self.limit * factor)
+        self.lastDecrease = now
+
+
+# Schedule the requests of the crawler: a HostLimiter for every host, and the retry policy for the requests
+# that failed or were throttled. Every method can be called from any thread. acquireAsync is meant for asyncio.
+class AdaptiveScheduler:
+    # maxConcurrency is the maximum number of requests in flight for a single host.
+    # rate is the maximum number of requests per second for a single host, 0 for no limit.
+    # maxRetries is the number of times a failed request is sent again.
+    # backoff is the delay in seconds before the first retry. It doubles at every retry, up to maxBackoff.
+    def __init__(self, maxConcurrency=10, rate=0.0, burst=1, maxRetries=5, backoff=0.5, maxBackoff=30.0):
+        self.maxConcurrency = maxConcurrency
+        self.rate = rate
+        self.burst = burst
+        self.maxRetries = maxRetries
+        self.backoff = backoff
+        self.maxBackoff = maxBackoff
+        self.limiters = {}
+        self.condition = threading.Condition()
+        self.retries = 0
+        self.failures = 0
+
+    def getLimiter(self, url):
+        host = urlsplit(url).netloc
+        limiter = self.limiters.get(host)
+        if limiter is None:
+            limiter = self.limiters[host] = HostLimiter(self.maxConcurrency, self.rate, self.burst)
+        return limiter
+
+    # Block until a request to url can be sent.
+    def acquire(self, url):
+        with self.condition:
+            limiter = self.getLimiter(url)
+            wait = limiter.tryAcquire()
+            while wait:
+                self.condition.wait(wait)
+                wait = limiter.tryAcquire()
+
+    # Wait without blocking the event loop until a request to url can be sent.
+    async def acquireAsync(self, url):
+        while True:
+            with self.condition:
+                wait = self.getLimiter(url).tryAcquire()
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+    # Must be called once the response of a request acquired for url is received.
+    # status is None when the request raised an error.
+    def release(self, url, latency, status):
+        with self.condition:
+            failed = status is None or self.shouldRetry(status)
+            if failed:
+                self.failures += 1
+            self.getLimiter(url).release(latency, failed)
+            self.condition.notify_all()
+
+    # Return True if a response with that status should be retried: throttled or server error.
+    def shouldRetry(self, status):
+        return status == 429 or 500 <= status < 600
+
+    # Return the number of seconds to wait before sending a request again after attempt failed attempts,
+    # or None if it shouldn't be retried anymore.
+    # retryAfter is the value of the Retry-After header of the response, if any.
+    def retryDelay(self, attempt, retryAfter=None):
+        if attempt >= self.maxRetries:
+            return None
+
+        with self.condition:
+            self.retries += 1
+
+        # Exponential backoff with full jitter, so the retries of many requests don't all fire at once.
+        delay = random.uniform(0, min(self.maxBackoff, self.backoff * 2 ** attempt))
+
+        # The server knows better. Retry-After can also be a date, which we don't bother to parse.
+        if retryAfter is not None:
+            try:
+                delay = max(delay, min(self.maxBackoff, float(retryAfter)))
+            except ValueError:
+                pass
+
+        return delay
+
+    # Return a dict with the number of retries and failures and the concurrency limit of every host.
+    def stats(self):
+        with self.condition:
+            return {'retries': self.retries, 'failures': self.failures,
+                    'limits': {host: int(limiter.limit) for host, limiter in self.limiters.items()}}
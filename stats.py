@@ -0,0 +1,182 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+# Upper bounds of the histogram buckets, in milliseconds. The last bucket holds everything slower.
+BUCKETS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000]
+
+# Most samples kept for every queue. Past it, every other sample is dropped and the interval doubled, so a long crawl
+# keeps samples over its whole duration in a bounded memory.
+MAX_SAMPLES = 10000
+
+
+# Call function with args and measure how long it takes.
+# Return a tuple of the result and the duration in seconds.
+# It's a module function so it can be sent to a process pool.
+def timedCall(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+# Return the counters minus the counters taken earlier, for example the requests of a single crawl from the
+# counters of an HttpPool kept by every crawl of the daemon.
+def difference(counters, previous):
+    return {name: value - previous.get(name, 0) for name, value in counters.items()}
+
+
+# Histogram of durations with fixed buckets. Not thread safe on its own, PipelineStats holds the lock.
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS_MS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, seconds):
+        milliseconds = seconds * 1000
+        index = 0
+        while index < len(BUCKETS_MS) and milliseconds > BUCKETS_MS[index]:
+            index += 1
+
+        self.counts[index] += 1
+        self.count += 1
+        self.total += milliseconds
+        self.min = milliseconds if self.min is None else min(self.min, milliseconds)
+        self.max = milliseconds if self.max is None else max(self.max, milliseconds)
+
+    def report(self):
+        buckets = {'<=%sms' % bound: count for bound, count in zip(BUCKETS_MS, self.counts)}
+        buckets['>%sms' % BUCKETS_MS[-1]] = self.counts[-1]
+
+        return {
+            'count': self.count,
+            'meanMs': self.total / self.count if self.count else 0.0,
+            'minMs': self.min,
+            'maxMs': self.max,
+            'buckets': buckets
+        }
+
+
+# Collect the telemetry of every stage of the crawl: queue depths over time, fetch latencies, bytes transferred,
+# parse time per card, time the workers spend busy or waiting for work and the duration of the final steps.
+# Every method is thread safe and cheap enough to be called for every request.
+# The times are measured from the creation of the stats, or from startSampling: create new stats for every crawl.
+class PipelineStats:
+    # interval is the time in seconds between two samples of the queue depths.
+    # maxSamples is the most samples kept for every queue.
+    def __init__(self, interval=0.1, maxSamples=MAX_SAMPLES):
+        self.interval = interval
+        self.maxSamples = maxSamples
+        self.lock = threading.Lock()
+        self.start = time.perf_counter()
+
+        # Functions returning the depth of every watched queue, and their samples as (time, depth) pairs.
+        self.queues = {}
+        self.depths = {}
+        self.fetchLatencies = {}
+        self.bytesTransferred = {}
+        self.parseTimes = Histogram()
+        # Busy and idle seconds of the workers of every stage.
+        self.workerTimes = {}
+        self.durations = {}
+
+        self.sampling = threading.Event()
+        self.samplingThread = None
+
+    # Sample the depth of a queue over time. depthFunction returns the current depth, for example Queue.qsize.
+    def watch(self, name, depthFunction):
+        with self.lock:
+            self.queues[name] = depthFunction
+            self.depths[name] = []
+
+    # Start sampling the watched queues in a background thread. The elapsed time is measured from here.
+    # Nothing is done if the samples are already being taken.
+    def startSampling(self):
+        if self.sampling.is_set():
+            return
+        self.start = time.perf_counter()
+        self.sampling.set()
+        self.samplingThread = threading.Thread(target=self.sample)
+        self.samplingThread.daemon = True
+        self.samplingThread.start()
+
+    # Stop sampling, once the last sample is taken.
+    def stopSampling(self):
+        self.sampling.clear()
+        if self.samplingThread is not None:
+            self.samplingThread.join()
+            self.samplingThread = None
+
+    def sample(self):
+        while self.sampling.is_set():
+            self.takeSample()
+            time.sleep(self.interval)
+
+    def takeSample(self):
+        now = round(time.perf_counter() - self.start, 3)
+        with self.lock:
+            for name, depthFunction in self.queues.items():
+                self.depths[name].append((now, depthFunction()))
+            if any(len(samples) >= self.maxSamples for samples in self.depths.values()):
+                for samples in self.depths.values():
+                    del samples[1::2]
+                self.interval *= 2
+
+    # Record a request of a stage. size is the size of the body in bytes.
+    def addFetch(self, stage, seconds, size):
+        with self.lock:
+            self.fetchLatencies.setdefault(stage, Histogram()).add(seconds)
+            self.bytesTransferred[stage] = self.bytesTransferred.get(stage, 0) + size
+
+    # Record the time taken to parse a card.
+    def addParse(self, seconds):
+        with self.lock:
+            self.parseTimes.add(seconds)
+
+    # Record the time a worker of a stage spent processing a task and waiting for it.
+    def addWorkerTime(self, stage, busy, idle):
+        with self.lock:
+            times = self.workerTimes.setdefault(stage, [0.0, 0.0])
+            times[0] += busy
+            times[1] += idle
+
+    # Measure the duration of the block under the given name.
+    @contextmanager
+    def timed(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.durations[name] = time.perf_counter() - start
+
+    # Return every metric as a dict that can be saved in json.
+    def report(self):
+        with self.lock:
+            workers = {}
+            for stage, (busy, idle) in self.workerTimes.items():
+                workers[stage] = {'busySeconds': busy, 'idleSeconds': idle,
+                                  'busyRatio': busy / (busy + idle) if busy + idle else 0.0}
+
+            return {
+                'elapsedSeconds': time.perf_counter() - self.start,
+                'queueDepths': {name: [list(sample) for sample in samples] for name, samples in self.depths.items()},
+                'maxQueueDepths': {name: max([depth for _, depth in samples] or [0])
+                                   for name, samples in self.depths.items()},
+                'fetchLatencies': {stage: histogram.report() for stage, histogram in self.fetchLatencies.items()},
+                'bytesTransferred': dict(self.bytesTransferred),
+                'parseTimes': self.parseTimes.report(),
+                'workers': workers,
+                'durations': dict(self.durations)
+            }
+
+    # Save the report in a json file.
+    def save(self, filepath):
+        with open(filepath, "w", encoding="utf-8", newline="\n") as f:
+            json.dump(self.report(), f, sort_keys=True, indent=2, separators=(',', ': '))
@@ -0,0 +1,142 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import time
+import queue
+import threading
+import traceback
+
+
+# Record of the work items that failed, saved as a jsonl file: one line per failure with the stage, the URL (or
+# the name of the card), the error and the traceback when there is one.
+# The file is only created when something fails, and the file of a previous run is removed.
+class DeadLetters:
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.lock = threading.Lock()
+        self.file = None
+        # Number of failures of every stage.
+        self.counts = {}
+
+        if os.path.exists(filepath):
+            os.remove(filepath)
+
+    # Record a failure. When error is None, the exception being handled is recorded with its traceback.
+    def add(self, stage, item, error=None):
+        record = {'stage': stage, 'item': item, 'time': time.time()}
+        if error is None:
+            record['error'] = traceback.format_exc().strip().splitlines()[-1]
+            record['traceback'] = traceback.format_exc()
+        else:
+            record['error'] = error
+
+        line = json.dumps(record, ensure_ascii=False, sort_keys=True)
+        with self.lock:
+            if self.file is None:
+                self.file = open(self.filepath, 'w', encoding='utf-8', newline='\n')
+            self.file.write(line + '\n')
+            self.file.flush()
+            self.counts[stage] = self.counts.get(stage, 0) + 1
+
+        print("Failed %s: %s (%s)" % (stage, item, record['error']))
+
+    # Total number of failures.
+    @property
+    def count(self):
+        with self.lock:
+            return sum(self.counts.values())
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+
+    # Print the number of failures of every stage and where they are saved.
+    def printReport(self):
+        with self.lock:
+            if not self.counts:
+                return
+            counts = ", ".join("%s %s" % (count, stage) for stage, count in sorted(self.counts.items()))
+        print("Failures: %s, saved to: %s" % (counts, self.filepath))
+
+
+# Keep the worker threads of the crawl alive, wait for their queues with a deadline and stop them.
+# The workers catch their own failures, but if one still dies, a new one is started in its place so the throughput
+# of the pool doesn't drop.
+# Every worker takes its work from a queue and returns when it gets a None from it, after calling task_done.
+class Supervisor:
+    # interval is the number of seconds between two checks of the workers.
+    def __init__(self, interval=1.0):
+        self.interval = interval
+        # (factory, workQueue, thread) of every worker.
+        self.workers = []
+        self.respawned = 0
+
+    # Start count workers taking their work from workQueue. factory returns a new, not started, thread.
+    def start(self, factory, workQueue, count):
+        for i in range(count):
+            self.workers.append((factory, workQueue, self.spawn(factory)))
+
+    def spawn(self, factory):
+        thread = factory()
+        thread.start()
+        return thread
+
+    # Replace the workers that died.
+    def check(self):
+        for index, (factory, workQueue, thread) in enumerate(self.workers):
+            if not thread.is_alive():
+                print("Restarting a dead worker: %s" % thread.name)
+                self.workers[index] = (factory, workQueue, self.spawn(factory))
+                self.respawned += 1
+
+    # Stop every worker and wait for them. The workers started last are stopped first, so the consumers of a queue
+    # are started before its producers and stopped after them.
+    # The work still queued is done first, unless discard is set: then it's dropped.
+    def stop(self, discard=False):
+        workers = self.workers
+        # Nothing is restarted from now on.
+        self.workers = []
+
+        queues = []
+        for factory, workQueue, thread in reversed(workers):
+            if workQueue not in queues:
+                queues.append(workQueue)
+
+        for workQueue in queues:
+            threads = [thread for factory, threadQueue, thread in workers if threadQueue is workQueue]
+            if discard:
+                discardQueue(workQueue)
+            for thread in threads:
+                workQueue.put(None)
+            for thread in threads:
+                thread.join()
+
+    # Block until every task of the queue is done, like Queue.join, or until deadline (a time.monotonic() value,
+    # or None to wait as long as needed). Return False if the deadline was reached first.
+    def join(self, workQueue, deadline=None):
+        while True:
+            with workQueue.all_tasks_done:
+                if not workQueue.unfinished_tasks:
+                    return True
+
+                timeout = self.interval
+                if deadline is not None:
+                    timeout = min(timeout, deadline - time.monotonic())
+                    if timeout <= 0:
+                        return False
+                workQueue.all_tasks_done.wait(timeout)
+
+            self.check()
+
+
+# Remove every item of the queue without processing it.
+def discardQueue(workQueue):
+    while True:
+        try:
+            workQueue.get_nowait()
+        except queue.Empty:
+            return
+        workQueue.task_done()
@@ -0,0 +1,85 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import os.path
+import json
+import copy
+import threading
+
+import gwentifyHandler as siteHandler
+
+
+# Remember the fingerprint of every row of the table view between the runs.
+# When the row of a card didn't change since the last run, the card saved by the last run is reused with the fields
+# of the row applied to it, and the page of the card isn't downloaded at all.
+class TableIndex:
+    # Default name for the index. Start with dot for making it hidden on linux.
+    FILE_NAME = ".table_index"
+
+    # previousCards maps the key of every card saved by the last run to the card.
+    def __init__(self, previousCards):
+        self.previousCards = previousCards
+        self.lock = threading.Lock()
+        # Fingerprint and key of every url, saved by the last run and for the current run.
+        self.savedIndex = self.loadIndex()
+        self.currentIndex = {}
+        # Fingerprint of the rows whose card is being downloaded, until we know their key.
+        self.pendingRows = {}
+        self.reused = 0
+
+    # Return a copy of the last saved card if the row didn't change, otherwise None.
+    # When None is returned, the page of the card must be downloaded and setKey called once it's parsed.
+    def getUnchangedCard(self, row):
+        saved = self.savedIndex.get(row['url'])
+
+        with self.lock:
+            if saved and saved['fingerprint'] == row['fingerprint'] and saved['key'] in self.previousCards:
+                self.currentIndex[row['url']] = saved
+                self.reused += 1
+
+                cardData = copy.deepcopy(self.previousCards[saved['key']])
+                siteHandler.applyTableFields(cardData, row['fields'])
+                return cardData
+
+            self.pendingRows[row['url']] = row['fingerprint']
+            return None
+
+    # Record the key of a card downloaded from url.
+    def setKey(self, url, key):
+        with self.lock:
+            fingerprint = self.pendingRows.pop(url, None)
+            if fingerprint is not None:
+                self.currentIndex[url] = {'fingerprint': fingerprint, 'key': key}
+
+    # Record the key of a card crawled from row by an interrupted run, resumed from its journal.
+    def addRow(self, row, key):
+        with self.lock:
+            self.currentIndex[row['url']] = {'fingerprint': row['fingerprint'], 'key': key}
+
+    # Load a previously saved index file. Return an empty index if there is none.
+    def loadIndex(self):
+        filepath = os.path.join('./' + self.FILE_NAME)
+        try:
+            with open(filepath, 'r', encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    # Save the index of the current run.
+    def saveIndex(self):
+        filepath = os.path.join('./' + self.FILE_NAME)
+        with open(filepath, "w", encoding="utf-8", newline="\n") as f:
+            json.dump(self.currentIndex, f, ensure_ascii=False, sort_keys=True, indent=2, separators=(',', ': '))
+
+    # Load the cards saved by the last run in a jsonl file. Return a map of the key of every card to the card.
+    @staticmethod
+    def loadCards(filepath):
+        cards = {}
+        try:
+            with open(filepath, 'r', encoding="utf-8") as f:
+                for line in f:
+                    cardData = json.loads(line)
+                    cards[cardData['key']] = cardData
+        except FileNotFoundError:
+            pass
+        return cards
@@ -0,0 +1,246 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import os
+import re
+import sys
+import json
+import math
+import time
+import argparse
+
+from unidecode import unidecode
+
+import indexer
+
+# Index saved by the crawler by default, next to its output.
+DEFAULT_PATH = os.path.join('.', 'output', 'latest.text.json')
+
+# Fields of the cards that are indexed, with the weight of their matches in the score.
+# The text of the ability of a card matters more than its flavor text.
+FIELDS = {
+    'info': 1.0,
+    'flavor': 0.5
+}
+
+# Parameters of the BM25 ranking.
+K1 = 1.2
+B = 0.75
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+QUERY_PATTERN = re.compile(r'"([^"]*)"|(\S+)')
+
+
+# Return the terms of text: lowercase words without accents, with the same unidecode folding as the keys of the
+# cards (see arachas.getNameKey). "Unit’s Resilience" gives ['unit', 's', 'resilience'].
+def tokenize(text):
+    return TOKEN_PATTERN.findall(unidecode(text.lower()))
+
+
+# Split a query into its keywords and its phrases, written between double quotes.
+# 'Resilience "from your Deck"' gives (['resilience'], [['from', 'your', 'deck']]).
+def parseQuery(query):
+    keywords = []
+    phrases = []
+    for phrase, word in QUERY_PATTERN.findall(query):
+        if phrase:
+            terms = tokenize(phrase)
+            if len(terms) > 1:
+                phrases.append(terms)
+            else:
+                keywords.extend(terms)
+        else:
+            keywords.extend(tokenize(word))
+    return keywords, phrases
+
+
+# Full-text index of the info and flavor text of the cards, an inverted index with the positions of every term, so
+# the phrases are matched without reading the cards. The results are ranked with BM25.
+# The index keeps the hash of the text of every card: update only tokenizes the cards whose text changed.
+#
+#     index = TextIndex.load('output/latest.text.json')
+#     index.search('Resilience')
+#     index.search('"from your Deck" Bronze')
+class TextIndex:
+    def __init__(self):
+        # For every card: the hash of its text, its text and the number of terms of every field.
+        self.cards = {}
+        # For every term and field, the positions of the term in the field of every card: {term: {field: {key: [i]}}}.
+        self.postings = {}
+        # Total number of terms of every field, for the average length of the fields.
+        self.lengths = {field: 0 for field in FIELDS}
+
+    # Load an index saved by save. Return an empty index if the file doesn't exist.
+    @staticmethod
+    def load(filepath=DEFAULT_PATH):
+        textIndex = TextIndex()
+        if os.path.exists(filepath):
+            with open(filepath, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            textIndex.cards = data['cards']
+            textIndex.postings = data['postings']
+            textIndex.lengths = data['lengths']
+        return textIndex
+
+    # The file is replaced at once, so a reader never finds half an index.
+    def save(self, filepath=DEFAULT_PATH):
+        tmpPath = filepath + ".tmp"
+        with open(tmpPath, 'w', encoding='utf-8', newline='\n') as f:
+            json.dump({'cards': self.cards, 'postings': self.postings, 'lengths': self.lengths}, f,
+                      ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+        os.replace(tmpPath, filepath)
+
+    # Index the cards, the whole output of a crawl. Only the cards whose text changed are tokenized again, and the
+    # cards missing from cards are removed. Return the number of cards added, changed and removed.
+    def update(self, cards):
+        counts = {'added': 0, 'changed': 0, 'removed': 0}
+        keys = set()
+        for card in cards:
+            key = card['key']
+            keys.add(key)
+            text = {field: card[field] for field in FIELDS if card.get(field)}
+            textHash = indexer.hashValue(text)
+
+            previous = self.cards.get(key)
+            if previous is not None:
+                if previous['hash'] == textHash:
+                    continue
+                self.removeCard(key)
+                counts['changed'] += 1
+            else:
+                counts['added'] += 1
+            self.addCard(key, text, textHash)
+
+        for key in set(self.cards) - keys:
+            self.removeCard(key)
+            counts['removed'] += 1
+        return counts
+
+    def addCard(self, key, text, textHash):
+        lengths = {}
+        for field, value in text.items():
+            terms = tokenize(value)
+            lengths[field] = len(terms)
+            self.lengths[field] += len(terms)
+            for position, term in enumerate(terms):
+                self.postings.setdefault(term, {}).setdefault(field, {}).setdefault(key, []).append(position)
+        self.cards[key] = {'hash': textHash, 'text': text, 'lengths': lengths}
+
+    def removeCard(self, key):
+        card = self.cards.pop(key)
+        for field, value in card['text'].items():
+            self.lengths[field] -= card['lengths'][field]
+            for term in set(tokenize(value)):
+                fieldPostings = self.postings[term][field]
+                fieldPostings.pop(key, None)
+                if not fieldPostings:
+                    del self.postings[term][field]
+                    if not self.postings[term]:
+                        del self.postings[term]
+
+    # Return the cards matching query, as (key, score) pairs from the best match, at most limit of them.
+    # The keywords of the query are ranked with BM25: a card matches any of them. The phrases, written between double
+    # quotes, must all be found in the card, with their words in that order.
+    # fields restricts the search to some of the FIELDS.
+    def search(self, query, limit=10, fields=None):
+        fields = fields or list(FIELDS)
+        keywords, phrases = parseQuery(query)
+
+        # Cards containing every phrase, in any of the fields.
+        required = None
+        for terms in phrases:
+            matches = set()
+            for field in fields:
+                matches |= self.findPhrase(terms, field)
+            required = matches if required is None else required & matches
+            if not required:
+                return []
+
+        scores = {}
+        for term in keywords + [term for terms in phrases for term in terms]:
+            for field in fields:
+                for key, score in self.scoreTerm(term, field, required).items():
+                    scores[key] = scores.get(key, 0.0) + score
+
+        results = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        return results[:limit] if limit else results
+
+    # Return the BM25 score of term in field for every card containing it, or only for the cards of keys.
+    def scoreTerm(self, term, field, keys=None):
+        fieldPostings = self.postings.get(term, {}).get(field)
+        if not fieldPostings:
+            return {}
+
+        count = len(self.cards)
+        averageLength = self.lengths[field] / count
+        idf = math.log(1 + (count - len(fieldPostings) + 0.5) / (len(fieldPostings) + 0.5))
+        if keys is not None:
+            keys = [key for key in keys if key in fieldPostings]
+        scores = {}
+        for key in fieldPostings if keys is None else keys:
+            frequency = len(fieldPostings[key])
+            length = self.cards[key]['lengths'][field]
+            scores[key] = FIELDS[field] * idf * frequency * (K1 + 1) / (
+                frequency + K1 * (1 - B + B * length / averageLength))
+        return scores
+
+    # Return the keys of the cards whose field contains the terms one after the other.
+    def findPhrase(self, terms, field):
+        termPostings = []
+        for term in terms:
+            fieldPostings = self.postings.get(term, {}).get(field)
+            if not fieldPostings:
+                return set()
+            termPostings.append(fieldPostings)
+
+        # Start from the rarest term, so the fewest cards are checked.
+        keys = set(min(termPostings, key=len))
+        for fieldPostings in termPostings:
+            keys &= fieldPostings.keys()
+
+        # A field has a few dozens of terms at most, the lists of positions are short.
+        matches = set()
+        for key in keys:
+            positions = [fieldPostings[key] for fieldPostings in termPostings]
+            if any(all(start + offset in positions[offset] for offset in range(1, len(terms)))
+                   for start in positions[0]):
+                matches.add(key)
+        return matches
+
+    def getText(self, key):
+        return self.cards[key]['text']
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Search the info and flavor text of the cards saved by arachas.py.')
+    parser.add_argument('query', help='Keywords, and phrases between double quotes: \'"from your Deck" Resilience\'.',
+                        nargs='?')
+    parser.add_argument('--file', help='Text index file.', default=DEFAULT_PATH, required=False)
+    parser.add_argument('--field', help='Only search this field.', choices=sorted(FIELDS), action='append',
+                        required=False)
+    parser.add_argument('--limit', help='Most cards printed, 0 for every match.', type=int, default=10,
+                        required=False)
+    parser.add_argument('--update', help='Index the cards of a jsonl output, only tokenizing the changed ones.',
+                        required=False)
+    args = parser.parse_args()
+
+    if args.update:
+        textIndex = TextIndex.load(args.file)
+        with open(args.update, 'r', encoding='utf-8') as f:
+            counts = textIndex.update(json.loads(line) for line in f)
+        textIndex.save(args.file)
+        print("Text index: %(added)s added, %(changed)s changed, %(removed)s removed" % counts)
+    elif args.query:
+        if not os.path.exists(args.file):
+            parser.error("Text index not found: %s" % args.file)
+        textIndex = TextIndex.load(args.file)
+        start = time.perf_counter()
+        results = textIndex.search(args.query, args.limit, args.field)
+        elapsed = time.perf_counter() - start
+
+        for key, score in results:
+            text = textIndex.getText(key)
+            print("%.3f\t%s\t%s" % (score, key, text.get('info') or text.get('flavor', '')))
+        print("%s cards in %.3f ms" % (len(results), elapsed * 1000), file=sys.stderr)
+    else:
+        parser.print_help()